@@ -1,17 +1,17 @@
 from flask import Flask, redirect, render_template, request, session, url_for
 from flask_bootstrap import Bootstrap
-from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
 from flask_login import LoginManager
 from flask_moment import Moment
 from elasticsearch import Elasticsearch
 from config import Config
+from .transactions import ReadReplicaSQLAlchemy
 
 # Flask-Bootstrap
 bootstrap = Bootstrap()
 
-# SQLAlchemy
-db = SQLAlchemy()
+# SQLAlchemy (read-only requests can use a read replica, see transactions.py)
+db = ReadReplicaSQLAlchemy()
 
 # Flask-Migrate
 migrate = Migrate()
@@ -38,7 +38,34 @@ def create_app(config_class=Config):
     # Elasticsearch
     app.elasticsearch = Elasticsearch([app.config['ELASTICSEARCH_URL']]) \
         if app.config['ELASTICSEARCH_URL'] else None
-
+    from .search import IndexingQueue
+    app.search_queue = IndexingQueue(
+        app.elasticsearch,
+        asynchronous=app.config['ELASTICSEARCH_ASYNC'],
+        batch_size=app.config['ELASTICSEARCH_BULK_SIZE']) \
+        if app.elasticsearch else None
+    # Database full-text search when Elasticsearch isn't set up
+    from .search import make_fulltext
+    app.fulltext = make_fulltext(app.config['SQLALCHEMY_DATABASE_URI']) \
+        if not app.elasticsearch and app.config['SEARCH_FALLBACK'] else None
+
+    # Server-side store for quizzes being taken
+    from .quiz_sessions import make_quiz_session_store
+    app.quiz_session_store = make_quiz_session_store(app.config)
+
+    # Cache for rendered parts of templates
+    from .fragment_cache import cached, make_fragment_cache
+    app.fragment_cache = make_fragment_cache(app.config)
+    app.jinja_env.globals['cached'] = cached
+
+    # Users' last seen times, written in bulk
+    from .last_seen import LastSeenTracker
+    app.last_seen = LastSeenTracker(
+        app, flush_interval=app.config['LAST_SEEN_FLUSH_INTERVAL'])
+
+    # Read-only routes and commit counts
+    from . import transactions
+    transactions.init_app(app, db)
 
     # Register blueprints
     from .admin import admin as admin_blueprint
@@ -6,7 +6,8 @@ from ..models import (Announcement, Assignment, Chapter, Class, ClassStudent,
                       Lesson, Module, Page, PageType, Permission, Post,
                       PostCategory, ProblemMistake, ProblemMistakeType,
                       QuestionAnswer, QuizAttempt, Role, Strand,
-                      StudentAssignment, Tag, User, UserAnswer, db)
+                      StudentAssignment, Tag, User, UserAnswer, db,
+                      page_types, question_types, quiz_types)
 from . import forms, views
 
 
@@ -24,4 +25,5 @@ def inject_models():
         Assignment=Assignment, StudentAssignment=StudentAssignment,
         ProblemMistake=ProblemMistake, ProblemMistakeType=ProblemMistakeType,
         QuestionAnswer=QuestionAnswer, UserAnswer=UserAnswer,
-        model_singulars=model_singulars)
\ No newline at end of file
+        page_types=page_types, question_types=question_types,
+        quiz_types=quiz_types, model_singulars=model_singulars)
\ No newline at end of file
@@ -5,15 +5,19 @@ Views for the admin interface.
 
 import json
 
-from flask import (abort, flash, jsonify, redirect, render_template, request,
-                   session, url_for)
+from flask import (abort, current_app, flash, jsonify, redirect,
+                   render_template, request, session, url_for)
 from flask_login import current_user, login_required
 
 from .. import db
+from ..curriculum import get_curriculum_tree, relink
+from ..progress import refresh_progress
+from ..transactions import read_only
 from ..models import (AnswerStatus, Chapter, Glossary, Hint, Lesson, Module,
                       Page, PageType, ProblemMistake, Project, ProjectStep,
                       Question, QuestionAnswer, QuestionOption, QuestionType,
-                      Quiz, Skill, Strand, UserAnswer, customTagMarkdown)
+                      Quiz, Skill, Strand, UserAnswer, customTagMarkdown,
+                      question_types)
 from . import admin
 from .forms import (EditLessonContent, NewChapter, NewGlossary, NewLesson,
                     NewModule, NewPage, NewProject, NewQuestion, NewQuiz,
@@ -53,9 +57,7 @@ def new_question():
     if form.validate_on_submit():
         # Figuring out the type of the question
         question_type = form.type.data
-        question_type_id = QuestionType.query.filter(
-            QuestionType.id == question_type
-        ).first().id
+        question_type_id = question_types.get(int(question_type)).id
         question = Question(text=form.text.data,
             question_type_id=question_type_id,
             max_attempts=form.max_attempts.data, skill_id=form.skill.data
@@ -70,14 +72,14 @@ def new_question():
                 text=hint_text.strip(), hint_no=i, question_id=question.id
             )
             db.session.add(hint)
-        question_type = question.question_type
+        question_type_id = question.question_type_id
 
         # Initialise option and answer variables
         question_answer = None
         options = request.form.getlist('options1')  # Returns list
                                                     # containing all
                                                     # the options
-        if question_type == QuestionType.query.filter_by(code='C').first():
+        if question_type_id == question_types.id('C'):
             # Multiple Choice
             for option in options:
                 db.session.add(
@@ -94,7 +96,7 @@ def new_question():
             question_answer = QuestionAnswer(
                 option=correct_option, question=question
             )
-        elif question_type == QuestionType.query.filter_by(code='D').first():
+        elif question_type_id == question_types.id('D'):
             # Drag and drop
             for option in options:
                 if option.startswith('img:'):
@@ -115,7 +117,7 @@ def new_question():
             question_answer = QuestionAnswer(
                 option=question_answer_option, question=question
                 )
-        elif question_type == QuestionType.query.filter_by(code='S').first():
+        elif question_type_id == question_types.id('S'):
             # Single Answer
             # Adds a dummy option so answer can be recorded
             question_option = QuestionOption(
@@ -179,6 +181,7 @@ def new_module():
             module.next_module_id = None # MySQL doesn't like 0
         db.session.add(module)
         db.session.commit()
+        relink(module)
         return redirect(url_for('admin.edit_module', id=module.id))
     return render_template('admin/admin_new_something.html', title="JCCoder - New Module", new_thing="Module", form=form)
 
@@ -199,6 +202,7 @@ def new_chapter():
             chapter.next_chapter_id = None # MySQL doesn't like 0
         db.session.add(chapter)
         db.session.commit()
+        relink(chapter)
         return redirect(url_for('admin.edit_chapter', id=chapter.id))
     return render_template('admin/admin_new_something.html', title="JCCoder - New Chapter", new_thing="Chapter", form=form)
 
@@ -226,6 +230,7 @@ def new_lesson():
             lesson.next_lesson_id = None # MySQL doesn't like 0
         db.session.add(lesson)
         db.session.commit()
+        relink(lesson)
         return redirect(url_for('admin.edit_lesson', id=lesson.id))
     return render_template('admin/admin_new_something.html', title="JCCoder - New Lesson", new_thing="Lesson", form=form)
 
@@ -260,6 +265,8 @@ def new_quiz():
             quiz.next_quiz_id = None # MySQL doesn't like 0
         db.session.add(quiz)
         db.session.commit()
+        relink(quiz)
+        refresh_progress([quiz.lesson.chapter_id])
         return redirect(url_for('admin.edit_quiz', id=quiz.id))
     return render_template('admin/admin_new_something.html', title="JCCoder - New Quiz", new_thing="Quiz", form=form)
 
@@ -295,6 +302,7 @@ def new_page():
 
         db.session.add(page)
         db.session.commit()
+        relink(page)
         return redirect(url_for('admin.edit_page', id=page.id))
     return render_template('admin/admin_new_something.html', title="JCCoder - New Page", new_thing="Page", form=form)
 
@@ -356,47 +364,38 @@ def all_strands():
 def all_modules():
     """View for displaying all modules."""
     modules = Module.query.all()
-    groups = Strand.query.all() # For displaying the modules grouped by strand
-    return render_template('admin/all_something.html', title="JCCoder - All Modules", list_items="Modules", items=modules, groups=groups)
+    curriculum = get_curriculum_tree()
+    groups = curriculum.strands # For displaying the modules grouped by strand
+    return render_template('admin/all_something.html', title="JCCoder - All Modules", list_items="Modules", items=modules, groups=groups, curriculum=curriculum)
 
 @admin.route('/all/chapter/')
 @login_required
 def all_chapters():
     """View for displaying all chapters."""
     chapters = Chapter.query.all()
-    groups = []
-    for strand in Strand.query.all():
-        groups.extend(strand.all_ordered_children())    # Gets modules
-                                                        # in order
-    return render_template('admin/all_something.html', title="JCCoder - All Chapters", list_items="Chapters", items=chapters, groups=groups)
+    curriculum = get_curriculum_tree()
+    groups = curriculum.modules()   # Gets modules in order
+    return render_template('admin/all_something.html', title="JCCoder - All Chapters", list_items="Chapters", items=chapters, groups=groups, curriculum=curriculum)
 
 @admin.route('/all/lesson/')
 @login_required
 def all_lessons():
     """View for displaying all lessons."""
     lessons = Lesson.query.all()
-    groups = []
-    for strand in Strand.query.all():
-        for module in strand.all_ordered_children(): # Returns ordered
-                                                     # modules
-            # Returns ordered chapters
-            groups.extend(module.all_ordered_children())
-    return render_template('admin/all_something.html', title="JCCoder - All Lessons", list_items="Lessons", items=lessons, groups=groups)
+    curriculum = get_curriculum_tree()
+    groups = curriculum.chapters()  # Returns ordered chapters
+    return render_template('admin/all_something.html', title="JCCoder - All Lessons", list_items="Lessons", items=lessons, groups=groups, curriculum=curriculum)
 
 @admin.route('/all/quiz/')
 @login_required
 def all_quizzes():
     """View for displaying all quizzes."""
     quizzes = Quiz.query.all()
-    groups = []
 
-    # Similar technique used to order all the lessons for grouping the
-    # quizzes by lesson
-    for strand in Strand.query.all():
-        for module in strand.all_ordered_children():
-            for chapter in module.all_ordered_children():
-                groups.extend(chapter.all_ordered_children())
-    return render_template('admin/all_something.html', title="JCCoder - All Quizzes", list_items="Quizzes", items=quizzes, groups=groups)
+    # All the lessons in order for grouping the quizzes by lesson
+    curriculum = get_curriculum_tree()
+    groups = curriculum.lessons()
+    return render_template('admin/all_something.html', title="JCCoder - All Quizzes", list_items="Quizzes", items=quizzes, groups=groups, curriculum=curriculum)
 
 @admin.route('/all/question/')
 @login_required
@@ -418,15 +417,11 @@ def all_glossaries():
 def all_pages():
     """View for displaying all pages."""
     pages = Page.query.all()
-    groups = []
 
-    # Similar technique used to order all the lessons for grouping the
-    # pages by lesson
-    for strand in Strand.query.all():
-        for module in strand.all_ordered_children():
-            for lesson in module.all_ordered_children():
-                groups.extend(lesson.all_ordered_children())
-    return render_template('admin/all_something.html', title="JCCoder - All Pages", list_items="Pages", items=pages, groups=groups)
+    # All the lessons in order for grouping the pages by lesson
+    curriculum = get_curriculum_tree()
+    groups = curriculum.lessons()
+    return render_template('admin/all_something.html', title="JCCoder - All Pages", list_items="Pages", items=pages, groups=groups, curriculum=curriculum)
 
 @admin.route('/all/skill/')
 @login_required
@@ -434,12 +429,9 @@ def all_skills():
     """View for displaying all skills."""
     skills = Skill.query.all()
 
-    groups = []
-    for strand in Strand.query.all():
-        for module in strand.all_ordered_children():
-            for lesson in module.all_ordered_children():
-                groups.extend(lesson.all_ordered_children())
-    return render_template('admin/all_something.html', title="JCCoder - All Skills", list_items="Skills", items=skills, groups=groups)
+    curriculum = get_curriculum_tree()
+    groups = curriculum.lessons()
+    return render_template('admin/all_something.html', title="JCCoder - All Skills", list_items="Skills", items=skills, groups=groups, curriculum=curriculum)
 
 @admin.route('/all/project/')
 @login_required
@@ -447,12 +439,9 @@ def all_projects():
     """View for displaying all projects."""
     projects = Project.query.all()
 
-    groups = []
-    for strand in Strand.query.all():
-        for module in strand.all_ordered_children():
-            for lesson in module.all_ordered_children():
-                groups.extend(lesson.all_ordered_children())
-    return render_template('admin/all_something.html', title="JCCoder - All Projects", list_items="Projects", items=projects, groups=groups)
+    curriculum = get_curriculum_tree()
+    groups = curriculum.lessons()
+    return render_template('admin/all_something.html', title="JCCoder - All Projects", list_items="Projects", items=projects, groups=groups, curriculum=curriculum)
 
 @admin.route('/all/problem-mistakes')
 @login_required
@@ -537,6 +526,7 @@ def edit_module(id):
     module = Module.query.get_or_404(id)
     form = NewModule()
     if form.validate_on_submit():
+        old_strand_id = module.strand_id
         module.title = form.title.data
         module.description = form.description.data
         module.strand_id = form.strand.data
@@ -547,6 +537,7 @@ def edit_module(id):
             module.next_module_id = None # MySQL doesn't like 0
         db.session.add(module)
         db.session.commit()
+        relink(module, old_strand_id)
         return redirect(url_for('.edit_module', id=module.id))
     form.title.data = module.title
     form.description.data = module.description
@@ -564,6 +555,7 @@ def edit_chapter(id):
     chapter = Chapter.query.get_or_404(id)
     form = NewChapter()
     if form.validate_on_submit():
+        old_module_id = chapter.module_id
         chapter.title = form.title.data
         chapter.name = form.name.data
         chapter.image_url = form.image_url.data
@@ -576,6 +568,7 @@ def edit_chapter(id):
             chapter.next_chapter_id = None # MySQL doesn't like 0
         db.session.add(chapter)
         db.session.commit()
+        relink(chapter, old_module_id)
         return redirect(url_for('.edit_chapter', id=chapter.id))
     form.title.data = chapter.title
     form.name.data = chapter.name
@@ -595,6 +588,7 @@ def edit_lesson(id):
     lesson = Lesson.query.get_or_404(id)
     form = NewLesson()
     if form.validate_on_submit():
+        old_chapter_id = lesson.chapter_id
         lesson.title = form.title.data
         lesson.type_id = form.lesson_type.data
         lesson.overview = form.overview.data    
@@ -609,6 +603,7 @@ def edit_lesson(id):
             lesson.next_lesson_id = None # MySQL doesn't like 0
         db.session.add(lesson)
         db.session.commit()
+        relink(lesson, old_chapter_id)
         return redirect(url_for('.edit_lesson', id=lesson.id))
     form.title.data = lesson.title
     form.lesson_type.data = lesson.type_id
@@ -670,6 +665,7 @@ def edit_page(id):
     page = Page.query.get_or_404(id)
     form = NewPage()
     if form.validate_on_submit():
+        old_lesson_id = page.lesson_id
         page.page_type_id = form.page_type.data
         page.title = form.title.data
         page.text = form.content.data
@@ -681,6 +677,7 @@ def edit_page(id):
         page.lesson_id = form.lesson.data
         db.session.add(page)
         db.session.commit()
+        relink(page, old_lesson_id)
         return redirect(url_for('.edit_page', id=page.id))
     form.page_type.data = page.page_type_id
     form.title.data = page.title
@@ -699,6 +696,8 @@ def edit_quiz(id):
     quiz = Quiz.query.get_or_404(id)
     form = NewQuiz(editing=True)
     if form.validate_on_submit():
+        old_lesson_id = quiz.lesson_id
+        old_chapter_id = quiz.lesson.chapter_id if quiz.lesson else None
         quiz.type_id = form.quiz_type.data
         quiz.description = form.description.data
         quiz.no_questions = form.no_questions.data
@@ -710,6 +709,8 @@ def edit_quiz(id):
         quiz.lesson_id = form.lesson.data
         db.session.add(quiz)
         db.session.commit()
+        relink(quiz, old_lesson_id)
+        refresh_progress([old_chapter_id, Lesson.query.get(quiz.lesson_id).chapter_id])
         return redirect(url_for('.edit_quiz', id=quiz.id))
     form.quiz_type.data = quiz.type_id
     form.description.data = quiz.description
@@ -738,7 +739,7 @@ def edit_question(id):
         original_options = question.options.all()   # Store the
                                                     # original options
 
-        if question.question_type_id == QuestionType.query.filter_by(code='D').first().id:
+        if question.question_type_id == question_types.id('D'):
             # To add the extra option (the option that is a dummy
             # option) that contains the answer
             options.append(question.correct_answer())
@@ -765,11 +766,11 @@ def edit_question(id):
         db.session.commit()
 
         # Modifying the correct answer
-        if question.question_type_id == QuestionType.query.filter_by(code='C').first().id:
+        if question.question_type_id == question_types.id('C'):
             # Multiple Choice
             question.answer.first().option_id = question.options.all()[
                 int(form.answer.data) - 1].id
-        elif question.question_type_id == QuestionType.query.filter_by(code='M').first().id:
+        elif question.question_type_id == question_types.id('M'):
             # Multiple Answer
 
             # Like options, get answer(s) and original answer(s)
@@ -830,9 +831,9 @@ def edit_question(id):
         options[i] = option.text
 
     # Correct answer
-    if question.question_type_id == QuestionType.query.filter_by(code='C').first().id:
+    if question.question_type_id == question_types.id('C'):
         form.answer.data = options.index(question.correct_answer()) + 1
-    elif question.question_type_id == QuestionType.query.filter_by(code='M').first().id:
+    elif question.question_type_id == question_types.id('M'):
         # Joins a comma between different options
         form.answer.data = ", ".join([
             str(question.options.all().index(answer.option) + 1)
@@ -851,7 +852,7 @@ def edit_question(id):
     form.max_attempts.data = question.max_attempts
     form.skill.data = question.skill_id
 
-    if question.question_type_id == QuestionType.query.filter_by(code='S').first().id:
+    if question.question_type_id == question_types.id('S'):
         # Single Answer has no real options, set to a list to avoid
         # type errors
         options = [None]
@@ -907,6 +908,7 @@ def close_problem_mistake(id):
     problem_mistake = ProblemMistake.query.get_or_404(id)
     problem_mistake.is_closed = True
     db.session.add(problem_mistake)
+    db.session.commit()
     flash('The issue is now closed.', 'success')
     return redirect(url_for('.open_problem_mistakes'))
 
@@ -916,6 +918,7 @@ def reopen_problem_mistake(id):
     problem_mistake = ProblemMistake.query.get_or_404(id)
     problem_mistake.is_closed = False
     db.session.add(problem_mistake)
+    db.session.commit()
     flash('The issue has been reopened.', 'danger')
     return redirect(url_for('.open_problem_mistakes'))
 
@@ -947,3 +950,11 @@ def preview_project():
 </div>""".format(step.get('title', 'None'), customTagMarkdown(step.get('content', 'None')))
 
     return jsonify(success=True, previewHTML=preview_html)
+
+@admin.route('/commit-counts')
+@read_only
+def commit_counts():
+    """Database commits made by each route since the process started (for
+    checking read-only routes don't commit).
+    """
+    return jsonify(success=True, commits=current_app.commit_counter.counts())
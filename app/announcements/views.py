@@ -119,6 +119,7 @@ def public(id):
 
     # Change status of announcement
     announcement.published = True
+    db.session.commit()
 
     # Flash a message that says that the announcement is public.
     flash("Your announcement is now public.", 'info')
@@ -137,6 +138,7 @@ def draft(id):
 
     # Change status of announcement
     announcement.published = False
+    db.session.commit()
 
     # Flash a message that says that the announcement is a draft
     flash("Your announcement is now a draft.", 'info')
@@ -164,6 +166,7 @@ def edit(id):
         announcement.tags = parseMultipleAnnouncement(form)
         announcement.published = form.published.data
         announcement.date_posted = datetime.utcnow()
+        db.session.commit()
 
         # Redirect the user to the page with the announcement in it
         return redirect(url_for('.permalink', id=id))
@@ -192,4 +195,4 @@ def search():
         if total > page * current_app.config["POSTS_PER_PAGE"] else None
     prev_url = url_for('.search', q=q, page=page - 1) \
         if page > 1 else None
-    return render_template('announcements/search_results.html', title="Search results for \"{0}\"".format(q), q=q, announcements=announcements.all(), total=total, prev_url=prev_url, next_url=next_url)
\ No newline at end of file
+    return render_template('announcements/search_results.html', title="Search results for \"{0}\"".format(q), q=q, announcements=announcements, total=total, prev_url=prev_url, next_url=next_url)
\ No newline at end of file
@@ -1,6 +1,6 @@
 from flask import flash, redirect, render_template, request, url_for
 from flask_login import current_user, login_required, login_user, logout_user
-from app.models import User, Role
+from app.models import User, roles_lookup
 from app import db
 from .forms import LoginForm, RegistrationForm
 from . import auth
@@ -51,8 +51,8 @@ def register_59261306():
 
     if form.validate_on_submit():
         under_13 = True if form.check_email.data == 'over_13' else False
-        role = Role.query.filter_by(name="Student").first() if form.user_type.data == 'student' else Role.query.filter_by(name="Teacher").first()
-        user = User(username=form.username.data, email=form.email.data, password=form.password.data, under_13=under_13, role=role)
+        role_id = roles_lookup.id("Student") if form.user_type.data == 'student' else roles_lookup.id("Teacher")
+        user = User(username=form.username.data, email=form.email.data, password=form.password.data, under_13=under_13, role_id=role_id)
         db.session.add(user)
         db.session.commit()
         login_user(user, False)
@@ -0,0 +1,192 @@
+"""app/curriculum.py
+
+Materialised ordering of the curriculum (Strand -> Module -> Chapter ->
+Lesson -> Page/Quiz). The `next_*` links are still the source of truth
+for the order, but every node also stores its `position` among its
+siblings so that the whole tree can be loaded in a fixed number of
+queries instead of following the links one lazy load at a time.
+"""
+
+from collections import defaultdict
+
+from flask import g
+from sqlalchemy.orm import defer
+
+from app import db
+from app.models import Chapter, Lesson, Module, Page, Quiz, Strand
+
+# Model: (column linking to the parent, column linking to the next sibling)
+ORDERED_MODELS = {
+    Module: ('strand_id', 'next_module_id'),
+    Chapter: ('module_id', 'next_chapter_id'),
+    Lesson: ('chapter_id', 'next_lesson_id'),
+    Page: ('lesson_id', 'next_page_id'),
+    Quiz: ('lesson_id', 'next_quiz_id'),
+}
+
+# Model: long text columns the tree doesn't show (only loaded if used)
+UNSHOWN_COLUMNS = {
+    Lesson: ('overview', 'overview_html'),
+    Page: ('text', 'html'),
+}
+
+
+def order_linked(nodes, next_key):
+    """Orders a list of sibling nodes by following their next links.
+
+    Walks the chain iteratively so long chains can't hit the recursion
+    limit. Nodes that can't be reached from a head (e.g. a broken or
+    circular chain) are added to the end in id order rather than lost.
+
+    Paramaters
+    ----------
+    nodes : list
+        Objects (or rows) with an `id` and a next link attribute
+    next_key : str
+        Name of the attribute holding the id of the next sibling
+
+    Returns
+    -------
+    Ordered nodes : list
+    """
+    by_id = {node.id: node for node in nodes}
+    linked_to = {getattr(node, next_key) for node in nodes}
+    heads = sorted((node for node in nodes if node.id not in linked_to),
+                   key=lambda node: node.id)
+    ordered = []
+    seen = set()
+    for node in heads:
+        while node is not None and node.id not in seen:
+            ordered.append(node)
+            seen.add(node.id)
+            node = by_id.get(getattr(node, next_key))
+    ordered.extend(sorted((node for node in nodes if node.id not in seen),
+                          key=lambda node: node.id))
+    return ordered
+
+
+def update_positions(model, parent_id):
+    """Recalculates `position` for every child of one parent.
+
+    Must be called whenever the next links of `model` under `parent_id`
+    change. The caller is responsible for committing.
+    """
+    parent_key, next_key = ORDERED_MODELS[model]
+    siblings = model.query.filter(
+        getattr(model, parent_key) == parent_id).all()
+    for position, node in enumerate(order_linked(siblings, next_key)):
+        if node.position != position:
+            node.position = position
+            db.session.add(node)
+
+
+def relink(node, *old_parent_ids):
+    """Updates positions after `node` has been added, moved or relinked.
+
+    Any parents the node used to belong to should be passed so that
+    their remaining children are renumbered as well.
+    """
+    parent_key = ORDERED_MODELS[type(node)][0]
+    parent_ids = {getattr(node, parent_key)}
+    parent_ids.update(old_parent_ids)
+    for parent_id in parent_ids:
+        if parent_id is not None:
+            update_positions(type(node), parent_id)
+    db.session.commit()
+    invalidate_curriculum_tree()
+
+
+def rebuild_positions():
+    """Utility method to recalculate the position of every node."""
+    for model, (parent_key, next_key) in ORDERED_MODELS.items():
+        groups = defaultdict(list)
+        for node in model.query:
+            groups[getattr(node, parent_key)].append(node)
+        for siblings in groups.values():
+            for position, node in enumerate(order_linked(siblings, next_key)):
+                node.position = position
+                db.session.add(node)
+    db.session.commit()
+    invalidate_curriculum_tree()
+
+
+class CurriculumTree(object):
+    """The whole curriculum loaded in one query per level.
+
+    Children are looked up in memory with `children(node)` (modules of a
+    strand, chapters of a module, lessons of a chapter or pages of a
+    lesson) and `quizzes(lesson)`.
+
+    Each level is only loaded the first time it is used, so a template
+    whose output has been cached (see fragment_cache.py) doesn't load
+    anything.
+    """
+
+    def __init__(self):
+        self._strands = None
+        self._children = {}
+
+    @property
+    def strands(self):
+        if self._strands is None:
+            self._strands = Strand.query.order_by(Strand.id).all()
+        return self._strands
+
+    def _lookup(self, model, parent):
+        if model not in self._children:
+            parent_key = ORDERED_MODELS[model][0]
+            groups = defaultdict(list)
+            nodes = model.query \
+                .options(*[defer(column)
+                           for column in UNSHOWN_COLUMNS.get(model, ())]) \
+                .order_by(getattr(model, parent_key), model.position,
+                          model.id)
+            for node in nodes:
+                groups[getattr(node, parent_key)].append(node)
+            self._children[model] = groups
+        return list(self._children[model].get(parent.id, []))
+
+    def children(self, node):
+        """Returns the ordered children of a strand, module, chapter or
+        lesson (pages).
+        """
+        if isinstance(node, Strand):
+            return self._lookup(Module, node)
+        if isinstance(node, Module):
+            return self._lookup(Chapter, node)
+        if isinstance(node, Chapter):
+            return self._lookup(Lesson, node)
+        if isinstance(node, Lesson):
+            return self._lookup(Page, node)
+        return []
+
+    def quizzes(self, lesson):
+        """Returns the ordered quizzes of a lesson."""
+        return self._lookup(Quiz, lesson)
+
+    def modules(self):
+        """All modules, ordered by strand."""
+        return [module for strand in self.strands
+                for module in self.children(strand)]
+
+    def chapters(self):
+        """All chapters, ordered by strand and module."""
+        return [chapter for module in self.modules()
+                for chapter in self.children(module)]
+
+    def lessons(self):
+        """All lessons, ordered by strand, module and chapter."""
+        return [lesson for chapter in self.chapters()
+                for lesson in self.children(chapter)]
+
+
+def get_curriculum_tree():
+    """Returns the curriculum tree, loaded at most once per request."""
+    if 'curriculum_tree' not in g:
+        g.curriculum_tree = CurriculumTree()
+    return g.curriculum_tree
+
+
+def invalidate_curriculum_tree():
+    """Drops the tree cached for the current request."""
+    g.pop('curriculum_tree', None)
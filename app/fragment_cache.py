@@ -0,0 +1,275 @@
+"""app/fragment_cache.py
+
+Caches rendered HTML (parts of templates or whole pages) that only
+changes when content such as the curriculum is edited. In a template:
+
+    {% call cached('strands') %}
+        ... expensive part of the template ...
+    {% endcall %}
+
+The cached HTML is kept per role (so admins and students never see each
+other's version) and per generation of each dependency it is built from.
+When a model that a dependency is made of is committed, the dependency's
+generation changes and every fragment built from it is rebuilt the next
+time it is used.
+
+The backend is chosen with the `FRAGMENT_CACHE` config variable:
+
+    'memory'  An LRU cache in each process (default). Only edits made
+              through the same process are seen, so use 'file' when
+              running several worker processes
+    'file'    A file per fragment in `FRAGMENT_CACHE_DIR`, shared by
+              every process on the machine
+    'none'    No caching
+"""
+
+import hashlib
+import os
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from flask import current_app
+from flask_login import current_user
+from markupsafe import Markup
+
+from app import db
+from app.models import (Chapter, Class, Lesson, Module, Page, Quiz, Skill,
+                        Strand, TeacherNote)
+
+# Dependency: models it is made of
+DEPENDENCIES = {
+    'curriculum': (Strand, Module, Chapter),
+    'content': (Lesson, Page, Quiz, Skill),
+    'teacher_notes': (TeacherNote, Class),
+}
+
+
+class MemoryFragmentCache(object):
+    """Keeps the `max_entries` most recently used fragments in memory."""
+
+    shared = False  # Each process has its own
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self._fragments = OrderedDict()
+        self._generations = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            html = self._fragments.get(key)
+            if html is not None:
+                self._fragments.move_to_end(key)
+            return html
+
+    def set(self, key, html):
+        with self._lock:
+            self._fragments[key] = html
+            self._fragments.move_to_end(key)
+            while len(self._fragments) > self.max_entries:
+                self._fragments.popitem(last=False)
+
+    def generation(self, dependency):
+        with self._lock:
+            return self._generations.setdefault(dependency, uuid.uuid4().hex)
+
+    def invalidate(self, dependency):
+        with self._lock:
+            self._generations[dependency] = uuid.uuid4().hex
+
+    def clear(self):
+        with self._lock:
+            self._fragments.clear()
+            self._generations.clear()
+
+
+class FileFragmentCache(object):
+    """Keeps each fragment in its own file. The generations are kept in
+    files as well so an edit made through one process is seen by all of
+    them.
+
+    Every invalidation leaves the fragments of the old generation behind,
+    so fragments written more than `max_age` seconds ago are deleted
+    (every `max_age / 4` seconds at most, when a fragment is written or
+    a dependency invalidated). Ones still in use are simply rebuilt.
+    """
+
+    shared = True
+
+    def __init__(self, directory, max_age=24 * 60 * 60):
+        self.directory = directory
+        self.max_age = max_age
+        self._next_prune = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _read(self, name):
+        try:
+            with open(self._path(name), encoding='utf-8') as f:
+                return f.read()
+        except IOError:
+            return None
+
+    def _write(self, name, text):
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(text)
+        os.replace(temp_path, self._path(name))
+
+    def get(self, key):
+        return self._read(key + '.html')
+
+    def set(self, key, html):
+        self._write(key + '.html', html)
+        self._prune_if_due()
+
+    def generation(self, dependency):
+        generation = self._read(dependency + '.generation')
+        if generation is None:
+            generation = uuid.uuid4().hex
+            self._write(dependency + '.generation', generation)
+        return generation
+
+    def invalidate(self, dependency):
+        self._write(dependency + '.generation', uuid.uuid4().hex)
+        self._prune_if_due()
+
+    def prune(self):
+        """Deletes fragments (and unfinished writes) older than
+        `max_age`.
+        """
+        oldest = time.time() - self.max_age
+        for name in os.listdir(self.directory):
+            if not name.endswith(('.html', '.tmp')):
+                continue
+            path = self._path(name)
+            try:
+                if os.path.getmtime(path) < oldest:
+                    os.remove(path)
+            except OSError:
+                pass    # Removed by another process
+
+    def _prune_if_due(self):
+        with self._lock:
+            now = time.time()
+            if now < self._next_prune:
+                return
+            self._next_prune = now + self.max_age / 4
+        self.prune()
+
+    def clear(self):
+        for name in os.listdir(self.directory):
+            try:
+                os.remove(self._path(name))
+            except OSError:
+                pass
+
+
+def make_fragment_cache(config):
+    """Creates the cache selected by `config['FRAGMENT_CACHE']` (None if
+    caching is turned off).
+    """
+    backend = config.get('FRAGMENT_CACHE', 'memory')
+    if backend == 'memory':
+        return MemoryFragmentCache(config.get('FRAGMENT_CACHE_SIZE', 256))
+    if backend == 'file':
+        return FileFragmentCache(config['FRAGMENT_CACHE_DIR'],
+                                 config.get('FRAGMENT_CACHE_MAX_AGE',
+                                            24 * 60 * 60))
+    if backend in (None, 'none'):
+        return None
+    raise ValueError('Unknown fragment cache {0!r}'.format(backend))
+
+
+def fragment_key(cache, name, vary, depends):
+    """Returns the key of a fragment for the current user's role."""
+    role_id = current_user.role_id if current_user.is_authenticated else None
+    generations = [cache.generation(dependency) for dependency in depends]
+    parts = (name, role_id, tuple(vary), generations)
+    return hashlib.sha1(repr(parts).encode('utf-8')).hexdigest()
+
+
+def cached(name, *vary, depends=('curriculum',), shared_only=False,
+           caller=None):
+    """Returns the HTML made by `caller()` from the cache, rendering and
+    caching it first if it isn't there.
+
+    Paramaters
+    ----------
+    name : str
+        Name of the fragment
+    *vary
+        Any other values the HTML depends on (it is cached separately
+        for each)
+    depends : iterable
+        Names of the dependencies (see `DEPENDENCIES`) the HTML is
+        built from
+    shared_only : bool
+        Only cache the HTML if the backend is shared by every process
+        (default False). For HTML whose dependencies are invalidated by
+        whichever process handles a request, like students' scores, as
+        the other processes would keep showing the old version
+    caller : callable
+        Renders the HTML. Given by Jinja for `{% call cached(...) %}`
+
+    Returns
+    -------
+    HTML : Markup
+    """
+    cache = current_app.fragment_cache
+    if cache is None or (shared_only and not cache.shared):
+        return Markup(caller())
+    key = fragment_key(cache, name, vary, depends)
+    html = cache.get(key)
+    if html is None:
+        html = str(caller())
+        cache.set(key, html)
+    return Markup(html)
+
+
+def invalidate(*dependencies):
+    """Makes every fragment built from `dependencies` be rebuilt."""
+    cache = current_app.fragment_cache
+    if cache is not None:
+        for dependency in dependencies:
+            cache.invalidate(dependency)
+
+
+def invalidate_on_commit(*dependencies):
+    """Invalidates `dependencies` once the current transaction has been
+    committed (for changes the session can't see, like bulk inserts).
+    """
+    db.session.info.setdefault('fragment_dependencies', set()) \
+        .update(dependencies)
+
+
+def after_flush(session, flush_context):
+    """Records which dependencies the flushed objects belong to."""
+    changed = session.info.setdefault('fragment_dependencies', set())
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        for dependency, models in DEPENDENCIES.items():
+            if isinstance(obj, models):
+                changed.add(dependency)
+
+
+def after_commit(session):
+    """Invalidates the dependencies changed in the transaction."""
+    changed = session.info.pop('fragment_dependencies', None)
+    if changed:
+        invalidate(*changed)
+
+
+def after_rollback(session):
+    """Forgets the recorded changes."""
+    session.info.pop('fragment_dependencies', None)
+
+
+db.event.listen(db.session, 'after_flush', after_flush)
+db.event.listen(db.session, 'after_commit', after_commit)
+db.event.listen(db.session, 'after_rollback', after_rollback)
@@ -0,0 +1,124 @@
+"""app/gradebook.py
+
+The gradebook of a class: every student's best score in each assignment,
+the class average of each assignment and whether each student is still
+in the class, loaded with one aggregate query.
+
+The rendered gradebook is kept in the fragment cache (see
+fragment_cache.py) for each class until something it shows changes: a
+new score (from `main.summary`), a new assignment or a change to the
+class's students. Scores are saved by whichever process handles
+`main.summary`, so the gradebook is only cached by a backend shared by
+every process.
+"""
+
+from sqlalchemy import and_
+from sqlalchemy.sql.expression import func
+
+from app import db
+from app.fragment_cache import invalidate_on_commit
+from app.models import Assignment, ClassStudent, StudentAssignment, User
+
+
+def gradebook_dependency(class_id):
+    """Name of the fragment cache dependency for a class's gradebook."""
+    return 'gradebook-{0}'.format(class_id)
+
+
+def invalidate_gradebooks(*class_ids):
+    """Rebuilds the gradebooks of the classes once the current
+    transaction is committed.
+    """
+    invalidate_on_commit(*(gradebook_dependency(class_id)
+                           for class_id in class_ids))
+
+
+class Gradebook(object):
+    """Scores of a class's students in some of its assignments.
+
+    Attributes
+    ----------
+    students : list
+        A dictionary with the `id`, `username` and whether each student
+        is `active` (still in the class), in the order they joined
+    scores : dict
+        `{(student_id, assignment_id): best score}`, for the assignments
+        a student has been given (None if they haven't got a score yet)
+    averages : dict
+        `{assignment_id: average}` of the best scores of the students
+        with a score (rounded, missing if nobody has a score)
+    """
+
+    def __init__(self, class_id, assignment_ids):
+        assignment_ids = list(assignment_ids)
+        self.students = []
+        self.scores = {}
+        rows = db.session.query(
+            User.id, User.username, ClassStudent.student_status,
+            StudentAssignment.assignment_id,
+            func.max(StudentAssignment.score)) \
+            .select_from(ClassStudent) \
+            .join(User, User.id == ClassStudent.student_id) \
+            .outerjoin(StudentAssignment, and_(
+                StudentAssignment.student_id == ClassStudent.student_id,
+                StudentAssignment.assignment_id.in_(assignment_ids or [None]))) \
+            .filter(ClassStudent.class_id == class_id) \
+            .group_by(ClassStudent.id, User.id, User.username,
+                      ClassStudent.student_status,
+                      StudentAssignment.assignment_id) \
+            .order_by(ClassStudent.id)
+        totals = {}
+        seen = set()
+        for student_id, username, active, assignment_id, score in rows:
+            if student_id not in seen:
+                seen.add(student_id)
+                self.students.append({'id': student_id, 'username': username,
+                                      'active': active})
+            if assignment_id is None:
+                continue
+            score = int(score) if score is not None else None
+            self.scores[(student_id, assignment_id)] = score
+            if score is not None:
+                total, count = totals.get(assignment_id, (0, 0))
+                totals[assignment_id] = (total + score, count + 1)
+        self.averages = {assignment_id: int(round(total / count))
+                         for assignment_id, (total, count) in totals.items()}
+
+    def is_assigned(self, student_id, assignment_id):
+        return (student_id, assignment_id) in self.scores
+
+    def score(self, student_id, assignment_id):
+        return self.scores.get((student_id, assignment_id))
+
+
+def class_ids_for_scores(student_id, quiz_id):
+    """Returns the ids of the classes whose gradebooks show a student's
+    scores in a quiz.
+    """
+    return [class_id for class_id, in db.session.query(Assignment.class_id)
+            .join(StudentAssignment,
+                  StudentAssignment.assignment_id == Assignment.id)
+            .filter(Assignment.quiz_id == quiz_id,
+                    StudentAssignment.student_id == student_id)
+            .distinct()]
+
+
+def class_ids_of_student(student_id):
+    """Returns the ids of the classes whose gradebooks show a student."""
+    return [class_id for class_id, in db.session.query(ClassStudent.class_id)
+            .filter(ClassStudent.student_id == student_id).distinct()]
+
+
+def after_flush(session, flush_context):
+    """Rebuilds the gradebooks of classes whose assignments or students
+    have been changed through the session.
+    """
+    class_ids = set()
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, (Assignment, ClassStudent)) and obj.class_id:
+            class_ids.add(obj.class_id)
+    if class_ids:
+        invalidate_gradebooks(*class_ids)
+
+
+db.event.listen(db.session, 'after_flush', after_flush)
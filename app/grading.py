@@ -0,0 +1,113 @@
+"""app/grading.py
+
+Grading of a submitted quiz. Everything `main.summary` needs about the
+questions (their correct answers and explanations) is fetched for the
+whole quiz at once instead of question by question.
+"""
+
+from collections import OrderedDict, defaultdict
+
+from sqlalchemy import or_
+
+from app import db
+from app.gradebook import class_ids_for_scores, invalidate_gradebooks
+from app.models import (Assignment, Hint, Question, QuestionAnswer,
+                        QuestionOption, StudentAssignment, question_types)
+
+
+def correct_answers(question_ids):
+    """Returns the correct answer of each question in one query.
+
+    Gives the same answers as `Question.correct_answer()`: a list of
+    option texts for multiple answer questions and the option text for
+    every other type.
+
+    Returns
+    -------
+    Answers : dict
+        `{question_id: answer}`
+    """
+    question_ids = set(question_ids)
+    if not question_ids:
+        return {}
+    rows = db.session.query(Question.id, Question.question_type_id,
+                            QuestionOption.text) \
+        .outerjoin(QuestionAnswer, QuestionAnswer.question_id == Question.id) \
+        .outerjoin(QuestionOption, QuestionAnswer.option_id == QuestionOption.id) \
+        .filter(Question.id.in_(question_ids)) \
+        .order_by(Question.id, QuestionAnswer.id)
+    multiple_answer_id = question_types.id('M')
+    answers = {}
+    for question_id, question_type_id, text in rows:
+        if question_type_id == multiple_answer_id:
+            answer_list = answers.setdefault(question_id, [])
+            if text is not None:
+                answer_list.append(text)
+        elif question_id not in answers:
+            answers[question_id] = text
+    return answers
+
+
+def explanations(question_ids):
+    """Returns the explanation (every hint joined together, as
+    `Question.get_explanation()`) of each question in one query as a
+    dictionary of `{question_id: html}`.
+    """
+    question_ids = set(question_ids)
+    if not question_ids:
+        return {}
+    html = defaultdict(str)
+    hints = db.session.query(Hint.question_id, Hint.html) \
+        .filter(Hint.question_id.in_(question_ids)).order_by(Hint.id)
+    for question_id, hint_html in hints:
+        html[question_id] += hint_html or ''
+    return {question_id: html[question_id] for question_id in question_ids}
+
+
+def grade_quiz(state):
+    """Grades the quiz in a quiz session (see quiz_sessions.py).
+
+    Returns
+    -------
+    Summary : OrderedDict
+        The `correct_answers`, `user_ans_status` (whether each answer
+        was correct), `explanations` (of each answered question) and
+        `overall_score` of the quiz.
+    """
+    answers = correct_answers(state["questions"])
+    answer_explanations = explanations(state["answered"])
+    summary = OrderedDict()
+    summary["correct_answers"] = [answers.get(question_id)
+                                  for question_id in state["questions"]]
+    summary["user_ans_status"] = [
+        user_result == answers.get(question_id)
+        for question_id, user_result in zip(state["questions"],
+                                            state["user_results"])
+    ]
+    summary["explanations"] = [answer_explanations[question_id]
+                               for question_id in state["answered"]]
+    summary["overall_score"] = sum(state["scores"]) / len(state["scores"])
+    return summary
+
+
+def update_assignment_scores(student_id, quiz_id, score):
+    """Raises the student's score in every assignment of the quiz to
+    `score` (if it is better) with a single UPDATE. The gradebooks
+    showing the new scores are rebuilt once the change is committed.
+
+    Returns
+    -------
+    Updated : int
+        Number of `StudentAssignment` rows that were updated
+    """
+    assignment_ids = db.session.query(Assignment.id) \
+        .filter(Assignment.quiz_id == quiz_id)
+    updated = StudentAssignment.query.filter(
+        StudentAssignment.student_id == student_id,
+        StudentAssignment.assignment_id.in_(assignment_ids.subquery()),
+        or_(StudentAssignment.score.is_(None),
+            StudentAssignment.score < score)
+    ).update({StudentAssignment.score: score}, synchronize_session=False)
+    if updated:
+        invalidate_gradebooks(*class_ids_for_scores(student_id, quiz_id))
+    return updated
@@ -0,0 +1,59 @@
+"""app/http_cache.py
+
+Conditional GET support. Views work out an ETag from cheap queries (the
+`version` of the content, ids and timestamps, never the content itself)
+and return `304 Not Modified` without rendering anything if the browser
+already has that version.
+
+Responses are marked `private, no-cache` so browsers keep them but
+always revalidate, since what a user may see depends on who they are.
+"""
+
+import hashlib
+import time
+
+from flask import current_app, request, session
+
+
+def make_etag(*parts):
+    """Returns an ETag made from the given values."""
+    return hashlib.sha1(repr(parts).encode('utf-8')).hexdigest()
+
+
+def csrf_period():
+    """Returns a number that changes every half of the CSRF time limit so
+    that pages with forms aren't served from cache with a CSRF token
+    that has expired.
+    """
+    time_limit = current_app.config.get('WTF_CSRF_TIME_LIMIT', 3600) or 3600
+    return int(time.time() // (time_limit / 2))
+
+
+def cacheable():
+    """Whether the current request can be answered from cache (a GET
+    with no flashed messages waiting to be shown).
+    """
+    return request.method == 'GET' and '_flashes' not in session
+
+
+def not_modified(etag):
+    """Returns a 304 response if the browser already has `etag`,
+    otherwise None.
+    """
+    if not cacheable() or not request.if_none_match.contains(etag):
+        return None
+    response = current_app.response_class(status=304)
+    return cache_response(response, etag)
+
+
+def cache_response(response, etag, last_modified=None):
+    """Adds the caching headers to `response`."""
+    if not cacheable():
+        return response
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    response.vary.add('Cookie')
+    return response
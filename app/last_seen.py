@@ -0,0 +1,100 @@
+"""app/last_seen.py
+
+Records when each user was last seen without writing to `users` on every
+request. The latest time of each user is kept in memory and they are all
+written with one bulk UPDATE every `LAST_SEEN_FLUSH_INTERVAL` seconds (by
+a background thread) and when the process exits.
+
+`User.last_seen` can be up to that many seconds behind.
+"""
+
+import atexit
+import logging
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy import bindparam, or_
+from sqlalchemy.exc import SQLAlchemyError
+
+from app import db
+from app.models import User
+
+logger = logging.getLogger(__name__)
+
+
+class LastSeenTracker(object):
+    """Coalesces last seen times and writes them in bulk.
+
+    Paramaters
+    ----------
+    app : Flask
+        The app whose database the times are written to
+    flush_interval : float
+        Seconds between writes (default 60). If 0, `seen()` writes the
+        time before returning.
+    """
+
+    def __init__(self, app, flush_interval=60):
+        self.app = app
+        self.flush_interval = flush_interval
+        self._pending = {}  # {user_id: datetime}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def seen(self, user_id, when=None):
+        """Records that a user has been seen (now unless `when` is given)."""
+        when = when or datetime.utcnow()
+        with self._lock:
+            if user_id not in self._pending or self._pending[user_id] < when:
+                self._pending[user_id] = when
+        if not self.flush_interval:
+            self.flush()
+            return
+        self._start_worker()
+
+    def flush(self):
+        """Writes every recorded time now with a single UPDATE statement
+        (run for each user). A time is only written if it is later than
+        the one already saved.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return
+        users = User.__table__
+        update = users.update() \
+            .where(users.c.id == bindparam('user_id')) \
+            .where(or_(users.c.last_seen == None,
+                       users.c.last_seen < bindparam('seen'))) \
+            .values(last_seen=bindparam('seen'))
+        try:
+            with db.get_engine(self.app).begin() as connection:
+                connection.execute(update, [
+                    {'user_id': user_id, 'seen': seen}
+                    for user_id, seen in pending.items()])
+        except SQLAlchemyError as e:
+            logger.warning('Saving last seen times failed: %s', e)
+            # Keep them for the next flush unless the user's been seen since
+            with self._lock:
+                for user_id, seen in pending.items():
+                    self._pending.setdefault(user_id, seen)
+
+    def _start_worker(self):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            if self._thread is None:
+                atexit.register(self.flush)
+            self._thread = threading.Thread(target=self._work,
+                                            name='last-seen-writer')
+            self._thread.daemon = True
+            self._thread.start()
+
+    def _work(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Unexpected error saving last seen times')
@@ -0,0 +1,87 @@
+"""app/lookups.py
+
+In-process cache of the small lookup tables (question types, quiz
+types, answer statuses, roles and page types). These tables only
+change when their `insert_types()`/`insert_roles()` method runs, so
+each worker loads them once and keeps plain copies of the rows instead
+of querying them on every request.
+"""
+
+from collections import namedtuple
+from threading import Lock
+
+from app import db
+
+
+class LookupTable(object):
+    """Cached copy of every row of a lookup table.
+
+    Rows are stored as named tuples rather than model instances so they
+    can be shared between requests (and threads) without being bound to
+    a session. Compare them with foreign keys, e.g.
+    `question.question_type_id == question_types.id('M')`.
+
+    Paramaters
+    ----------
+    model : db.Model
+        The lookup table's model
+    key : str
+        Name of the column rows are looked up by (e.g. `'code'`)
+    """
+
+    def __init__(self, model, key):
+        self.model = model
+        self.key = key
+        self._rows = None
+        self._lock = Lock()
+
+    def _load(self):
+        columns = [column.name for column in self.model.__table__.columns]
+        row_type = namedtuple(self.model.__name__ + 'Row', columns)
+        query = db.session.query(
+            *[getattr(self.model, column) for column in columns]) \
+            .order_by(self.model.id)
+        return [row_type(*row) for row in query]
+
+    def rows(self):
+        """Returns every row, loading the table the first time."""
+        rows = self._rows
+        if rows is None:
+            with self._lock:
+                if self._rows is None:
+                    self._rows = self._load()
+                rows = self._rows
+        return rows
+
+    def get(self, id):
+        """Returns the row with the given id, or None."""
+        for row in self.rows():
+            if row.id == id:
+                return row
+        return None
+
+    def lookup(self, key):
+        """Returns the row whose key column equals `key`, or None."""
+        return self.find(**{self.key: key})
+
+    def find(self, **kwargs):
+        """Returns the first row matching every keyword, or None."""
+        for row in self.rows():
+            if all(getattr(row, name) == value
+                   for name, value in kwargs.items()):
+                return row
+        return None
+
+    def id(self, key):
+        """Returns the id of the row whose key column equals `key`, or
+        None if there isn't one.
+        """
+        row = self.lookup(key)
+        return row.id if row is not None else None
+
+    def invalidate(self):
+        """Drops the cached rows so they are reloaded on next use. Must
+        be called after the table has been changed.
+        """
+        with self._lock:
+            self._rows = None
@@ -0,0 +1,215 @@
+"""main/assignment_feed.py
+
+A student's upcoming or past assignments, each with everything the
+assignment table (`_upcoming_past_assignments.html`) shows: the page or
+quiz, the class, the chapter to link to, the student's best score and
+whether it is late. A page of the feed is loaded with one query.
+
+The feed is paginated by keyset rather than by page number. A cursor
+holds the due date and id of the last assignment shown, and the next
+page starts after it using the `(student_id, due_date)` index on
+`student_assignments`, so a page costs the same however far back it
+is.
+"""
+
+from collections import namedtuple
+from datetime import datetime
+
+from sqlalchemy import and_, or_
+from sqlalchemy.sql.expression import func
+
+from .. import db
+from ..models import (Assignment, Chapter, Class, Lesson, Page, PageType, Quiz,
+                      QuizType, Skill, StudentAssignment, quiz_skills)
+
+FeedPage = namedtuple('FeedPage', ['items', 'prev_cursor', 'next_cursor'])
+
+CURSOR_FORMAT = '%Y%m%d%H%M%S%f'
+
+
+def encode_cursor(due_date, assignment_id):
+    """Returns the cursor of an assignment in the feed."""
+    return '{0}-{1}'.format(due_date.strftime(CURSOR_FORMAT), assignment_id)
+
+
+def decode_cursor(cursor):
+    """Returns the `(due_date, assignment_id)` of a cursor.
+
+    Raises
+    ------
+    ValueError
+        If the cursor isn't valid
+    """
+    due_date, _, assignment_id = str(cursor).partition('-')
+    return datetime.strptime(due_date, CURSOR_FORMAT), int(assignment_id)
+
+
+def _beyond(cursor, ascending):
+    """Filters the student's assignments that come after `cursor` in
+    due date (then id) order.
+    """
+    due_date, assignment_id = cursor
+    if ascending:
+        return or_(StudentAssignment.due_date > due_date,
+                   and_(StudentAssignment.due_date == due_date,
+                        StudentAssignment.assignment_id > assignment_id))
+    return or_(StudentAssignment.due_date < due_date,
+               and_(StudentAssignment.due_date == due_date,
+                    StudentAssignment.assignment_id < assignment_id))
+
+
+def _details(assigned):
+    """Joins the details of each assignment to a subquery of
+    `assignment_id`, `due_date` and `score` columns.
+    """
+    # First skill tested by a practice quiz, which is what it's called
+    skill = db.session.query(Skill.description) \
+        .join(quiz_skills, quiz_skills.c.skill_id == Skill.id) \
+        .filter(quiz_skills.c.quiz_id == Assignment.quiz_id) \
+        .order_by(Skill.id).limit(1).correlate(Assignment).as_scalar()
+    return db.session.query(
+        assigned.c.assignment_id, assigned.c.due_date, assigned.c.score,
+        Assignment.page_id, Assignment.quiz_id, Class.name.label('class_name'),
+        Page.title.label('page_title'),
+        PageType.description.label('page_type'),
+        QuizType.code.label('quiz_type'), Lesson.title.label('lesson_title'),
+        Chapter.id.label('chapter_id'), Chapter.title.label('chapter_title'),
+        skill.label('skill')) \
+        .select_from(assigned) \
+        .join(Assignment, Assignment.id == assigned.c.assignment_id) \
+        .outerjoin(Class, Class.id == Assignment.class_id) \
+        .outerjoin(Page, Page.id == Assignment.page_id) \
+        .outerjoin(PageType, PageType.id == Page.page_type_id) \
+        .outerjoin(Quiz, Quiz.id == Assignment.quiz_id) \
+        .outerjoin(QuizType, QuizType.id == Quiz.type_id) \
+        .outerjoin(Lesson, Lesson.id == func.coalesce(Quiz.lesson_id,
+                                                      Page.lesson_id)) \
+        .outerjoin(Chapter, Chapter.id == Lesson.chapter_id)
+
+
+def assignment_feed(student_id, upcoming=True, after=None, before=None,
+                    per_page=10, now=None):
+    """Returns a page of a student's upcoming or past assignments.
+
+    Upcoming assignments are listed soonest first and past assignments
+    most recent first.
+
+    Paramaters
+    ----------
+    student_id : int
+    upcoming : bool
+        Upcoming (due after `now`) rather than past assignments
+    after, before : str
+        Cursor of the assignment the page starts after (for the next
+        page) or ends before (for the previous page), the first page if
+        neither is given
+    per_page : int
+    now : datetime
+        In UTC like the due dates, defaults to the current time
+
+    Returns
+    -------
+    Page : FeedPage
+        The `items` (a dictionary for each assignment) and the cursors of
+        the previous and next pages (None if there aren't any)
+
+    Raises
+    ------
+    ValueError
+        If a cursor isn't valid
+    """
+    now = now or datetime.utcnow()
+    ascending = upcoming
+    cursor = decode_cursor(before or after) if (before or after) else None
+    if before:
+        ascending = not ascending   # Walk back from the cursor
+
+    best_score = func.max(StudentAssignment.score)
+    assigned = db.session.query(StudentAssignment.assignment_id,
+                                StudentAssignment.due_date,
+                                best_score.label('score')) \
+        .filter(StudentAssignment.student_id == student_id,
+                StudentAssignment.due_date > now if upcoming
+                else StudentAssignment.due_date < now)
+    if cursor:
+        assigned = assigned.filter(_beyond(cursor, ascending))
+    order = (StudentAssignment.due_date, StudentAssignment.assignment_id)
+    assigned = assigned \
+        .group_by(StudentAssignment.assignment_id, StudentAssignment.due_date) \
+        .order_by(*(column if ascending else column.desc() for column in order)) \
+        .limit(per_page + 1).subquery()   # One more to know if there's another page
+
+    rows = _details(assigned).all()
+    rows.sort(key=lambda row: (row.due_date, row.assignment_id),
+              reverse=not ascending)
+    more = len(rows) > per_page
+    rows = rows[:per_page]
+    if before:
+        rows.reverse()
+
+    items = [{
+        'id': row.assignment_id,
+        'due_date': row.due_date,
+        'class_name': row.class_name,
+        'is_quiz': row.quiz_id is not None,
+        'quiz_id': row.quiz_id,
+        'quiz_type': row.quiz_type,
+        'page_id': row.page_id,
+        'page_title': row.page_title,
+        'page_type': row.page_type,
+        'lesson_title': row.lesson_title,
+        'chapter_id': row.chapter_id,
+        'chapter_title': row.chapter_title,
+        'skill': row.skill,
+        'score': int(row.score) if row.score is not None else None,
+        'late': (not upcoming and row.quiz_id is not None and
+                 row.score is None),
+    } for row in rows]
+
+    prev_cursor = next_cursor = None
+    if items:
+        first = encode_cursor(items[0]['due_date'], items[0]['id'])
+        last = encode_cursor(items[-1]['due_date'], items[-1]['id'])
+        if before:
+            prev_cursor = first if more else None
+            next_cursor = last
+        else:
+            prev_cursor = first if after else None
+            next_cursor = last if more else None
+    return FeedPage(items, prev_cursor, next_cursor)
+
+
+def assigned_chapters(student_id):
+    """Summarises a student's assignments in each chapter (for the
+    chapter cards on the dashboard) with one query.
+
+    Returns
+    -------
+    Chapters : dict
+        `{chapter_id: summary}` for the chapters the student has been
+        assigned something in. The summary has the number of quizzes
+        assigned (`count`), how many have a score of 100
+        (`completed_count`) and whether any has been started
+        (`in_progress`)
+    """
+    rows = db.session.query(Assignment.quiz_id, Lesson.chapter_id,
+                            func.max(StudentAssignment.score)) \
+        .select_from(StudentAssignment) \
+        .join(Assignment, Assignment.id == StudentAssignment.assignment_id) \
+        .outerjoin(Page, Page.id == Assignment.page_id) \
+        .outerjoin(Quiz, Quiz.id == Assignment.quiz_id) \
+        .join(Lesson, Lesson.id == func.coalesce(Quiz.lesson_id,
+                                                 Page.lesson_id)) \
+        .filter(StudentAssignment.student_id == student_id) \
+        .group_by(Assignment.id, Assignment.quiz_id, Lesson.chapter_id)
+    chapters = {}
+    for quiz_id, chapter_id, score in rows:
+        summary = chapters.setdefault(chapter_id, {
+            'count': 0, 'completed_count': 0, 'in_progress': False})
+        if quiz_id is not None:
+            summary['count'] += 1
+        if score is not None and score > 0:
+            summary['in_progress'] = True
+        if score == 100:
+            summary['completed_count'] += 1
+    return chapters
@@ -0,0 +1,128 @@
+"""main/chapter_page.py
+
+Builds everything the chapter page (`display_chapter.html`) shows in a
+fixed number of queries (lessons, pages, quizzes, skills, projects, the
+user's attempts and the user's assignments), however big the chapter
+is. The template is given plain dictionaries rather than models so that
+it can't trigger any more queries.
+"""
+
+from collections import defaultdict
+
+from sqlalchemy.sql.expression import func
+
+from .. import db
+from ..models import (Page, Permission, Project, Quiz, QuizAttempt, Skill,
+                      lesson_types, page_types, quiz_skills, unlocked_ids)
+
+
+def _group(rows, key):
+    groups = defaultdict(list)
+    for row in rows:
+        groups[getattr(row, key)].append(row)
+    return groups
+
+
+def quiz_attempt_summaries(user, quiz_ids):
+    """Returns `{quiz_id: {'best_score', 'most_recent', 'count'}}` for
+    the quizzes the user has attempted.
+    """
+    if not user.is_authenticated or not quiz_ids:
+        return {}
+    rows = db.session.query(QuizAttempt.quiz_id, func.max(QuizAttempt.percent),
+                            func.max(QuizAttempt.datetime),
+                            func.count(QuizAttempt.id)) \
+        .filter(QuizAttempt.user_id == user.id,
+                QuizAttempt.quiz_id.in_(quiz_ids)) \
+        .group_by(QuizAttempt.quiz_id)
+    return {quiz_id: {'best_score': best_score, 'most_recent': most_recent,
+                      'count': count}
+            for quiz_id, best_score, most_recent, count in rows}
+
+
+def build_chapter_page(chapter, user):
+    """Loads a chapter's lessons and everything in them.
+
+    Paramaters
+    ----------
+    chapter : Chapter
+    user : User
+        The current user (may be anonymous)
+
+    Returns
+    -------
+    Lessons : list
+        A dictionary for each lesson in order with its `id`, `title`,
+        `type_code`, `overview_html`, `pages`, `quizzes` and `projects`
+        (lists of dictionaries, in order).
+    """
+    lessons = chapter.all_ordered_children()
+    lesson_ids = [lesson.id for lesson in lessons]
+    if not lesson_ids:
+        return []
+
+    # Only the columns shown, not the pages' text
+    pages = _group(db.session.query(Page.id, Page.title, Page.page_type_id,
+                                    Page.lesson_id)
+                   .filter(Page.lesson_id.in_(lesson_ids))
+                   .order_by(Page.lesson_id, Page.position, Page.id),
+                   'lesson_id')
+    quizzes = _group(db.session.query(Quiz.id, Quiz.lesson_id)
+                     .filter(Quiz.lesson_id.in_(lesson_ids))
+                     .order_by(Quiz.lesson_id, Quiz.position, Quiz.id),
+                     'lesson_id')
+    projects = _group(Project.query.filter(Project.lesson_id.in_(lesson_ids),
+                                           Project.status == True)
+                      .order_by(Project.id), 'lesson_id')
+    quiz_ids = [quiz.id for group in quizzes.values() for quiz in group]
+    skills = defaultdict(list)
+    if quiz_ids:
+        tested = db.session.query(quiz_skills.c.quiz_id, Skill.description) \
+            .join(Skill, Skill.id == quiz_skills.c.skill_id) \
+            .filter(quiz_skills.c.quiz_id.in_(quiz_ids)) \
+            .order_by(Skill.id)
+        for quiz_id, description in tested:
+            skills[quiz_id].append(description)
+    attempts = quiz_attempt_summaries(user, quiz_ids)
+
+    manages_class = user.can(Permission.MANAGE_CLASS)
+    assigned_pages, assigned_quizzes = unlocked_ids(user)
+
+    result = []
+    for lesson in lessons:
+        lesson_pages = []
+        for page in pages[lesson.id]:
+            page_type = page_types.get(page.page_type_id)
+            lesson_pages.append({
+                'id': page.id,
+                'title': page.title,
+                'page_type': page_type.description if page_type else None,
+                'unlocked': manages_class or page.id in assigned_pages,
+            })
+        for page, next_page in zip(lesson_pages, lesson_pages[1:]):
+            page['next_page_id'] = next_page['id'] \
+                if next_page['unlocked'] else None
+        if lesson_pages:
+            lesson_pages[-1]['next_page_id'] = None
+
+        lesson_type = lesson_types.get(lesson.type_id)
+        result.append({
+            'id': lesson.id,
+            'title': lesson.title,
+            'type_code': lesson_type.code if lesson_type else None,
+            'overview_html': lesson.overview_html,
+            'pages': lesson_pages,
+            'quizzes': [{
+                'id': quiz.id,
+                'skills': skills[quiz.id],
+                'attempts': attempts.get(quiz.id),
+                'unlocked': manages_class or quiz.id in assigned_quizzes,
+            } for quiz in quizzes[lesson.id]],
+            'projects': [{
+                'id': project.id,
+                'title': project.title,
+                'description': project.description,
+                'thumbnail': project.thumbnail,
+            } for project in projects[lesson.id]],
+        })
+    return result
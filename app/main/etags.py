@@ -0,0 +1,120 @@
+"""main/etags.py
+
+Works out the ETags of the lesson page, the page content AJAX responses
+and the project page (see http_cache.py). Each ETag is made from small
+columns only (ids, titles, `version` numbers and timestamps) so a
+browser's cached copy can be checked without fetching any page bodies.
+"""
+
+from flask import current_app
+from sqlalchemy.sql.expression import func
+
+from .. import db
+from ..http_cache import csrf_period, make_etag
+from ..models import (Chapter, Lesson, Module, Page,
+                      PageAnswer, PageQuestion, Permission, Project,
+                      ProjectStep, TeacherNote, unlocked_ids)
+from ..teacher_notes import visible_notes, visible_to
+
+
+def user_key(user):
+    """The parts of the current user that are shown on every page."""
+    if not user.is_authenticated:
+        return (None,)
+    return (user.id, user.username, user.role_id)
+
+
+def page_unlocked(page_id, user):
+    """Same as `Page.is_unlocked()` without loading the page."""
+    return user.can(Permission.MANAGE_CLASS) or \
+        page_id in unlocked_ids(user).pages
+
+
+def page_summary(page_id):
+    """Returns the `id`, `version`, `last_updated`, `lesson_id` and
+    `next_page_id` of a page (None if it doesn't exist).
+    """
+    return db.session.query(Page.id, Page.version, Page.last_updated,
+                            Page.lesson_id, Page.next_page_id) \
+        .filter(Page.id == page_id).first()
+
+
+def page_content_etag(page):
+    """ETag of `/page-content/<id>` for a row from `page_summary()`."""
+    next_page_type = None
+    if page.next_page_id is not None:
+        next_page_type = db.session.query(Page.page_type_id) \
+            .filter(Page.id == page.next_page_id).scalar()
+    return make_etag('page-content', page.id, page.version, next_page_type)
+
+
+def lesson_page_etag(page, user):
+    """ETag of `/lesson/page/<id>` for a row from `page_summary()`.
+
+    The lesson page shows the page, the pages of its lesson (locked or
+    not), the next lesson, the chapter and module titles and the page's
+    questions and answers, so all of those are part of the ETag. The
+    forms on the page have a CSRF token, so it is also changed well
+    before the token expires.
+    """
+    chapter = db.session.query(Chapter.id, Chapter.title, Module.title) \
+        .join(Lesson, Lesson.chapter_id == Chapter.id) \
+        .outerjoin(Module, Module.id == Chapter.module_id) \
+        .filter(Lesson.id == page.lesson_id).first()
+    lessons = db.session.query(Lesson.id, Lesson.title, Lesson.type_id,
+                               Lesson.next_lesson_id) \
+        .filter(Lesson.chapter_id == (chapter[0] if chapter else None)) \
+        .order_by(Lesson.id).all()
+    pages = db.session.query(Page.id, Page.title, Page.page_type_id,
+                             Page.next_page_id, Page.version) \
+        .filter(Page.lesson_id.in_([lesson.id for lesson in lessons] or
+                                   [page.lesson_id])) \
+        .order_by(Page.id).all()
+    page_ids = {row.id for row in pages}
+    if user.can(Permission.MANAGE_CLASS):
+        unlocked = True
+    else:
+        unlocked = sorted(unlocked_ids(user).pages & page_ids)
+    questions = db.session.query(func.count(PageQuestion.id),
+                                 func.max(PageQuestion.last_updated)) \
+        .filter(PageQuestion.page_id == page.id).first()
+    answers = db.session.query(func.count(PageAnswer.id),
+                               func.max(PageAnswer.last_updated)) \
+        .join(PageQuestion, PageQuestion.id == PageAnswer.question_id) \
+        .filter(PageQuestion.page_id == page.id).first()
+    return make_etag('lesson-page', user_key(user), csrf_period(),
+                     page.id, page.version, chapter, lessons, pages,
+                     unlocked, tuple(questions), tuple(answers))
+
+
+def notes_etag(page_id, user):
+    """ETag of `/page-content/<id>/notes`. Made from the generation of
+    the cached notes if there is a fragment cache, so no query is needed.
+    """
+    visibility = visible_to(user)[0]
+    if current_app.fragment_cache is not None:
+        notes = current_app.fragment_cache.generation('teacher_notes')
+    else:
+        notes = tuple(visible_notes(user)
+                      .filter(TeacherNote.page_id == page_id)
+                      .with_entities(func.count(TeacherNote.id),
+                                     func.max(TeacherNote.id),
+                                     func.max(TeacherNote.last_updated))
+                      .first())
+    return make_etag('notes', page_id, user_key(user), visibility, notes)
+
+
+def project_etag(project_id, user):
+    """ETag of `/project/<id>`."""
+    project = db.session.query(Project.id, Project.title, Project.version,
+                               Project.lesson_id) \
+        .filter(Project.id == project_id).first()
+    if project is None:
+        return None
+    steps = db.session.query(ProjectStep.id, ProjectStep.title,
+                             ProjectStep.version, ProjectStep.next_step_id) \
+        .filter(ProjectStep.project_id == project_id) \
+        .order_by(ProjectStep.id).all()
+    chapter_id = db.session.query(Lesson.chapter_id) \
+        .filter(Lesson.id == project.lesson_id).scalar()
+    return make_etag('project', user_key(user), project, steps, chapter_id)
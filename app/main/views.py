@@ -1,13 +1,25 @@
-from flask import abort, current_app, flash, jsonify, redirect, render_template, url_for, session, request, g
+from flask import abort, current_app, flash, jsonify, make_response, redirect, render_template, url_for, request, g
 from flask_login import current_user, login_required
 from sqlalchemy.sql.expression import func
-from datetime import datetime
-from ..models import (db, AnswerStatus, Assignment, Chapter, Class,
+from ..models import (db, answer_statuses, Chapter, Class,
                       ClassStudent, Hint, Lesson, Page, PageAnswer,
                       PageQuestion, Permission, ProblemMistake,
-                      ProblemMistakeType, Project, Quiz, StudentAssignment,
-                      TeacherNote, UserAnswer, Question, QuizAttempt)
+                      ProblemMistakeType, Project, Quiz,
+                      UserAnswer, Question, QuizAttempt)
 from .. import moment
+from ..fragment_cache import cached
+from ..http_cache import cache_response, cacheable, not_modified
+from ..curriculum import get_curriculum_tree
+from ..grading import grade_quiz, update_assignment_scores
+from ..progress import chapter_progress, record_attempt
+from ..quiz_sessions import (get_quiz_session, save_quiz_session,
+                             start_quiz_session)
+from ..teacher_notes import notes_html
+from ..transactions import read_only
+from .assignment_feed import assigned_chapters, assignment_feed
+from .chapter_page import build_chapter_page
+from .etags import (lesson_page_etag, notes_etag, page_content_etag,
+                    page_summary, page_unlocked, project_etag)
 from .forms import NewPageQuestion, NewPageAnswer, EditPageAnswer, SearchForm
 from . import main
 import random
@@ -15,51 +27,73 @@ import random
 @main.before_app_request
 def before_request():
     if current_user.is_authenticated:
-        current_user.last_seen = datetime.utcnow()
+        current_app.last_seen.seen(current_user.id)
     g.search_form = SearchForm()
 
 @main.route('/')
+@read_only
 def index():
     upcoming_assignments = None
     past_assignments = None
+    progress = {}
+    assigned = {}
     title = "JCCoder"
+    if not current_user.is_authenticated and cacheable() and not request.args:
+        # The landing page is the same for everyone who isn't logged in
+        return cached('index', caller=lambda: render_template('index_new.html', title=title, upcoming_assignments=None, past_assignments=None, assigned={}, curriculum=get_curriculum_tree(), progress={}))
     if current_user.is_authenticated:
         if current_user.can(Permission.MANAGE_CLASS) and not current_user.is_admin():
             return redirect(url_for('teacher.dashboard'))
-        upcoming_page = request.args.get('upcoming_page', 1, int)
-        past_page = request.args.get('past_page', 1, int)
-        upcoming_assignments = current_user.upcoming_assignments()
-        past_assignments = current_user.past_assignments()
+        try:
+            upcoming_assignments = assignment_feed(current_user.id, upcoming=True, after=request.args.get('upcoming_after'), before=request.args.get('upcoming_before'))
+            past_assignments = assignment_feed(current_user.id, upcoming=False, after=request.args.get('past_after'), before=request.args.get('past_before'))
+        except ValueError:
+            abort(400)
+        assigned = assigned_chapters(current_user.id)
+        progress = chapter_progress(current_user)
         title = "JCCoder - Dashboard"
-    return render_template('index_new.html', title=title, upcoming_assignments=upcoming_assignments, past_assignments=past_assignments)
+    return render_template('index_new.html', title=title, upcoming_assignments=upcoming_assignments, past_assignments=past_assignments, assigned=assigned, curriculum=get_curriculum_tree(), progress=progress)
 
 @main.route('/assignment-table', methods=['GET', 'POST'])
+@login_required
 def assignment_table():
     if request.method == 'GET':
         abort(400)
-    data = request.get_json()
-    page = int(data["page"])
-    assignments_type = data["type"]
-    pagination = current_user.assignments
-    if assignments_type == 'upcoming':
-        pagination = pagination.filter(Assignment.due_date > datetime.now())
-    else:
-        pagination = pagination.filter(Assignment.due_date < datetime.now())
-    pagination = pagination.paginate(page + data["direction"], per_page=10)
-    html = render_template('_upcoming_past_assignments.html', type=assignments_type, pagination=pagination, assignments=pagination.items)
+    data = request.get_json() or {}
+    assignments_type = data.get("type")
+    if assignments_type not in ('upcoming', 'past'):
+        abort(400)
+    cursor = data.get("cursor")
+    try:
+        feed = assignment_feed(current_user.id, upcoming=assignments_type == 'upcoming',
+                               after=cursor if data.get("direction") == 'next' else None,
+                               before=cursor if data.get("direction") == 'prev' else None)
+    except ValueError:
+        abort(400)
+    html = render_template('_upcoming_past_assignments.html', type=assignments_type, feed=feed, assignments=feed.items)
     return jsonify(success=True, html=html)
 
 
 @main.route('/content')
+@read_only
 def chapters():
-    return render_template('chapters.html', title="JCCoder - Content")
+    return render_template('chapters.html', title="JCCoder - Content", curriculum=get_curriculum_tree())
 
 @main.route('/about')
+@read_only
 def about():
     return render_template('about.html', title="JCCoder - About")
 
 @main.route('/lesson/page/<int:id>', methods=['GET', 'POST'])
 def lesson_page(id):
+    etag = None
+    summary = page_summary(id)
+    if summary and request.method == 'GET' and page_unlocked(id, current_user):
+        # Nothing is fetched or rendered if the browser's copy is current
+        etag = lesson_page_etag(summary, current_user)
+        response = not_modified(etag)
+        if response:
+            return response
     page = Page.query.get_or_404(id)
     if not page.is_unlocked():
         flash('You have not unlocked that page yet!', 'warning')
@@ -69,11 +103,17 @@ def lesson_page(id):
     if new_question_form.submit_question.data and new_question_form.validate():
         question = PageQuestion(author=current_user._get_current_object(), text=new_question_form.text.data, page=page)
         db.session.add(question)
+        db.session.commit()
         return redirect(url_for('main.lesson_page', id=id))
     if new_answer_form.submit_answer.data and new_answer_form.validate():
         answer = PageAnswer(author=current_user._get_current_object(), text=new_answer_form.answer.data, question_id=int(new_answer_form.question_id.data))
+        db.session.add(answer)
+        db.session.commit()
         return redirect(url_for('main.lesson_page', id=id))
-    return render_template('lesson_page.html', title="JCCoder - Lesson Pages", page=page, new_question_form=new_question_form, new_answer_form=new_answer_form, page_html=page.html)
+    response = make_response(render_template('lesson_page.html', title="JCCoder - Lesson Pages", page=page, new_question_form=new_question_form, new_answer_form=new_answer_form, page_html=page.html))
+    if etag is not None:
+        response = cache_response(response, etag, page.last_updated)
+    return response
 
 @main.route('/edit/lesson-page/question/<int:id>', methods=['GET', 'POST'])
 def edit_page_question(id):
@@ -82,6 +122,7 @@ def edit_page_question(id):
     if form.validate_on_submit():
         page_question.text = form.text.data
         db.session.add(page_question)
+        db.session.commit()
         return redirect(url_for('main.lesson_page', id=page_question.page_id))
     form.text.data = page_question.text
     return render_template('edit_page_question.html', title="JCCoder - Edit Question", form=form)
@@ -93,6 +134,7 @@ def edit_page_answer(id):
     if form.validate_on_submit():
         page_answer.text = form.answer.data
         db.session.add(page_answer)
+        db.session.commit()
         return redirect(url_for('main.lesson_page', id=page_answer.question.page_id))
     form.answer.data = page_answer.text
     return render_template('edit_page_answer.html', title="JCCoder - Edit Answer", form=form)
@@ -121,17 +163,12 @@ def take_quiz(id):
             questions.append(q)
             bank.remove(q)
         random.shuffle(questions)
-    session["attempt_no"] = 0
     try:
-        session["questions"] = [question.id for question in questions]
+        start_quiz_session([question.id for question in questions])
     except AttributeError:
         # If all skills have no questions
-        session["questions"] = []
-    session["user_results"] = []
-    session["no_attempts"] = []
-    session["scores"] = []
-    session["explanations"] = []
-    session["num_hints_used"] = 0
+        start_quiz_session([])
+    db.session.commit()
     return render_template('take_quiz.html', title="JCCoder - Take Quiz", quiz=quiz, questions=questions)
 
 @main.route('/submit-mistake', methods=["GET", "POST"])
@@ -151,21 +188,53 @@ def submit_mistake():
     user_id = current_user.id if current_user.is_authenticated else None
     mistake = ProblemMistake(description=description, problem_mistake_type_id=mistake_type_id, user_id=user_id, question_id=question_id)
     db.session.add(mistake)
+    db.session.commit()
     return jsonify(success=True)
 
 @main.route('/chapter/<int:id>')
+@read_only
 def chapter(id):
     chapter = Chapter.query.get_or_404(id)
-    lessons = []
-    def append_lessons(lesson):
-        lessons.append(lesson)
-        if lesson.next_lesson:
-            append_lessons(lesson.next_lesson)
-    first_lesson = chapter.lessons.filter_by(prev_lesson=None).first()
-    if first_lesson:
-        append_lessons(first_lesson)
+    lessons = build_chapter_page(chapter, current_user)
     return render_template('display_chapter.html', title="JCCoder - " + chapter.title, chapter=chapter, lessons=lessons)
 
+@main.route('/page-content/<int:id>')
+@read_only
+def page_content_get(id):
+    # AJAX url for a page's content. The teacher notes are loaded
+    # separately from page_content_notes so that the content can be
+    # cached by everyone who can see it.
+    page = page_summary(id)
+    if not page:
+        abort(404)
+    if not page_unlocked(id, current_user):
+        abort(403)
+    etag = page_content_etag(page)
+    response = not_modified(etag)
+    if response:
+        return response
+
+    page = Page.query.get(id)
+    if page.next_page:
+        page_type = page.next_page.page_type.description
+    else:
+        page_type = ''
+    response = jsonify(success=True, page_title=page.title, page_html=page.html, page_type=page_type)
+    return cache_response(response, etag, page.last_updated)
+
+@main.route('/page-content/<int:id>/notes')
+@read_only
+def page_content_notes(id):
+    # AJAX url for the teacher notes on a page
+    if not page_unlocked(id, current_user):
+        abort(403)
+    etag = notes_etag(id, current_user)
+    response = not_modified(etag)
+    if response:
+        return response
+    response = jsonify(success=True, notes_html=notes_html(id, current_user))
+    return cache_response(response, etag)
+
 @main.route('/page-content/', methods=['GET', 'POST'])
 def page_content():
     # AJAX url for page
@@ -221,28 +290,7 @@ def page_content():
         else:
             page_type = ''
 
-        notes_html = ''
-        if current_user.is_admin():
-            notes = page.notes.group_by(TeacherNote.teacher_id).all()
-            notes_html = "<hr /><h3>Added Notes</h3>" if notes else ""
-            for note in notes:
-                notes_html += '<hr />{0}<p>Added by {1} to their class {2}'.format(note.body_html, note.teacher.username, note.class_.name)
-        elif current_user.can(Permission.MANAGE_CLASS):
-            notes = page.notes.filter_by(teacher_id=current_user.id).group_by(TeacherNote.class_id).all()
-            notes_html = "<hr /><h3>You added</h3>" if notes else ""
-            current_class = None
-            for note in notes:
-                if note.class_id != current_class:
-                    notes_html += '<hr /><h5>Class: ' + note.class_.name + '</h5>'
-                    current_class = note.class_id 
-                notes_html += '<hr />{0}'.format(note.body_html)
-        else:
-            notes = page.notes.filter(TeacherNote.class_.has(Class.students.contains(current_user._get_current_object()))).all()
-            notes_html = "<hr /><h3>Added by your teacher</h3>" if notes else ""
-            for note in notes:
-                notes_html += '<hr />{0}'.format(note.body_html)
-                
-        page_html += notes_html
+        page_html += notes_html(page.id, current_user)
         # css, js, stripped_lines = parsePageContent(page_html)
         # page_html = '\n'.join(stripped_lines)
         # return jsonify(success=True, page_title=page_title, page_html=page_html, page_type=page_type, css=css, js=js)
@@ -252,9 +300,12 @@ def page_content():
 def check():
     if request.method == "GET":
         abort(404)
-    attempt_no = session.get('attempt_no')
-    attempt_no += 1
-    session["attempt_no"] += 1
+    state = get_quiz_session()
+    if state is None:
+        # No quiz has been started (or it has expired)
+        abort(400)
+    state["attempt_no"] += 1
+    attempt_no = state["attempt_no"]
     data = request.get_json()
     # if data.get('hint_used_mark_incorrect', False):
     #     session["user_results"].append("Used hint")
@@ -268,7 +319,7 @@ def check():
         # Return error as id is invalid
         abort(400)
 
-    hints_used = int(session.get("num_hints_used", 0))
+    hints_used = int(state["num_hints_used"])
     total_num_hints = Hint.query.filter_by(question_id=question.id).count()
     try:
         score = round(100 - ((hints_used / total_num_hints) * 100), 0)
@@ -281,14 +332,14 @@ def check():
     status = question.check(answer)
     try_again = False
     if status:
-        answer_status = AnswerStatus.query.get(1) # Correct
-        session["attempt_no"] = 0 # For the next question
-        session["num_hints_used"] = 0
+        answer_status_id = answer_statuses.id('Correct')
+        state["attempt_no"] = 0 # For the next question
+        state["num_hints_used"] = 0
     else:
-        answer_status = AnswerStatus.query.get(2) # Incorrect
+        answer_status_id = answer_statuses.id('Incorrect')
         if attempt_no == question.max_attempts:
-            session["attempt_no"] = 0 # For the next question
-            session["num_hints_used"] = 0
+            state["attempt_no"] = 0 # For the next question
+            state["num_hints_used"] = 0
         else:
             try_again = True
     
@@ -301,17 +352,20 @@ def check():
         solution_html = ""
 
     if not try_again:
-        session["scores"].append(score)
+        state["scores"].append(score)
         # if not data.get("used_hint", False):
-        session["user_results"].append(answer)
-        session["no_attempts"].append(attempt_no)
-        session["explanations"].append(question.get_explanation())
+        state["user_results"].append(answer)
+        state["no_attempts"].append(attempt_no)
+        state["answered"].append(question.id)
+    save_quiz_session(state)
     if current_user.is_authenticated:
         keyed_answer = answer
         if type(answer) == list:
             keyed_answer = ", ".join(answer)
-        user_answer = UserAnswer(keyed_answer=keyed_answer, answer_status=answer_status, score=score, user=current_user._get_current_object(),
+        user_answer = UserAnswer(keyed_answer=keyed_answer, answer_status_id=answer_status_id, score=score, user=current_user._get_current_object(),
                                 question=question, attempt_no=attempt_no)
+        db.session.add(user_answer)
+    db.session.commit()
     return jsonify(success=True, answer_status=status, try_again=try_again, solution_html=solution_html)
 
 @main.route('/summary', methods=['GET', 'POST'])
@@ -319,40 +373,23 @@ def summary():
     if request.method == "GET":
         abort(404)
     data = request.get_json()
-    question_ids = []
-    questions = []
-    correct_answers = []
-    user_ans_status = []
-    i = 0
-    # for question in Quiz.query.filter_by(id=data['id']).first().questions:
-    for question in [Question.query.get(question_id) for question_id in session["questions"]]:
-        question_ids.append(question.id)
-        questions.append((question.html or question.text))
-        questions.append(question)
-        correct_answers.append(question.correct_answer())
-        user_ans_status.append(question.check(session["user_results"][i]))
-        i += 1
-
-    overall_score = sum(session["scores"]) / len(session["scores"])
+    state = get_quiz_session()
+    if state is None:
+        abort(400)
+    summary = grade_quiz(state)
+    overall_score = summary["overall_score"]
     if current_user.is_authenticated:
         quiz_attempt = QuizAttempt(user_id=current_user.id, quiz_id=data['id'], percent=overall_score)
         #UserAnswer.query.filter_by(user_id=current_user.id).delete()
         db.session.add(quiz_attempt)
-        assignments = Assignment.query.filter_by(quiz_id=data['id']).all()
-        for assignment in assignments:
-            if assignment.students.filter_by(username=current_user.username).first():
-                #student_assignment = StudentAssignment(assignment_id=assignment.id, student_id=current_user.id, score=overall_score)
-                student_assignments = StudentAssignment.query.filter_by(assignment_id=assignment.id, student_id=current_user.id).all()
-                for student_assignment in student_assignments:
-                    if not student_assignment.score or (student_assignment.score < overall_score):
-                        student_assignment.score = overall_score
-                        db.session.add(student_assignment)
-
-
-    return jsonify(success=True, question_ids=question_ids, questions=session["questions"], no_attempts=session["no_attempts"],
-            last_attempts=session["user_results"], scores=session["scores"],
-            correct_answers=correct_answers, user_ans_status=user_ans_status,
-            explanations=session["explanations"], overall_score=overall_score)
+        record_attempt(quiz_attempt)
+        update_assignment_scores(current_user.id, data['id'], overall_score)
+        db.session.commit()
+
+    return jsonify(success=True, question_ids=state["questions"], questions=state["questions"], no_attempts=state["no_attempts"],
+            last_attempts=state["user_results"], scores=state["scores"],
+            correct_answers=summary["correct_answers"], user_ans_status=summary["user_ans_status"],
+            explanations=summary["explanations"], overall_score=overall_score)
 
 @main.route('/update-quiz-attempts', methods=["GET", "POST"])
 def update_quiz_attempts():
@@ -382,28 +419,45 @@ def get_hint():
         # Return error as data is invalid (possibly user tried to change values through browser Inspector)
         abort(400)
     hint_count = Hint.query.filter_by(question_id=data["question_id"]).count()
-    if not data["is_checked"]:
-        session["num_hints_used"] = int(session.get("num_hints_used", 0)) + 1
+    state = get_quiz_session()
+    if not data["is_checked"] and state is not None:
+        state["num_hints_used"] += 1
+        save_quiz_session(state)
+        db.session.commit()
     is_last_hint = int(data["hint_no"]) == hint_count
     return jsonify(success=True, hint_html=hint.html, is_last_hint=is_last_hint)
 
 @main.route('/project/<int:id>')
+@read_only
 def project(id):
+    etag = project_etag(id, current_user)
+    if etag is None:
+        abort(404)
+    response = not_modified(etag)
+    if response:
+        return response
     project = Project.query.get_or_404(id)
-    return render_template('project.html', title="JCCoder - Project - " + project.title, project=project)
+    response = make_response(render_template('project.html', title="JCCoder - Project - " + project.title, project=project))
+    return cache_response(response, etag, project.last_updated)
 
 @main.route('/search')
+@read_only
 def search():
     if not g.search_form.validate():
         abort(404)
     q = g.search_form.q.data
     page = request.args.get('page', 1, type=int)
-    pages, total = Page.search(q, page, current_app.config["POSTS_PER_PAGE"])
+    results = Page.search_hits(q, page, current_app.config["POSTS_PER_PAGE"])
+    total = results.total
     next_url = url_for('main.search', q=q, page=page + 1) \
         if total > page * current_app.config["POSTS_PER_PAGE"] else None
     prev_url = url_for('main.search', q=q, page=page - 1) \
         if page > 1 else None
-    return render_template('search_results.html', title="Search results for \"{0}\"".format(q), q=q, pages=pages.all(), total=total, prev_url=prev_url, next_url=next_url)
+    response = make_response(render_template('search_results.html', title="Search results for \"{0}\"".format(q), q=q, pages=results.hits, total=total, prev_url=prev_url, next_url=next_url))
+    # For monitoring how long searches take
+    response.headers['X-Search-Took'] = '{0:.1f}ms'.format(results.took)
+    response.headers['X-Search-Total'] = str(total)
+    return response
 
 @main.route('/join', methods=["GET", "POST"])
 @login_required
@@ -1,7 +1,7 @@
 """app/models.py
 
-Module containing all the models in the application. Contains functions
-for rendering markdown.
+Module containing all the models in the application. Markdown is
+rendered by `customTagMarkdown` from `rendering.py`.
 """
 
 import hashlib
@@ -9,216 +9,18 @@ import re
 from datetime import datetime
 
 import bleach
-from flask import request, url_for
+from flask import current_app, request, url_for
 from flask_login import AnonymousUserMixin, UserMixin, current_user
-from markdown import markdown
-from mdx_gfm import GithubFlavoredMarkdownExtension
 from werkzeug.security import check_password_hash, generate_password_hash
 
 from app import db, login
-from app.search import add_to_index, query_index, remove_from_index
+from app.lookups import LookupTable
+from app.rendering import customTagMarkdown
+from app.search import (delete_action, index_action, query_index,
+                        search_index, stored_fields)
+from app.unlocks import UnlockedContent, UnlockedIds
 
 
-def customTagMarkdown(original_mardown, object_id=None, extensions=None):
-    """Renders markdown to HTML with modified custom Markdown syntax.
-    
-    Paramaters
-    ----------
-    original_markdown : str
-        Markdown to be converted
-    object_id : int
-        ID of the model that is converting the markdown (default None)
-    extensions : list
-        Any additional extensions to be added to markdown converter
-        (default None)
-
-    Returns
-    -------
-    Converted HTML : str
-    """
-
-    # Initialising variables
-    lines = []  # Markdown split into individual lines
-    hint_counter = 0    # Stores what hint # the program is at
-    collapse_counter = 1    # Stores what collapse no the program is at
-    hints = []  # List of hints
-    drag_and_drop_options = []  # Options in a drag and drop question
-    recording_hint = False  # If a hint tag is in progress
-    recording_collapse = False  # If a collapse tag is in progress
-    recording_drag_and_drop = False # If a drag and drop tag is in progress
-    add_line = True # If the program should add the current line to the
-                    # end HTML
-    for line in original_mardown.split('\n'):   # Splits markdown by newline
-        if ':video::' in line:  # Video (also used for Scratch embed)
-            # Splits arguments and creates HTML
-            arguments = line.split('::')
-
-            # arguments[0] = "video" from tag (not used)
-            # arguments[1] = Bootstrap grid class
-            # arguments[2] = Aspect ratio
-            # arguments[3] = Embed link
-            video = """<div class="row" style="margin-bottom:20px">
-    <div class="{0}">
-        <div class="embed-responsive embed-responsive-{1}">
-            <iframe class="embed-responsive-item" src="{2}" allowfullscreen></iframe>
-        </div>
-    </div>
-</div>""".format(arguments[1], arguments[2], arguments[3])
-
-            # Replaces line with entire HTML
-            line = video
-        
-        # Hints
-        elif '::hints::' in line:   # Opening tag
-            # Initial HTML (object_id ensures unique ids if two hint
-            # objects occur within the same step)
-            hint_html = """<div class="card border-info mb-3">
-    <div class="card-header bg-info p-2">
-        <h5 class="mb-0">
-            <button class="btn btn-link text-white" data-toggle="collapse" data-target="#step{0}-hints" aria-expanded="true" aria-controls="step{0}-hints" style="text-decoration: none;">
-                <i class="fas fa-2x fa-question-circle"></i>
-                <span style="position: relative; bottom: 5px; left: 5px;">I need a hint</span>
-            </button>
-        </h5>
-    </div>
-
-    <div id="step{0}-hints" class="collapse">
-        <div class="card-body">\n""".format(object_id)  # BS4 card
-            add_line = False    # "::hints::" should not be added
-        elif '::/hint::' in line:   # End of one individual hint
-            # Stop recording HTML of the hint
-            # "::hint::" should not be added to HTML
-            recording_hint = False
-            add_line = False
-        elif recording_hint:    # Add current line to list containing
-                                # all hints
-            try:
-                # Adding line to current hint
-                hints[hint_counter - 1] = hints[hint_counter - 1] + '\n' + line
-            except IndexError:
-                # First line so index currently doesn't exist
-                hints.append(line)
-            # Do not add line to HTML as it will be added later
-            add_line = False
-        elif '::hint::' in line:    # Start recording HTML for a hint
-            hint_counter += 1
-            recording_hint = True
-            add_line = False
-        elif '::/hints::' in line:  # End of hints
-            hint_counter = 1    # Is reused as loop counter
-            # Put everything together
-
-            # BS4 navigation pills
-            hint_html += """<ul class="nav nav-pills" role="tablist">\n"""
-            for hint in hints:
-                if hint:    # In case of a blank line
-                    hint_html += """<li class="nav-item">
-    <a class="nav-link"""
-                    # First hint should be visible
-                    hint_html += ' active show"' if hint_counter == 1 else '"'
-                    hint_html += """ id="step{0}-hint{1}-tab" data-toggle="pill" href="#step{0}-hint{1}" role="tab" aria-controls="lesson{0}-hint{1}">Hint {1}</a>
-</li>\n""".format(object_id, hint_counter)
-                    hint_counter += 1
-            # Reset counter and close navigation pills HTML
-            hint_counter = 1
-            hint_html += """</ul>
-<div class="tab-content mt-2 border rounded px-3 pt-3">"""
-            
-            # BS4 pill/tab content
-            for hint in hints:
-                if hint:
-                    # Similar to above
-                    hint_html += '<div class="tab-pane fade'
-                    hint_html += ' show active"' if hint_counter == 1 else '"'
-                    hint_html += """ id="step{0}-hint{1}" role="tabpanel" aria-labelledby="step{0}-hint{1}">{2}</div>\n""".format(object_id, hint_counter, markdown(hint, output_format='html'))
-                    hint_counter += 1
-            # Close all open HTML tags and reset variables
-            hint_html += '</div></div></div></div>'
-            hint_counter = 1
-            hints = []
-
-            # Replace line with all the HTML
-            line = hint_html
-        
-        # CSS & JS specific to a page
-        elif ':css::' in line:
-            line = '<link rel="stylesheet" href="{0}" class="css-extra" />'.format(line.split('::')[1].strip())
-        elif ':js::' in line:
-            line = '<script type="text/javascript" src="{0}" class="js-extra"></script>'.format(line.split('::')[1].strip())
-
-        # Drag and Drop quiz
-        elif '::drag-and-drop::' in line:
-            recording_drag_and_drop = True
-            line = ''   # Or `add_line = False` could be used
-        elif '::/drag-and-drop::' in line:  # Turn options into a table
-            table = """<table class="table bg-secondary table-bordered text-white">\n"""
-            for option in drag_and_drop_options:
-                # Uses BS4 table
-                table += """    <tr>
-        <td>{0}</td>
-        <td class="blank bg-info"></td>
-    </tr>""".format(option)
-            table += "\n</table>"
-            line = table
-            recording_drag_and_drop = False
-            drag_and_drop_options = []
-        elif recording_drag_and_drop:
-            # Add options to the list
-            drag_and_drop_options.append(line)
-            line = ''
-        
-
-        # Collapse (similar to drag and drop)
-        elif ':collapse::' in line:
-            collapse_title = line.split('::')[1].strip()
-
-            # Add BS4 collapsible card (collapse_counter ensured unique
-            # IDs)
-            line = """<div class="card border-info mb-3">
-    <div class="card-header bg-info p-2">
-        <h5 class="mb-0">
-            <button class="btn btn-link text-white" data-toggle="collapse" data-target="#step{0}-collapse{1}" aria-expanded="true" aria-controls="step{0}-hints" style="text-decoration: none;">
-                <i class="fas fa-2x fa-info-circle"></i>
-                <span style="position: relative; bottom: 5px; left: 5px;">{2}</span>
-            </button>
-        </h5>
-    </div>
-
-    <div id="step{0}-collapse{1}" class="collapse">
-        <div class="card-body">\n""".format(object_id, collapse_counter, collapse_title)
-            recording_collapse = True   # Not really required
-        elif '::/collapse::' in line:   # Close open HTML tags
-            line = "</div></div></div>"
-            recording_collapse = False
-            collapse_counter += 1
-
-        # Glossary items
-        elif ':glossary-item::' in line:    
-            glossary_item = line.split('::')[1].strip()
-            line = """<div class="card mb-3">
-    <h5 class="card-header">{0}</h5>
-    <div class="card-body pb-1">""".format(glossary_item)
-            recording_collapse = True
-        
-        elif '::/glossary-item::' in line:
-            line = "</div></div>"
-            recording_collapse = False
-        
-        elif recording_collapse:    # Does nothing extra
-            line = markdown(line, output_format='html')
-        if add_line:
-            lines.append(line)
-        add_line = True
-    
-    # Join up the lines
-    finished_markdown = '\n'.join(lines)
-
-    # Add GFM extension and any extras passed as arguments
-    extensions_list = [GithubFlavoredMarkdownExtension()]
-    extensions_list.extend(extensions or [])
-    html = markdown(finished_markdown, output_format='html', extensions=extensions_list)
-    return html
-
 # Following three tables are association tables for many-to-many
 # relationships
 announcement_tags = db.Table("announcement_tags",
@@ -237,6 +39,14 @@ quiz_skills = db.Table("quiz_skills",
 )
 
 
+def bump_version(target):
+    """Marks that the content of `target` has changed so that cached
+    copies (see http_cache.py) are no longer used.
+    """
+    target.version = (target.version or 0) + 1
+    target.last_updated = datetime.utcnow()
+
+
 class Permission:
     """Contains the binary values for actions a user can or cannot do."""
     ASK_QUESTIONS = 0x01
@@ -257,6 +67,11 @@ class SearchableMixin(object):
     Based from the Flask-Mega Tutorial by Miguel Grinberg.
     """
 
+    # Fields returned with each hit by `search_hits()`; defaults to
+    # `__searchable__`. Fields that aren't searchable are stored in the
+    # index as well.
+    __search_source__ = None
+
     @classmethod
     def search(cls, expression, page, per_page):
         """Searches using `search.py` `query_index` function and
@@ -264,60 +79,99 @@ class SearchableMixin(object):
 
         Returns
         -------
-        Objects found : SQLAlchemy.BaseQuery
+        Objects found : list
+            In the order the search returned them
         
         Total objects found : int
         """
 
-        ids, total = query_index(cls.__tablename__, expression, page, per_page)
-        if total == 0:
-            # Return a blank query
-            return cls.query.filter_by(id=0), 0
-        
-        # Used in a SQL WHEN statement to order objects in the same order the search returned
-        when = []   
-        for i in range(len(ids)):   # enumerate() could also be used
-            when.append((ids[i], i))
+        ids, total = query_index(cls.__tablename__, expression, page,
+                                 per_page, fields=cls.__searchable__)
+        if not ids:
+            return [], total
 
-        # Filter: IF object id IN ids (above)
-        # ORDER BY: when list
-        return cls.query.filter(cls.id.in_(ids)).order_by(
-            db.case(when, value=cls.id)), total
+        # Put the objects back in the order the search returned them
+        objects = {obj.id: obj for obj in cls.query.filter(cls.id.in_(ids))}
+        return [objects[id] for id in ids if id in objects], total
 
     @classmethod
-    def before_commit(cls, session):
-        """Adds any changes to DB in a dictionary."""
-        session._changes = {
-            'add': list(session.new),
-            'update': list(session.dirty),
-            'delete': list(session.deleted)
-        }
+    def search_hits(cls, expression, page, per_page, highlight=True):
+        """Searches like `search()` but returns the hits straight from
+        the index without loading the objects from the database. Each hit
+        has the object's `id`, the fields in `__search_source__` and the
+        highlighted `highlights` of the fields that matched.
+
+        Returns
+        -------
+        Results : search.SearchResults
+            With the `hits`, the `total` and how long the search `took`
+        """
+        return search_index(cls.__tablename__, expression, page, per_page,
+                            cls.__searchable__, stored_fields(cls),
+                            cls.__search_source__ or cls.__searchable__,
+                            highlight)
 
     @classmethod
-    def after_commit(cls, session):
-        """Checks the changes and either adds, modifies or deletes from
-        the indices.
+    def after_flush(cls, session, flush_context):
+        """Records the index changes for the objects that have just been
+        flushed. Recorded here rather than in `before_commit` so that
+        objects flushed earlier in the transaction aren't missed and new
+        objects already have an id.
         """
-        for obj in session._changes['add']:
-            if isinstance(obj, SearchableMixin):
-                add_to_index(obj.__tablename__, obj)
-        for obj in session._changes['update']:
+        if not current_app.search_queue and not current_app.fulltext:
+            return
+        changes = {}
+        for obj in list(session.new) + list(session.dirty):
             if isinstance(obj, SearchableMixin):
-                add_to_index(obj.__tablename__, obj)
-        for obj in session._changes['delete']:
+                changes[(obj.__tablename__, obj.id)] = index_action(
+                    obj.__tablename__, obj)
+        for obj in session.deleted:
             if isinstance(obj, SearchableMixin):
-                remove_from_index(obj.__tablename__, obj)
-        session._changes = None
+                changes[(obj.__tablename__, obj.id)] = delete_action(
+                    obj.__tablename__, obj)
+        if not changes:
+            return
+        if current_app.fulltext:
+            # Kept up to date in the same transaction
+            current_app.fulltext.apply(session.connection(), changes.values())
+        if current_app.search_queue:
+            session.info.setdefault('search_changes', {}).update(changes)
+
+    @classmethod
+    def after_commit(cls, session):
+        """Queues the recorded changes to be sent to the indices."""
+        changes = session.info.pop('search_changes', None)
+        if changes and current_app.search_queue:
+            current_app.search_queue.put(changes.values())
 
     @classmethod
-    def reindex(cls):
-        """Utility method to reindex all objects."""
-        for obj in cls.query:
-            add_to_index(cls.__tablename__, obj)
+    def after_rollback(cls, session):
+        """Forgets the recorded changes."""
+        session.info.pop('search_changes', None)
+
+    @classmethod
+    def reindex(cls, chunk_size=500):
+        """Utility method to reindex all objects. Rows are streamed and
+        sent to the index in bulk requests of `chunk_size`.
+        """
+        if current_app.fulltext:
+            current_app.fulltext.rebuild(cls.__tablename__, cls.__searchable__,
+                                         stored_fields(cls))
+            db.session.commit()
+        if not current_app.search_queue:
+            return
+        batch = []
+        for obj in cls.query.yield_per(chunk_size):
+            batch.append(index_action(cls.__tablename__, obj))
+            if len(batch) >= chunk_size:
+                current_app.search_queue.send(batch)
+                batch = []
+        current_app.search_queue.send(batch)
 
 # Add events for automatic addition or deletion of the indices
-db.event.listen(db.session, 'before_commit', SearchableMixin.before_commit)
+db.event.listen(db.session, 'after_flush', SearchableMixin.after_flush)
 db.event.listen(db.session, 'after_commit', SearchableMixin.after_commit)
+db.event.listen(db.session, 'after_rollback', SearchableMixin.after_rollback)
 
 
 class Role(db.Model):
@@ -354,6 +208,7 @@ class Role(db.Model):
             role.default = roles[r][1]
             db.session.add(role)
         db.session.commit()
+        roles_lookup.invalidate()
 
     def __repr__(self):
         return '<Role %r>' % self.name
@@ -401,8 +256,10 @@ class User(UserMixin, db.Model):
 
     def __init__(self, **kwargs):
         super(User, self).__init__(**kwargs)
-        if self.role is None:
-            self.role = Role.query.filter_by(default=True).first()
+        if self.role is None and self.role_id is None:
+            default_role = roles_lookup.find(default=True)
+            if default_role is not None:
+                self.role_id = default_role.id
         self.avatar_hash = hashlib.md5(self.username.encode("utf-8")).hexdigest()
 
     def check_password(self, password):
@@ -412,13 +269,14 @@ class User(UserMixin, db.Model):
         return self.can(Permission.ADMINISTRATOR)
     
     def can(self, permissions):
-        return self.role is not None and (self.role.permissions & permissions) == permissions
+        role = roles_lookup.get(self.role_id) if self.role_id is not None else self.role
+        return role is not None and (role.permissions & permissions) == permissions
 
     def upcoming_assignments(self):
-        return self.assignments.filter(Assignment.due_date > datetime.now())
+        return self.assignments.filter(Assignment.due_date > datetime.utcnow())
     
     def past_assignments(self):
-        return self.assignments.filter(Assignment.due_date < datetime.now())
+        return self.assignments.filter(Assignment.due_date < datetime.utcnow())
     
     def getAvatar(self, size=100, default='identicon', rating='g'):
         if request.is_secure:
@@ -507,11 +365,14 @@ class Project(db.Model):
     thumbnail = db.Column(db.String(500))
     status = db.Column(db.Boolean, default=False)
     lesson_id = db.Column(db.Integer, db.ForeignKey('lessons.id'))
+    version = db.Column(db.Integer, default=1)  # Incremented when the content changes
+    last_updated = db.Column(db.DateTime, default=datetime.utcnow)
     steps = db.relationship('ProjectStep', backref='project', lazy='dynamic')
 
     @staticmethod
     def description_changed(target, value, oldvalue, initiator):
         target.description_html = customTagMarkdown(value)
+        bump_version(target)
 
     def what_model(self):
         return "Project"
@@ -527,11 +388,13 @@ class ProjectStep(db.Model):
     next_step_id = db.Column(db.Integer, db.ForeignKey('projectsteps.id'), nullable=True)
     next_step = db.relationship('ProjectStep', backref=db.backref('prev_step', uselist=False), remote_side=[id], uselist=False)
     last_updated = db.Column(db.DateTime, default=datetime.utcnow)
+    version = db.Column(db.Integer, default=1)  # Incremented when the content changes
     project_id = db.Column(db.Integer, db.ForeignKey('projects.id'))
 
     @staticmethod
     def content_changed(target, value, oldvalue, initiator):
         target.content_html = customTagMarkdown(value, target.id)
+        bump_version(target)
 
 db.event.listen(ProjectStep.content, 'set', ProjectStep.content_changed)
 
@@ -564,7 +427,7 @@ class Question(db.Model):
             return False
     
     def correct_answer(self):
-        if self.question_type == QuestionType.query.filter_by(code='M').first():
+        if self.question_type_id == question_types.id('M'):
             return [answer.option.text for answer in self.answer.all()]
         return self.answer.first().option.text
 
@@ -599,7 +462,7 @@ class Question(db.Model):
             char = pair.split('=')[1]
             options.append(self.options.offset(int(char) - 1).first())
 
-        if self.question_type != QuestionType.query.filter_by(code='D').first():
+        if self.question_type_id != question_types.id('D'):
             return ""
 
         spaces = self.html.split('<td class="blank bg-info"></td>')
@@ -652,6 +515,7 @@ class Quiz(db.Model):
     next_quiz_id = db.Column(db.Integer, db.ForeignKey('quizzes.id'), nullable=True)
     type_id = db.Column(db.Integer, db.ForeignKey('quiztypes.id'))
     next_quiz = db.relationship('Quiz', backref=db.backref('prev_quiz', uselist=False), remote_side=[id], uselist=False)
+    position = db.Column(db.Integer, index=True)   # Materialised order of next_quiz
     # questions = db.relationship('Question', backref='quiz', lazy='dynamic')
     assignments = db.relationship('Assignment', backref='quiz', lazy='dynamic')
     tested_skills = db.relationship('Skill', secondary=quiz_skills,
@@ -660,13 +524,13 @@ class Quiz(db.Model):
 
     @property
     def questions(self):
-        if self.type.code == 'P':
+        if self.type_id == quiz_types.id('P'):
             return self.tested_skills.first().questions # NOTE: Returns BaseQuery object and not list
         else:
             return None
 
     def title(self):
-        if self.type == QuizType.query.filter_by(code='P').first():
+        if self.type_id == quiz_types.id('P'):
             return self.tested_skills.first().description
         else:
             return self.lesson.title + ' - Chapter ' + self.lesson.chapter.title 
@@ -678,7 +542,7 @@ class Quiz(db.Model):
         return "Questions"
 
     def is_unlocked(self):
-        return current_user.assignments.filter_by(quiz_id=self.id).first() or current_user.can(Permission.MANAGE_CLASS)
+        return current_user.can(Permission.MANAGE_CLASS) or self.id in unlocked_ids(current_user).quizzes
 
 class QuizType(db.Model):
     __tablename__ = 'quiztypes'
@@ -695,6 +559,7 @@ class QuizType(db.Model):
                 t = QuizType(code=code, description=quiz_type)
                 db.session.add(t)
         db.session.commit()
+        quiz_types.invalidate()
 
 class Glossary(db.Model):
     __tablename__ = 'glossaries'
@@ -775,12 +640,63 @@ class QuizAttempt(db.Model):
     quiz = db.relationship('Quiz', backref=db.backref('quizattempts',
                 cascade='all, delete-orphan', lazy='dynamic'))
 
+# The following three tables are a rollup of quizattempts kept up to
+# date by app/progress.py whenever a quiz is submitted
+class StudentQuizProgress(db.Model):
+    __tablename__ = 'studentquizprogress'
+    id = db.Column(db.Integer, primary_key=True)
+    student_id = db.Column(db.Integer, db.ForeignKey('users.id'))
+    quiz_id = db.Column(db.Integer, db.ForeignKey('quizzes.id'), index=True)
+    best_score = db.Column(db.Integer)  # Best QuizAttempt.percent
+    last_updated = db.Column(db.DateTime, default=datetime.utcnow)
+    __table_args__ = (
+        db.UniqueConstraint('student_id', 'quiz_id',
+                            name='uq_studentquizprogress_student_id_quiz_id'),)
+
+class StudentLessonProgress(db.Model):
+    __tablename__ = 'studentlessonprogress'
+    id = db.Column(db.Integer, primary_key=True)
+    student_id = db.Column(db.Integer, db.ForeignKey('users.id'))
+    lesson_id = db.Column(db.Integer, db.ForeignKey('lessons.id'), index=True)
+    percent = db.Column(db.Integer) # Mean of the best score of every quiz
+    last_updated = db.Column(db.DateTime, default=datetime.utcnow)
+    __table_args__ = (
+        db.UniqueConstraint('student_id', 'lesson_id',
+                            name='uq_studentlessonprogress_student_id_lesson_id'),)
+
+class StudentChapterProgress(db.Model):
+    __tablename__ = 'studentchapterprogress'
+    id = db.Column(db.Integer, primary_key=True)
+    student_id = db.Column(db.Integer, db.ForeignKey('users.id'))
+    chapter_id = db.Column(db.Integer, db.ForeignKey('chapters.id'), index=True)
+    percent = db.Column(db.Integer) # Mean of the best score of every quiz
+    last_updated = db.Column(db.DateTime, default=datetime.utcnow)
+    __table_args__ = (
+        db.UniqueConstraint('student_id', 'chapter_id',
+                            name='uq_studentchapterprogress_student_id_chapter_id'),)
+
+# State of a quiz that is being taken (used by the SQL backend of
+# app/quiz_sessions.py)
+class QuizSession(db.Model):
+    __tablename__ = 'quizsessions'
+    id = db.Column(db.String(32), primary_key=True)
+    data = db.Column(db.Text)   # JSON
+    last_updated = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
 class AnswerStatus(db.Model):
     __tablename__ = 'answerstatus'
     id = db.Column(db.Integer, primary_key=True)
     description = db.Column(db.String(64))
     user_answer = db.relationship('UserAnswer', backref='answer_status', lazy='dynamic')
 
+    @staticmethod
+    def insert_types():
+        for description in ('Correct', 'Incorrect'):
+            if not AnswerStatus.query.filter_by(description=description).first():
+                db.session.add(AnswerStatus(description=description))
+        db.session.commit()
+        answer_statuses.invalidate()
+
 class Strand(db.Model):
     __tablename__ = 'strands'
     id = db.Column(db.Integer, primary_key=True)
@@ -797,14 +713,8 @@ class Strand(db.Model):
         return "Modules"
 
     def all_ordered_children(self):
-        ordered = []
-        if len(self.modules.all()) > 0:
-            def append_module(module):
-                ordered.append(module)
-                if module.next_module:
-                    append_module(module.next_module)
-            append_module(self.modules.filter_by(prev_module=None).first())
-        return ordered
+        # Ordered by the materialised position (see app/curriculum.py)
+        return self.modules.order_by(Module.position, Module.id).all()
 
 class Module(db.Model):
     __tablename__ = 'modules'
@@ -813,6 +723,7 @@ class Module(db.Model):
     description = db.Column(db.Text)
     next_module_id = db.Column(db.Integer, db.ForeignKey('modules.id'), nullable=True)
     next_module = db.relationship('Module', backref=db.backref('prev_module', uselist=False), remote_side=[id], uselist=False)
+    position = db.Column(db.Integer, index=True)   # Materialised order of next_module
     number = db.Column(db.Integer)
     strand_id = db.Column(db.Integer, db.ForeignKey('strands.id'))
     chapters = db.relationship('Chapter', backref='module', lazy='dynamic')
@@ -827,14 +738,7 @@ class Module(db.Model):
         return "Chapters"
 
     def all_ordered_children(self):
-        ordered = []
-        if len(self.chapters.all()) > 0:
-            def append_chapter(chapter):
-                ordered.append(chapter)
-                if chapter.next_chapter:
-                    append_chapter(chapter.next_chapter)
-            append_chapter(self.chapters.filter_by(prev_chapter=None).first())
-        return ordered
+        return self.chapters.order_by(Chapter.position, Chapter.id).all()
 
 class Chapter(db.Model):
     __tablename__ = 'chapters'
@@ -846,6 +750,7 @@ class Chapter(db.Model):
     active = db.Column(db.Boolean)
     next_chapter_id = db.Column(db.Integer, db.ForeignKey('chapters.id'), nullable=True)
     next_chapter = db.relationship('Chapter', backref=db.backref('prev_chapter', uselist=False), remote_side=[id], uselist=False)
+    position = db.Column(db.Integer, index=True)   # Materialised order of next_chapter
     module_id = db.Column(db.Integer, db.ForeignKey('modules.id'))
     lessons = db.relationship('Lesson', backref='chapter', lazy='dynamic')
 
@@ -859,33 +764,14 @@ class Chapter(db.Model):
         return "Lessons"
 
     def all_ordered_children(self):
-        ordered = []
-        if len(self.lessons.all()) > 0:
-            def append_lesson(lesson):
-                ordered.append(lesson)
-                if lesson.next_lesson:
-                    append_lesson(lesson.next_lesson)
-            append_lesson(self.lessons.filter_by(prev_lesson=None).first())
-        return ordered
+        return self.lessons.order_by(Lesson.position, Lesson.id).all()
 
     def student_progress(self, student):
-        quiz_scores = []
-        for lesson in self.lessons:
-            for quiz in lesson.quizzes:
-                best_score = QuizAttempt.query.filter_by(quiz_id=quiz.id, user_id=student.id).order_by(QuizAttempt.percent.desc()).first()
-                if not best_score:
-                    best_score = 0
-                else:
-                    best_score = best_score.percent
-                quiz_scores.append(best_score)
-        try:
-            average = (sum(quiz_scores) / len(quiz_scores)) # Mean of all scores
-        except ZeroDivisionError:
-            return 0
-        else:
-            return round(average)
+        progress = StudentChapterProgress.query.filter_by(
+            student_id=student.id, chapter_id=self.id).first()
+        return progress.percent if progress else 0
 
-class Lesson(db.Model):
+class Lesson(SearchableMixin, db.Model):
     __tablename__ = 'lessons'
     __searchable__ = ['title', 'overview']
 
@@ -897,6 +783,7 @@ class Lesson(db.Model):
     icon = db.Column(db.Text)
     next_lesson_id = db.Column(db.Integer, db.ForeignKey('lessons.id'), nullable=True)
     next_lesson = db.relationship('Lesson', backref=db.backref('prev_lesson', uselist=False), remote_side=[id], uselist=False)
+    position = db.Column(db.Integer, index=True)   # Materialised order of next_lesson
     chapter_id = db.Column(db.Integer, db.ForeignKey('chapters.id'))
     type_id = db.Column(db.Integer, db.ForeignKey('lessontypes.id'))
     skills = db.relationship('Skill', backref='lesson', lazy='dynamic')
@@ -922,24 +809,10 @@ class Lesson(db.Model):
             tags=allowed_tags, attributes=['class', 'id', 'href', 'alt', 'title', 'style', 'src']))
 
     def all_ordered_children(self):
-        ordered = []
-        if len(self.pages.all()) > 0:
-            def append_page(page):
-                ordered.append(page)
-                if page.next_page:
-                    append_page(page.next_page)
-            append_page(self.pages.filter_by(prev_page=None).first())
-        return ordered
+        return self.pages.order_by(Page.position, Page.id).all()
 
     def all_ordered_quizzes(self):
-        ordered = []
-        if len(self.quizzes.all()) > 0:
-            def append_quiz(quiz):
-                ordered.append(quiz)
-                if quiz.next_quiz:
-                    append_quiz(quiz.next_quiz)
-            append_quiz(self.quizzes.filter_by(prev_quiz=None).first())
-        return ordered
+        return self.quizzes.order_by(Quiz.position, Quiz.id).all()
 
 db.event.listen(Lesson.overview, 'set', Lesson.generate_new_html)
 
@@ -958,10 +831,12 @@ class LessonType(db.Model):
                 t = LessonType(code=code, description=lesson_type)
                 db.session.add(t)
         db.session.commit()
+        lesson_types.invalidate()
 
 class Page(SearchableMixin, db.Model):
     __tablename__ = 'pages'
     __searchable__ = ['title', 'text']
+    __search_source__ = ['title', 'page_type_id']
 
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(100))
@@ -971,6 +846,9 @@ class Page(SearchableMixin, db.Model):
     # prev_page_id = db.Column(db.Integer, db.ForeignKey('pages.id'), nullable=True)
     next_page_id = db.Column(db.Integer, db.ForeignKey('pages.id'), nullable=True)
     next_page = db.relationship('Page', backref=db.backref('prev_page', uselist=False), remote_side=[id], uselist=False)
+    position = db.Column(db.Integer, index=True)   # Materialised order of next_page
+    version = db.Column(db.Integer, default=1)  # Incremented when the content changes
+    last_updated = db.Column(db.DateTime, default=datetime.utcnow)
     questions = db.relationship('PageQuestion', backref='page', lazy='dynamic')
     assignments = db.relationship('Assignment', backref='page', lazy='dynamic')
     notes = db.relationship('TeacherNote', backref='page', lazy='dynamic')
@@ -985,9 +863,10 @@ class Page(SearchableMixin, db.Model):
         #                 'h1', 'h2', 'h3', 'p', 'img', 'footer', 'div', 'span', 'iframe']
         
         target.html = customTagMarkdown(value)
+        bump_version(target)
     
     def is_unlocked(self):
-        return current_user.assignments.filter_by(page_id=self.id).first() or current_user.can(Permission.MANAGE_CLASS)
+        return current_user.can(Permission.MANAGE_CLASS) or self.id in unlocked_ids(current_user).pages
 
     def __repr__(self):
         return '<Page %s>' % self.title
@@ -1009,6 +888,7 @@ class PageType(db.Model):
                 t = PageType(description=page_type)
                 db.session.add(t)
         db.session.commit()
+        page_types.invalidate()
 
 class PageQuestion(db.Model):
     __tablename__ = 'pagequestion'
@@ -1028,6 +908,7 @@ class PageQuestion(db.Model):
         target.html = bleach.linkify(bleach.clean(
             customTagMarkdown(value),
             tags=allowed_tags, attributes=['class', 'id', 'href', 'alt', 'title', 'style', 'src']))
+        target.last_updated = datetime.utcnow()
 
 db.event.listen(PageQuestion.text, 'set', PageQuestion.generate_new_html)
 
@@ -1048,6 +929,7 @@ class PageAnswer(db.Model):
         target.html = bleach.linkify(bleach.clean(
             customTagMarkdown(value),
             tags=allowed_tags, attributes=['class', 'id', 'href', 'alt', 'title', 'style', 'src']))
+        target.last_updated = datetime.utcnow()
 
 db.event.listen(PageAnswer.text, 'set', PageAnswer.generate_new_html)
 
@@ -1063,7 +945,7 @@ class Skill(db.Model):
     
     @property
     def practice_quiz(self):
-        return self.quizzes_tested.filter(Quiz.type_id == QuizType.query.filter_by(code='P').first().id).first()
+        return self.quizzes_tested.filter(Quiz.type_id == quiz_types.id('P')).first()
 
 class Class(db.Model):
     __tablename__ = 'classes'
@@ -1118,6 +1000,9 @@ class StudentAssignment(db.Model):
     assignment_id = db.Column(db.Integer, db.ForeignKey('assignments.id'))
     datetime = db.Column(db.DateTime, default=datetime.utcnow)
     score = db.Column(db.Integer)
+    due_date = db.Column(db.DateTime)   # Copy of the assignment's, for the student's assignment feed
+    __table_args__ = (db.Index('ix_student_assignments_student_id_due_date',
+                               'student_id', 'due_date'),)
 
 class ProblemMistake(db.Model):
     __tablename__ = 'problemmistakes'
@@ -1247,5 +1132,74 @@ class TeacherNote(db.Model):
         target.body_html = bleach.linkify(bleach.clean(
             customTagMarkdown(value),
             tags=allowed_tags, attributes=['class', 'id', 'href', 'alt', 'title', 'style', 'src']), callbacks=[set_target])
+        target.last_updated = datetime.utcnow()
 
 db.event.listen(TeacherNote.body, 'set', TeacherNote.body_changed)
+
+
+# Cached lookup tables, see lookups.py
+roles_lookup = LookupTable(Role, 'name')
+question_types = LookupTable(QuestionType, 'code')
+quiz_types = LookupTable(QuizType, 'code')
+answer_statuses = LookupTable(AnswerStatus, 'description')
+page_types = LookupTable(PageType, 'description')
+lesson_types = LookupTable(LessonType, 'code')
+
+
+def load_unlocked_ids(user_id):
+    """Loads the ids of the pages and quizzes assigned to a user in one
+    query.
+    """
+    page_ids, quiz_ids = set(), set()
+    assigned = db.session.query(Assignment.page_id, Assignment.quiz_id) \
+        .join(StudentAssignment, StudentAssignment.assignment_id == Assignment.id) \
+        .filter(StudentAssignment.student_id == user_id)
+    for page_id, quiz_id in assigned:
+        if page_id is not None:
+            page_ids.add(page_id)
+        if quiz_id is not None:
+            quiz_ids.add(quiz_id)
+    return UnlockedIds(frozenset(page_ids), frozenset(quiz_ids))
+
+
+# Pages and quizzes each user has unlocked, see unlocks.py
+unlocked_content = UnlockedContent(load_unlocked_ids)
+
+
+def unlocked_ids(user):
+    """Returns the ids of the pages and quizzes a user has been assigned
+    (as `UnlockedIds`).
+    """
+    return unlocked_content.get(user)
+
+
+def record_assigned_students(*student_ids):
+    """Makes the unlocked ids of the students be loaded again once the
+    current transaction is committed (for bulk inserts the session can't
+    see).
+    """
+    db.session.info.setdefault('assigned_students', set()).update(student_ids)
+
+
+def record_assignment_changes(session, flush_context):
+    """Records whose assignments have changed in the flush."""
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, StudentAssignment) and obj.student_id:
+            session.info.setdefault('assigned_students', set()).add(obj.student_id)
+
+
+def forget_unlocked_ids(session):
+    """Makes the unlocked ids of the recorded users be loaded again."""
+    student_ids = session.info.pop('assigned_students', None)
+    if student_ids:
+        unlocked_content.forget(*student_ids)
+
+
+def discard_assignment_changes(session):
+    """Forgets the recorded changes."""
+    session.info.pop('assigned_students', None)
+
+
+db.event.listen(db.session, 'after_flush', record_assignment_changes)
+db.event.listen(db.session, 'after_commit', forget_unlocked_ids)
+db.event.listen(db.session, 'after_rollback', discard_assignment_changes)
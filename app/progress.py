@@ -0,0 +1,256 @@
+"""app/progress.py
+
+Student progress through the curriculum. A student's progress in a
+lesson or chapter is the mean of their best score in every quiz of that
+lesson or chapter (quizzes that haven't been attempted count as 0).
+
+Progress is read from rollup tables (`StudentQuizProgress`,
+`StudentLessonProgress` and `StudentChapterProgress`) that are updated
+by `record_attempt()` whenever a quiz is submitted, so reading it never
+scans `quizattempts`.
+"""
+
+from collections import defaultdict
+from datetime import datetime
+
+from sqlalchemy.dialects import mysql, postgresql
+from sqlalchemy.sql.expression import func
+
+from app import db
+from app.models import (Lesson, Quiz, QuizAttempt, StudentChapterProgress,
+                        StudentLessonProgress, StudentQuizProgress)
+
+
+def best_scores(student_ids=None, quiz_ids=None):
+    """Returns the best score of each student in each quiz they have
+    attempted as a dictionary of `{(student_id, quiz_id): percent}`.
+
+    Calculated from `quizattempts` with a single aggregate query; used to
+    (re)build the rollup tables.
+    """
+    query = db.session.query(QuizAttempt.user_id, QuizAttempt.quiz_id,
+                             func.max(QuizAttempt.percent))
+    if student_ids is not None:
+        query = query.filter(QuizAttempt.user_id.in_(student_ids))
+    if quiz_ids is not None:
+        query = query.filter(QuizAttempt.quiz_id.in_(quiz_ids))
+    query = query.group_by(QuizAttempt.user_id, QuizAttempt.quiz_id)
+    return {(user_id, quiz_id): percent or 0
+            for user_id, quiz_id, percent in query}
+
+
+def curriculum_quizzes(chapter_ids=None):
+    """Returns `(quiz_id, lesson_id, chapter_id)` for every quiz (in
+    the given chapters).
+    """
+    query = db.session.query(Quiz.id, Lesson.id, Lesson.chapter_id) \
+        .join(Lesson, Quiz.lesson_id == Lesson.id)
+    if chapter_ids is not None:
+        query = query.filter(Lesson.chapter_id.in_(chapter_ids))
+    return query.all()
+
+
+def _mean(scores):
+    try:
+        return round(sum(scores) / len(scores))
+    except ZeroDivisionError:
+        return 0
+
+
+def _insert_if_missing(model, keys):
+    """Returns an INSERT of a `model` row with `keys` that does nothing
+    if the row already exists (the unique constraint would fail).
+    """
+    table = model.__table__
+    dialect = db.session.get_bind(model.__mapper__).dialect.name
+    if dialect == 'mysql':
+        insert = mysql.insert(table).values(**keys)
+        return insert.on_duplicate_key_update(id=table.c.id)
+    if dialect == 'postgresql':
+        return postgresql.insert(table).values(**keys) \
+            .on_conflict_do_nothing()
+    return table.insert().values(**keys).prefix_with('OR IGNORE')  # SQLite
+
+
+def _get_or_create(model, **keys):
+    """Returns the rollup row with `keys` (e.g. `student_id` and
+    `quiz_id`), inserting it if there isn't one.
+
+    Two submissions can both find no row and try to insert it, so the
+    row is upserted and then selected again. That select locks the row:
+    a locking read sees the row the other submission inserted, whereas
+    a plain one could still read the snapshot taken before it (MySQL's
+    REPEATABLE READ).
+    """
+    row = model.query.filter_by(**keys).first()
+    if row is not None:
+        return row
+    db.session.execute(_insert_if_missing(model, keys))
+    return model.query.filter_by(**keys).with_for_update().one()
+
+
+def _update_rollup(model, key, student_ids, group_ids, group_quizzes,
+                   scores):
+    """Writes the mean score of each group of quizzes (lesson or chapter)
+    for every student into the rollup table `model`.
+    """
+    group_column = getattr(model, key)
+    existing = {
+        (row.student_id, getattr(row, key)): row
+        for row in model.query.filter(model.student_id.in_(student_ids),
+                                      group_column.in_(group_ids))
+    }
+    for student_id in student_ids:
+        for group_id, quiz_ids in group_quizzes.items():
+            percent = _mean([scores.get((student_id, quiz_id), 0)
+                             for quiz_id in quiz_ids])
+            row = existing.pop((student_id, group_id), None)
+            if row is None:
+                if not percent:
+                    continue    # No row is the same as 0%
+                row = _get_or_create(model, student_id=student_id,
+                                     **{key: group_id})
+            if row.percent == percent:
+                continue
+            row.percent = percent
+            row.last_updated = datetime.utcnow()
+            db.session.add(row)
+    for row in existing.values():
+        # The lesson or chapter no longer has any quizzes
+        db.session.delete(row)
+
+
+def _refresh(student_ids, chapter_ids):
+    """Recalculates the lesson and chapter rollups of the given students
+    in the given chapters from `StudentQuizProgress`.
+    """
+    student_ids = list(student_ids)
+    chapter_ids = list(chapter_ids)
+    if not student_ids or not chapter_ids:
+        return
+    db.session.flush()
+    lesson_quizzes = defaultdict(list)
+    chapter_quizzes = defaultdict(list)
+    lesson_ids = set()
+    for quiz_id, lesson_id, chapter_id in curriculum_quizzes(chapter_ids):
+        lesson_quizzes[lesson_id].append(quiz_id)
+        chapter_quizzes[chapter_id].append(quiz_id)
+        lesson_ids.add(lesson_id)
+    lesson_ids.update(lesson_id for lesson_id, in db.session.query(
+        StudentLessonProgress.lesson_id).join(
+        Lesson, StudentLessonProgress.lesson_id == Lesson.id).filter(
+        Lesson.chapter_id.in_(chapter_ids)).distinct())
+
+    quiz_ids = [quiz_id for quiz_ids in chapter_quizzes.values()
+                for quiz_id in quiz_ids]
+    scores = {}
+    if quiz_ids:
+        query = db.session.query(StudentQuizProgress.student_id,
+                                 StudentQuizProgress.quiz_id,
+                                 StudentQuizProgress.best_score) \
+            .filter(StudentQuizProgress.student_id.in_(student_ids),
+                    StudentQuizProgress.quiz_id.in_(quiz_ids))
+        scores = {(student_id, quiz_id): best_score or 0
+                  for student_id, quiz_id, best_score in query}
+
+    _update_rollup(StudentLessonProgress, 'lesson_id', student_ids,
+                   lesson_ids, lesson_quizzes, scores)
+    _update_rollup(StudentChapterProgress, 'chapter_id', student_ids,
+                   chapter_ids, chapter_quizzes, scores)
+
+
+def record_attempt(attempt):
+    """Updates the rollups after `attempt` (a new `QuizAttempt`) has been
+    added to the session. Nothing but the quiz row is touched unless the
+    attempt beats the student's best score. The caller commits.
+    """
+    progress = _get_or_create(StudentQuizProgress, student_id=attempt.user_id,
+                              quiz_id=attempt.quiz_id)
+    score = round(attempt.percent or 0)
+    if progress.best_score is not None and progress.best_score >= score:
+        return
+    progress.best_score = score
+    progress.last_updated = datetime.utcnow()
+    db.session.add(progress)
+
+    chapter_id = db.session.query(Lesson.chapter_id).join(
+        Quiz, Quiz.lesson_id == Lesson.id).filter(
+        Quiz.id == attempt.quiz_id).scalar()
+    if chapter_id is not None:
+        _refresh([attempt.user_id], [chapter_id])
+
+
+def refresh_progress(chapter_ids):
+    """Recalculates the rollups of every student in the given chapters.
+
+    Must be called when quizzes are added to or moved between lessons,
+    as that changes what each lesson and chapter mean is taken over.
+    """
+    chapter_ids = [chapter_id for chapter_id in set(chapter_ids)
+                   if chapter_id is not None]
+    if not chapter_ids:
+        return
+    quiz_ids = [quiz_id for quiz_id, _, _ in curriculum_quizzes(chapter_ids)]
+    student_ids = {student_id for student_id, in db.session.query(
+        StudentChapterProgress.student_id).filter(
+        StudentChapterProgress.chapter_id.in_(chapter_ids)).distinct()}
+    if quiz_ids:
+        student_ids.update(student_id for student_id, in db.session.query(
+            StudentQuizProgress.student_id).filter(
+            StudentQuizProgress.quiz_id.in_(quiz_ids)).distinct())
+    _refresh(student_ids, chapter_ids)
+    db.session.commit()
+
+
+def rebuild_progress():
+    """Utility method to rebuild all the rollups from `quizattempts`."""
+    StudentChapterProgress.query.delete()
+    StudentLessonProgress.query.delete()
+    StudentQuizProgress.query.delete()
+    scores = best_scores()
+    db.session.bulk_insert_mappings(StudentQuizProgress, [
+        {'student_id': student_id, 'quiz_id': quiz_id,
+         'best_score': round(score), 'last_updated': datetime.utcnow()}
+        for (student_id, quiz_id), score in scores.items()
+    ])
+    chapter_ids = {chapter_id for _, _, chapter_id in curriculum_quizzes()}
+    _refresh({student_id for student_id, _ in scores}, chapter_ids)
+    db.session.commit()
+
+
+def class_chapter_progress(student_ids, chapter_ids=None):
+    """Returns the progress of several students in every chapter.
+
+    Paramaters
+    ----------
+    student_ids : list
+        IDs of the students
+    chapter_ids : list
+        Limit the result to these chapters (default None, every chapter)
+
+    Returns
+    -------
+    Progress : dict
+        `{student_id: {chapter_id: percent}}`. Chapters with no progress
+        are left out; use `.get(chapter_id, 0)` to look a chapter up.
+    """
+    student_ids = list(student_ids)
+    progress = {student_id: {} for student_id in student_ids}
+    if not student_ids:
+        return progress
+    query = StudentChapterProgress.query.filter(
+        StudentChapterProgress.student_id.in_(student_ids))
+    if chapter_ids is not None:
+        query = query.filter(StudentChapterProgress.chapter_id.in_(chapter_ids))
+    for row in query:
+        progress[row.student_id][row.chapter_id] = row.percent
+    return progress
+
+
+def chapter_progress(student, chapter_ids=None):
+    """Returns the progress of one student in every chapter as a
+    dictionary of `{chapter_id: percent}`.
+    """
+    if not student.is_authenticated:
+        return {}
+    return class_chapter_progress([student.id], chapter_ids)[student.id]
@@ -0,0 +1,157 @@
+"""app/quiz_sessions.py
+
+Server-side storage of the quiz that a user is taking. The question ids,
+answers, attempt counts and scores used by `take_quiz`, `check`,
+`get_hint` and `summary` used to be kept in the (signed cookie) session,
+which grew with every answer. Now only the id of the quiz session is
+kept in the cookie and the state itself is kept by a store:
+
+    'sql'   A row in the `quizsessions` table (default)
+    'file'  A JSON file per quiz session in `QUIZ_SESSION_DIR`
+
+The store is chosen with the `QUIZ_SESSION_STORE` config variable.
+"""
+
+import json
+import os
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from flask import current_app, session
+
+from app import db
+from app.models import QuizSession
+
+SESSION_KEY = 'quiz_session_id'
+
+
+def new_quiz_state(question_ids):
+    """Returns the state of a quiz that has just been started."""
+    return {
+        'questions': list(question_ids),
+        'attempt_no': 0,
+        'num_hints_used': 0,
+        'user_results': [],
+        'no_attempts': [],
+        'scores': [],
+        'answered': [],     # IDs of the questions the results are for
+    }
+
+
+class SQLQuizSessionStore(object):
+    """Keeps quiz sessions in the `quizsessions` table. Changes are
+    committed with the rest of the request.
+    """
+
+    def load(self, session_id):
+        row = QuizSession.query.get(session_id)
+        if row is None:
+            return None
+        return json.loads(row.data)
+
+    def save(self, session_id, state):
+        row = QuizSession.query.get(session_id)
+        if row is None:
+            row = QuizSession(id=session_id)
+        row.data = json.dumps(state)
+        row.last_updated = datetime.utcnow()
+        db.session.add(row)
+
+    def delete(self, session_id):
+        QuizSession.query.filter_by(id=session_id).delete()
+
+    def purge(self, max_age):
+        """Deletes quiz sessions that haven't been used for `max_age`
+        seconds. Returns how many were deleted.
+        """
+        cutoff = datetime.utcnow() - timedelta(seconds=max_age)
+        deleted = QuizSession.query.filter(
+            QuizSession.last_updated < cutoff).delete()
+        db.session.commit()
+        return deleted
+
+
+class FileQuizSessionStore(object):
+    """Keeps each quiz session in its own JSON file. Files are replaced
+    atomically so several workers can share the directory.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, session_id):
+        return os.path.join(self.directory, session_id + '.json')
+
+    def load(self, session_id):
+        try:
+            with open(self._path(session_id)) as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return None
+
+    def save(self, session_id, state):
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(state, f)
+        os.replace(temp_path, self._path(session_id))
+
+    def delete(self, session_id):
+        try:
+            os.remove(self._path(session_id))
+        except OSError:
+            pass
+
+    def purge(self, max_age):
+        cutoff = time.time() - max_age
+        deleted = 0
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+                    deleted += 1
+            except OSError:
+                pass
+        return deleted
+
+
+def make_quiz_session_store(config):
+    """Creates the store selected by `config['QUIZ_SESSION_STORE']`."""
+    backend = config.get('QUIZ_SESSION_STORE', 'sql')
+    if backend == 'sql':
+        return SQLQuizSessionStore()
+    if backend == 'file':
+        return FileQuizSessionStore(config['QUIZ_SESSION_DIR'])
+    raise ValueError('Unknown quiz session store {0!r}'.format(backend))
+
+
+def start_quiz_session(question_ids):
+    """Starts a new quiz session for the current user (replacing any
+    previous one) and returns its state.
+    """
+    store = current_app.quiz_session_store
+    old_session_id = session.pop(SESSION_KEY, None)
+    if old_session_id is not None:
+        store.delete(old_session_id)
+    session[SESSION_KEY] = uuid.uuid4().hex
+    state = new_quiz_state(question_ids)
+    store.save(session[SESSION_KEY], state)
+    return state
+
+
+def get_quiz_session():
+    """Returns the state of the current user's quiz session, or None if
+    they haven't started a quiz (or it has expired).
+    """
+    session_id = session.get(SESSION_KEY)
+    if session_id is None:
+        return None
+    return current_app.quiz_session_store.load(session_id)
+
+
+def save_quiz_session(state):
+    """Saves the state of the current user's quiz session."""
+    current_app.quiz_session_store.save(session[SESSION_KEY], state)
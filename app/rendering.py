@@ -0,0 +1,329 @@
+"""app/rendering.py
+
+Renders the custom Markdown dialect used by pages, project steps,
+questions, posts, etc. to HTML.
+
+Markdown instances are expensive to build (especially with the GFM
+extension), so each thread keeps its own and `reset()`s it between
+documents. Rendered HTML is cached by a hash of the source so that
+content which is rendered repeatedly (admin previews, bulk edits) is
+only converted once.
+"""
+
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+
+from markdown import Markdown
+from mdx_gfm import GithubFlavoredMarkdownExtension
+
+# Every custom tag. A line is scanned for all of them at once; the
+# lookahead means overlapping tags (e.g. ":video::" inside "::video::")
+# are all found.
+CUSTOM_TAGS = (':video::', '::hints::', '::/hint::', '::hint::',
+               '::/hints::', ':css::', ':js::', '::drag-and-drop::',
+               '::/drag-and-drop::', ':collapse::', '::/collapse::',
+               ':glossary-item::', '::/glossary-item::')
+TAG_PATTERN = re.compile(
+    '(?=({0}))'.format('|'.join(re.escape(tag) for tag in CUSTOM_TAGS)))
+NO_TAGS = frozenset()
+
+
+def find_tags(line):
+    """Returns the set of custom tags in a line of markdown."""
+    if '::' not in line:    # Every tag contains "::"
+        return NO_TAGS
+    return frozenset(TAG_PATTERN.findall(line))
+
+
+def expand_custom_tags(original_mardown, object_id, convert):
+    """Replaces the custom tags in markdown with their HTML.
+
+    Paramaters
+    ----------
+    original_markdown : str
+        Markdown to be converted
+    object_id : int
+        ID of the model that is converting the markdown
+    convert : function
+        Converts a fragment of plain markdown (hints, collapse lines) to
+        HTML
+
+    Returns
+    -------
+    Markdown with custom tags replaced : str
+    """
+
+
+    # Initialising variables
+    lines = []  # Markdown split into individual lines
+    hint_counter = 0    # Stores what hint # the program is at
+    collapse_counter = 1    # Stores what collapse no the program is at
+    hints = []  # List of hints
+    drag_and_drop_options = []  # Options in a drag and drop question
+    recording_hint = False  # If a hint tag is in progress
+    recording_collapse = False  # If a collapse tag is in progress
+    recording_drag_and_drop = False # If a drag and drop tag is in progress
+    add_line = True # If the program should add the current line to the
+                    # end HTML
+    for line in original_mardown.split('\n'):   # Splits markdown by newline
+        tags = find_tags(line)   # Custom tags in the line
+        if ':video::' in tags:  # Video (also used for Scratch embed)
+            # Splits arguments and creates HTML
+            arguments = line.split('::')
+
+            # arguments[0] = "video" from tag (not used)
+            # arguments[1] = Bootstrap grid class
+            # arguments[2] = Aspect ratio
+            # arguments[3] = Embed link
+            video = """<div class="row" style="margin-bottom:20px">
+    <div class="{0}">
+        <div class="embed-responsive embed-responsive-{1}">
+            <iframe class="embed-responsive-item" src="{2}" allowfullscreen></iframe>
+        </div>
+    </div>
+</div>""".format(arguments[1], arguments[2], arguments[3])
+
+            # Replaces line with entire HTML
+            line = video
+        
+        # Hints
+        elif '::hints::' in tags:   # Opening tag
+            # Initial HTML (object_id ensures unique ids if two hint
+            # objects occur within the same step)
+            hint_html = """<div class="card border-info mb-3">
+    <div class="card-header bg-info p-2">
+        <h5 class="mb-0">
+            <button class="btn btn-link text-white" data-toggle="collapse" data-target="#step{0}-hints" aria-expanded="true" aria-controls="step{0}-hints" style="text-decoration: none;">
+                <i class="fas fa-2x fa-question-circle"></i>
+                <span style="position: relative; bottom: 5px; left: 5px;">I need a hint</span>
+            </button>
+        </h5>
+    </div>
+
+    <div id="step{0}-hints" class="collapse">
+        <div class="card-body">\n""".format(object_id)  # BS4 card
+            add_line = False    # "::hints::" should not be added
+        elif '::/hint::' in tags:   # End of one individual hint
+            # Stop recording HTML of the hint
+            # "::hint::" should not be added to HTML
+            recording_hint = False
+            add_line = False
+        elif recording_hint:    # Add current line to list containing
+                                # all hints
+            try:
+                # Adding line to current hint
+                hints[hint_counter - 1] = hints[hint_counter - 1] + '\n' + line
+            except IndexError:
+                # First line so index currently doesn't exist
+                hints.append(line)
+            # Do not add line to HTML as it will be added later
+            add_line = False
+        elif '::hint::' in tags:    # Start recording HTML for a hint
+            hint_counter += 1
+            recording_hint = True
+            add_line = False
+        elif '::/hints::' in tags:  # End of hints
+            hint_counter = 1    # Is reused as loop counter
+            # Put everything together
+
+            # BS4 navigation pills
+            hint_html += """<ul class="nav nav-pills" role="tablist">\n"""
+            for hint in hints:
+                if hint:    # In case of a blank line
+                    hint_html += """<li class="nav-item">
+    <a class="nav-link"""
+                    # First hint should be visible
+                    hint_html += ' active show"' if hint_counter == 1 else '"'
+                    hint_html += """ id="step{0}-hint{1}-tab" data-toggle="pill" href="#step{0}-hint{1}" role="tab" aria-controls="lesson{0}-hint{1}">Hint {1}</a>
+</li>\n""".format(object_id, hint_counter)
+                    hint_counter += 1
+            # Reset counter and close navigation pills HTML
+            hint_counter = 1
+            hint_html += """</ul>
+<div class="tab-content mt-2 border rounded px-3 pt-3">"""
+            
+            # BS4 pill/tab content
+            for hint in hints:
+                if hint:
+                    # Similar to above
+                    hint_html += '<div class="tab-pane fade'
+                    hint_html += ' show active"' if hint_counter == 1 else '"'
+                    hint_html += """ id="step{0}-hint{1}" role="tabpanel" aria-labelledby="step{0}-hint{1}">{2}</div>\n""".format(object_id, hint_counter, convert(hint))
+                    hint_counter += 1
+            # Close all open HTML tags and reset variables
+            hint_html += '</div></div></div></div>'
+            hint_counter = 1
+            hints = []
+
+            # Replace line with all the HTML
+            line = hint_html
+        
+        # CSS & JS specific to a page
+        elif ':css::' in tags:
+            line = '<link rel="stylesheet" href="{0}" class="css-extra" />'.format(line.split('::')[1].strip())
+        elif ':js::' in tags:
+            line = '<script type="text/javascript" src="{0}" class="js-extra"></script>'.format(line.split('::')[1].strip())
+
+        # Drag and Drop quiz
+        elif '::drag-and-drop::' in tags:
+            recording_drag_and_drop = True
+            line = ''   # Or `add_line = False` could be used
+        elif '::/drag-and-drop::' in tags:  # Turn options into a table
+            table = """<table class="table bg-secondary table-bordered text-white">\n"""
+            for option in drag_and_drop_options:
+                # Uses BS4 table
+                table += """    <tr>
+        <td>{0}</td>
+        <td class="blank bg-info"></td>
+    </tr>""".format(option)
+            table += "\n</table>"
+            line = table
+            recording_drag_and_drop = False
+            drag_and_drop_options = []
+        elif recording_drag_and_drop:
+            # Add options to the list
+            drag_and_drop_options.append(line)
+            line = ''
+        
+
+        # Collapse (similar to drag and drop)
+        elif ':collapse::' in tags:
+            collapse_title = line.split('::')[1].strip()
+
+            # Add BS4 collapsible card (collapse_counter ensured unique
+            # IDs)
+            line = """<div class="card border-info mb-3">
+    <div class="card-header bg-info p-2">
+        <h5 class="mb-0">
+            <button class="btn btn-link text-white" data-toggle="collapse" data-target="#step{0}-collapse{1}" aria-expanded="true" aria-controls="step{0}-hints" style="text-decoration: none;">
+                <i class="fas fa-2x fa-info-circle"></i>
+                <span style="position: relative; bottom: 5px; left: 5px;">{2}</span>
+            </button>
+        </h5>
+    </div>
+
+    <div id="step{0}-collapse{1}" class="collapse">
+        <div class="card-body">\n""".format(object_id, collapse_counter, collapse_title)
+            recording_collapse = True   # Not really required
+        elif '::/collapse::' in tags:   # Close open HTML tags
+            line = "</div></div></div>"
+            recording_collapse = False
+            collapse_counter += 1
+
+        # Glossary items
+        elif ':glossary-item::' in tags:    
+            glossary_item = line.split('::')[1].strip()
+            line = """<div class="card mb-3">
+    <h5 class="card-header">{0}</h5>
+    <div class="card-body pb-1">""".format(glossary_item)
+            recording_collapse = True
+        
+        elif '::/glossary-item::' in tags:
+            line = "</div></div>"
+            recording_collapse = False
+        
+        elif recording_collapse:    # Does nothing extra
+            line = convert(line)
+        if add_line:
+            lines.append(line)
+        add_line = True
+    
+    # Join up the lines
+    return '\n'.join(lines)
+
+
+class CustomTagRenderer(object):
+    """Renders markdown with the custom tags to HTML.
+
+    Paramaters
+    ----------
+    cache_size : int
+        Maximum number of rendered documents kept in the cache
+        (default 256, 0 disables the cache)
+    """
+
+    def __init__(self, cache_size=256):
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self._local = threading.local()
+
+    def _markdown(self, name, extensions):
+        """Returns this thread's Markdown instance called `name`."""
+        md = getattr(self._local, name, None)
+        if md is None:
+            md = Markdown(output_format='html', extensions=extensions)
+            setattr(self._local, name, md)
+        return md.reset()
+
+    def convert_fragment(self, text):
+        """Converts plain markdown (no extensions) to HTML."""
+        return self._markdown('plain', []).convert(text)
+
+    def convert_document(self, text, extensions=None):
+        """Converts markdown to HTML with the GFM extension."""
+        if extensions:
+            # Unusual, so not worth keeping an instance for
+            extensions_list = [GithubFlavoredMarkdownExtension()]
+            extensions_list.extend(extensions)
+            return Markdown(output_format='html',
+                            extensions=extensions_list).convert(text)
+        return self._markdown('gfm', [GithubFlavoredMarkdownExtension()]) \
+            .convert(text)
+
+    def _cache_key(self, text, object_id):
+        digest = hashlib.sha1(text.encode('utf-8')).hexdigest()
+        return digest, object_id
+
+    def render(self, original_mardown, object_id=None, extensions=None):
+        """Renders markdown to HTML with modified custom Markdown syntax,
+        using the cache unless extra extensions are given.
+        """
+        use_cache = self.cache_size > 0 and not extensions
+        if use_cache:
+            key = self._cache_key(original_mardown, object_id)
+            with self._cache_lock:
+                html = self._cache.get(key)
+                if html is not None:
+                    self._cache.move_to_end(key)
+                    return html
+
+        finished_markdown = expand_custom_tags(original_mardown, object_id,
+                                               self.convert_fragment)
+        html = self.convert_document(finished_markdown, extensions)
+
+        if use_cache:
+            with self._cache_lock:
+                self._cache[key] = html
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return html
+
+    def clear_cache(self):
+        with self._cache_lock:
+            self._cache.clear()
+
+
+renderer = CustomTagRenderer()
+
+
+def customTagMarkdown(original_mardown, object_id=None, extensions=None):
+    """Renders markdown to HTML with modified custom Markdown syntax.
+    
+    Paramaters
+    ----------
+    original_markdown : str
+        Markdown to be converted
+    object_id : int
+        ID of the model that is converting the markdown (default None)
+    extensions : list
+        Any additional extensions to be added to markdown converter
+        (default None)
+
+    Returns
+    -------
+    Converted HTML : str
+    """
+    return renderer.render(original_mardown, object_id, extensions)
@@ -1,28 +1,489 @@
+"""app/search.py
+
+Elasticsearch helpers. Changes to searchable models are not sent one
+document at a time; they are put on an `IndexingQueue` which sends them
+with the bulk API, from a background thread by default.
+
+Without Elasticsearch, searches fall back to the database's own
+full-text search (SQLite FTS5 or MySQL FULLTEXT).
+"""
+
+import atexit
+import logging
+import re
+import sqlite3
+import threading
+import time
+from queue import Empty, Queue
+
+from elasticsearch import TransportError
 from flask import current_app
+from markupsafe import Markup, escape
+from sqlalchemy import text
 
+from app import db
 
-def add_to_index(index, model):
-    if not current_app.elasticsearch:
-        return
+logger = logging.getLogger(__name__)
+
+
+def stored_fields(model):
+    """Returns the fields of `model` that are stored in the index (so
+    they can be shown in results) but not searched.
+    """
+    source = getattr(model, '__search_source__', None) or []
+    return [field for field in source if field not in model.__searchable__]
+
+
+def document(model):
+    """Returns the searchable and stored fields of `model` as a
+    dictionary.
+    """
     payload = {}
-    for field in model.__searchable__:
+    for field in list(model.__searchable__) + stored_fields(model):
         payload[field] = getattr(model, field)
-    current_app.elasticsearch.index(index=index, doc_type=index, id=model.id,
-                                    body=payload)
+    return payload
+
+
+def index_action(index, model):
+    """Returns an action that adds or updates `model` in the index."""
+    return {'op': 'index', 'index': index, 'id': model.id,
+            'body': document(model), 'stored': stored_fields(model)}
+
+
+def delete_action(index, model):
+    """Returns an action that removes `model` from the index."""
+    return {'op': 'delete', 'index': index, 'id': model.id}
+
+
+def bulk(elasticsearch, actions):
+    """Sends `actions` in a single bulk request.
+
+    Returns
+    -------
+    Failed actions : list
+        Actions that failed with an error worth retrying (the cluster
+        was busy or had a server error). Other failures are logged and
+        dropped; deleting a document that isn't indexed is not an error.
+    """
+    body = []
+    for action in actions:
+        header = {'_index': action['index'], '_id': action['id']}
+        body.append({action['op']: header})
+        if action['op'] == 'index':
+            body.append(action['body'])
+    response = elasticsearch.bulk(body=body)
+    if not response.get('errors'):
+        return []
+
+    retry = []
+    for action, item in zip(actions, response['items']):
+        result = item[action['op']]
+        status = result.get('status', 500)
+        if status == 429 or status >= 500:
+            retry.append(action)
+        elif status >= 300 and not (action['op'] == 'delete' and status == 404):
+            logger.error('Could not %s %s/%s: %s', action['op'],
+                         action['index'], action['id'], result.get('error'))
+    return retry
+
+
+class IndexingQueue(object):
+    """Sends index and delete actions to Elasticsearch in batches.
+
+    Paramaters
+    ----------
+    elasticsearch : Elasticsearch
+        The client to send the actions with
+    asynchronous : bool
+        Send actions from a background thread (default True). If False,
+        `put()` sends them before returning.
+    batch_size : int
+        Most actions sent in one bulk request (default 500)
+    flush_interval : float
+        Seconds the background thread waits for a batch to fill up
+        (default 1)
+    max_retries : int
+        Times a failed batch is retried before it is dropped (default 5)
+    retry_delay : float
+        Seconds before the first retry, doubled after every retry
+        (default 0.5)
+    """
+
+    def __init__(self, elasticsearch, asynchronous=True, batch_size=500,
+                 flush_interval=1.0, max_retries=5, retry_delay=0.5):
+        self.elasticsearch = elasticsearch
+        self.asynchronous = asynchronous
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self._queue = Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def put(self, actions):
+        """Queues actions to be sent."""
+        actions = list(actions)
+        if not self.asynchronous:
+            self.send(actions)
+            return
+        for action in actions:
+            self._queue.put(action)
+        self._start_worker()
+
+    def send(self, actions):
+        """Sends actions now, in batches of `batch_size`, retrying
+        failures.
+        """
+        actions = list(actions)
+        for start in range(0, len(actions), self.batch_size):
+            self._send_batch(actions[start:start + self.batch_size])
+
+    def flush(self):
+        """Blocks until every queued action has been sent."""
+        if self._thread is not None:
+            self._queue.join()
+
+    def _send_batch(self, batch):
+        for attempt in range(self.max_retries + 1):
+            try:
+                batch = bulk(self.elasticsearch, batch)
+            except TransportError as e:
+                # Includes connection errors and timeouts
+                logger.warning('Bulk indexing failed: %s', e)
+            if not batch:
+                return
+            if attempt < self.max_retries:
+                time.sleep(self.retry_delay * 2 ** attempt)
+        logger.error('Gave up indexing %d documents', len(batch))
+
+    def _start_worker(self):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            if self._thread is None:
+                atexit.register(self.flush)
+            self._thread = threading.Thread(target=self._work,
+                                            name='search-indexer')
+            self._thread.daemon = True
+            self._thread.start()
+
+    def _next_batch(self):
+        """Waits for an action and then collects more until the batch is
+        full or `flush_interval` has passed.
+        """
+        batch = [self._queue.get()]
+        deadline = time.time() + self.flush_interval
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=timeout))
+            except Empty:
+                break
+        return batch
+
+    def _work(self):
+        while True:
+            batch = self._next_batch()
+            try:
+                # Only the latest action for each document matters
+                latest = {}
+                for action in batch:
+                    latest.pop((action['index'], action['id']), None)
+                    latest[(action['index'], action['id'])] = action
+                self._send_batch(list(latest.values()))
+            except Exception:
+                logger.exception('Search indexer failed')
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+
+class SearchResults(object):
+    """A page of search results.
+
+    Attributes
+    ----------
+    hits : list
+        Dictionaries with the `id` of each object found, the stored
+        fields that were asked for and the `highlights` of each field
+        that matched (`{field: Markup}`), best match first
+    total : int
+        Number of objects found
+    took : float
+        Milliseconds the search took
+    """
+
+    def __init__(self, hits, total, took):
+        self.hits = hits
+        self.total = total
+        self.took = took
+
+    @property
+    def ids(self):
+        return [hit['id'] for hit in self.hits]
+
+
+def _search_terms(query):
+    """Splits a query into words, dropping any full-text operators."""
+    return re.findall(r'\w+', query, re.UNICODE)
+
+
+# Snippets from SQLite are escaped before these are replaced by <mark>
+_MARK_START = '\x02'
+_MARK_END = '\x03'
+
+
+def _mark(snippet):
+    return Markup(str(escape(snippet)).replace(_MARK_START, '<mark>')
+                  .replace(_MARK_END, '</mark>'))
+
+
+class SQLiteFullText(object):
+    """Search without Elasticsearch using SQLite FTS5.
+
+    Each searchable table is shadowed by an FTS5 table called
+    `search_<table>` whose rowid is the object's id (stored fields are
+    UNINDEXED columns). The FTS tables are created and filled by the full
+    text search migration (and rebuilt by `flask reindex`), never while
+    handling a request, and kept up to date inside the same transaction
+    as the changes, so they can never disagree with the data.
+    """
+
+    def _table(self, index):
+        return 'search_' + index
+
+    def _columns(self, connection, index):
+        """Returns the columns of the FTS table of `index` (an empty list
+        if it doesn't exist).
+        """
+        return [row[1] for row in connection.execute(
+            text('PRAGMA table_info({0})'.format(self._table(index))))]
+
+    def rebuild(self, index, fields, stored=()):
+        """Drops, recreates and refills the FTS table of `index`."""
+        connection = db.session.connection()
+        table = self._table(index)
+        columns = list(fields) + list(stored)
+        definitions = list(fields) + [field + ' UNINDEXED' for field in stored]
+        connection.execute(text('DROP TABLE IF EXISTS {0}'.format(table)))
+        connection.execute(text(
+            "CREATE VIRTUAL TABLE {0} USING fts5({1}, "
+            "tokenize = 'porter unicode61')".format(
+                table, ', '.join(definitions))))
+        connection.execute(text(
+            'INSERT INTO {0} (rowid, {1}) SELECT id, {1} FROM {2}'.format(
+                table, ', '.join(columns), index)))
+
+    def apply(self, connection, actions):
+        """Applies index and delete actions using `connection` (so they
+        are part of its transaction). Actions for an index whose FTS
+        table is missing or out of date are skipped until it is rebuilt
+        with `flask reindex`.
+        """
+        columns_of = {}
+        for action in actions:
+            index = action['index']
+            table = self._table(index)
+            if index not in columns_of:
+                columns_of[index] = self._columns(connection, index)
+            if not columns_of[index]:
+                continue    # Not created yet
+            columns = list(action.get('body', ()))
+            if action['op'] == 'index' and columns != columns_of[index]:
+                logger.warning('%s is out of date, run flask reindex', table)
+                continue
+            connection.execute(
+                text('DELETE FROM {0} WHERE rowid = :id'.format(table)),
+                id=action['id'])
+            if action['op'] == 'index':
+                connection.execute(
+                    text('INSERT INTO {0} (rowid, {1}) VALUES (:id, {2})'.format(
+                        table, ', '.join(columns),
+                        ', '.join(':' + column for column in columns))),
+                    id=action['id'], **action['body'])
+
+    def search(self, index, query, page, per_page, fields, stored=(),
+               source=(), highlight=False):
+        start = time.time()
+        terms = _search_terms(query)
+        if not terms:
+            return SearchResults([], 0, 0)
+        connection = db.session.connection()
+        if not self._columns(connection, index):
+            return SearchResults([], 0, 0)  # Not created yet
+        table = self._table(index)
+        # Quoted so the words are never read as FTS operators
+        match = ' OR '.join('"{0}"'.format(term) for term in terms)
+        columns = ['rowid'] + list(source)
+        if highlight:
+            columns += ["snippet({0}, {1}, '{2}', '{3}', '...', 24)".format(
+                table, i, _MARK_START, _MARK_END)
+                for i in range(len(fields))]
+        rows = connection.execute(
+            text('SELECT {1} FROM {0} WHERE {0} MATCH :match '
+                 'ORDER BY rank LIMIT :limit OFFSET :offset'.format(
+                     table, ', '.join(columns))),
+            match=match, limit=per_page, offset=(page - 1) * per_page)
+        hits = []
+        for row in rows:
+            hit = dict(zip(source, row[1:len(source) + 1]))
+            hit['id'] = row[0]
+            hit['highlights'] = {}
+            if highlight:
+                for field, snippet in zip(fields, row[len(source) + 1:]):
+                    if _MARK_START in (snippet or ''):
+                        hit['highlights'][field] = _mark(snippet)
+            hits.append(hit)
+        total = connection.execute(
+            text('SELECT count(*) FROM {0} WHERE {0} MATCH :match'.format(
+                table)), match=match).scalar()
+        return SearchResults(hits, total, (time.time() - start) * 1000)
+
+
+class MySQLFullText(object):
+    """Search without Elasticsearch using MySQL FULLTEXT indexes on the
+    searchable columns (see the full text search migration). MySQL keeps
+    the indexes up to date itself. Highlights aren't supported.
+    """
+
+    def rebuild(self, index, fields, stored=()):
+        pass
+
+    def apply(self, connection, actions):
+        pass
+
+    def search(self, index, query, page, per_page, fields, stored=(),
+               source=(), highlight=False):
+        start = time.time()
+        terms = _search_terms(query)
+        if not terms:
+            return SearchResults([], 0, 0)
+        match = 'MATCH ({0}) AGAINST (:query IN NATURAL LANGUAGE MODE)'.format(
+            ', '.join(fields))
+        query = ' '.join(terms)
+        columns = ['id'] + list(source)
+        rows = db.session.execute(
+            text('SELECT {2} FROM {0} WHERE {1} ORDER BY {1} DESC '
+                 'LIMIT :limit OFFSET :offset'.format(
+                     index, match, ', '.join(columns))),
+            {'query': query, 'limit': per_page,
+             'offset': (page - 1) * per_page})
+        hits = []
+        for row in rows:
+            hit = dict(zip(source, row[1:]))
+            hit['id'] = row[0]
+            hit['highlights'] = {}
+            hits.append(hit)
+        total = db.session.execute(
+            text('SELECT count(*) FROM {0} WHERE {1}'.format(index, match)),
+            {'query': query}).scalar()
+        return SearchResults(hits, total, (time.time() - start) * 1000)
+
+
+def make_fulltext(database_uri):
+    """Returns the full-text search backend for the database, or None if
+    the database doesn't have one.
+    """
+    if database_uri.startswith('sqlite'):
+        try:
+            sqlite3.connect(':memory:').execute(
+                'CREATE VIRTUAL TABLE fts5_test USING fts5(x)')
+        except sqlite3.OperationalError:
+            return None     # SQLite was built without FTS5
+        return SQLiteFullText()
+    if database_uri.startswith('mysql'):
+        return MySQLFullText()
+    return None
+
+
+def add_to_index(index, model):
+    if not current_app.search_queue:
+        return
+    current_app.search_queue.put([index_action(index, model)])
 
 
 def remove_from_index(index, model):
-    if not current_app.elasticsearch:
+    if not current_app.search_queue:
         return
-    current_app.elasticsearch.delete(index=index, doc_type=index, id=model.id)
-
-
-def query_index(index, query, page, per_page):
-    if not current_app.elasticsearch:
-        return [], 0
-    search = current_app.elasticsearch.search(
-        index=index,
-        body={'query': {'multi_match': {'query': query, 'fields': ['*']}},
-              'from': (page - 1) * per_page, 'size': per_page})
-    ids = [int(hit['_id']) for hit in search['hits']['hits']]
-    return ids, search['hits']['total']
+    current_app.search_queue.put([delete_action(index, model)])
+
+
+def _elasticsearch_search(index, query, page, per_page, fields, source,
+                          highlight):
+    body = {'query': {'multi_match': {'query': query, 'fields': list(fields)}},
+            '_source': list(source) or False,
+            'from': (page - 1) * per_page, 'size': per_page}
+    if highlight:
+        body['highlight'] = {'fields': {field: {} for field in fields},
+                             'pre_tags': ['<mark>'],
+                             'post_tags': ['</mark>'],
+                             'encoder': 'html'}
+    response = current_app.elasticsearch.search(index=index, body=body)
+    total = response['hits']['total']
+    if isinstance(total, dict):
+        total = total['value']  # Elasticsearch 7
+    hits = []
+    for hit in response['hits']['hits']:
+        result = dict(hit.get('_source') or {})
+        result['id'] = int(hit['_id'])
+        result['highlights'] = {
+            field: Markup(' ... '.join(fragments))
+            for field, fragments in hit.get('highlight', {}).items()
+        }
+        hits.append(result)
+    return SearchResults(hits, total, response.get('took', 0))
+
+
+def search_index(index, query, page, per_page, fields, stored=(), source=(),
+                 highlight=False):
+    """Searches `index` using Elasticsearch if it is set up and the
+    database's full-text search if not.
+
+    Paramaters
+    ----------
+    index : str
+        Name of the index (the model's table)
+    query : str
+        What to search for
+    page : int
+        Page of results (starting at 1)
+    per_page : int
+        Number of results per page
+    fields : list
+        Searchable fields
+    stored : list
+        Fields that are stored in the index but not searched
+    source : list
+        Fields (searchable or stored) to return with each hit
+        (default none)
+    highlight : bool
+        Return highlighted snippets of the fields that matched (default
+        False)
+
+    Returns
+    -------
+    Results : SearchResults
+    """
+    if current_app.elasticsearch:
+        results = _elasticsearch_search(index, query, page, per_page, fields,
+                                        source, highlight)
+    elif current_app.fulltext:
+        results = current_app.fulltext.search(index, query, page, per_page,
+                                              fields, stored, source,
+                                              highlight)
+    else:
+        return SearchResults([], 0, 0)
+    logger.info('Searched %s for %r: %d results in %.1fms', index, query,
+                results.total, results.took)
+    return results
+
+
+def query_index(index, query, page, per_page, fields=None):
+    """Searches `index`, returning the ids of the objects found on the
+    page (best match first) and the total.
+    """
+    results = search_index(index, query, page, per_page, fields or ['*'])
+    return results.ids, results.total
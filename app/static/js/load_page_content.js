@@ -3,14 +3,26 @@ function destroyExtras() {
 }
 
 function loadPageContent(pageEl, page_id, is_quiz=false, preview=false) {
-    // Send ajax request to server to retrieve page content
-    data = {id: page_id, is_quiz: is_quiz, is_preview: preview}
-    $.ajax({
-        url: '/page-content/',
-        data: JSON.stringify(data),
+    // Send ajax request to server to retrieve page content. Pages are
+    // fetched with GET so the browser can revalidate its cached copy;
+    // the teacher notes are fetched separately and added afterwards.
+    var request;
+    if (is_quiz) {
+        data = {id: page_id, is_quiz: is_quiz, is_preview: preview}
+        request = {
+            url: '/page-content/',
+            data: JSON.stringify(data),
+            contentType: 'application/json; charset=utf-8',
+            type: 'POST'
+        };
+    } else {
+        request = {
+            url: '/page-content/' + page_id,
+            type: 'GET'
+        };
+    }
+    $.ajax($.extend(request, {
         dataType: 'json',
-        contentType: 'application/json; charset=utf-8',
-        type: 'POST',
         success: function(response) {
             var pageTitle = response.page_title;
             var pageHTML = response.page_html;
@@ -28,6 +40,10 @@ function loadPageContent(pageEl, page_id, is_quiz=false, preview=false) {
             }
             $('#pageModal #page-html').html(pageHTML);
             $('#pageModal #page-html img').addClass('img-fluid');
+            $('#pageModal #page-html').data('page-id', page_id);
+            if (!is_quiz) {
+                loadPageNotes(page_id);
+            }
             $('#go-to-page').attr('href', pageEl.attr('href'));
             $('#page-type').text(response.page_type);
 
@@ -57,5 +73,21 @@ function loadPageContent(pageEl, page_id, is_quiz=false, preview=false) {
             $('#pageModal #page-title').text('Error');
             $('#pageModal #page-html').text('There has been an error in retrieving the content.')
         }
+    }));
+}
+
+function loadPageNotes(page_id) {
+    // Add the teacher notes for the page to the end of its content
+    $.ajax({
+        url: '/page-content/' + page_id + '/notes',
+        dataType: 'json',
+        type: 'GET',
+        success: function(response) {
+            if ($('#pageModal #page-html').data('page-id') != page_id) {
+                return;     // Another page has been opened since
+            }
+            $('#pageModal #page-html').append(response.notes_html);
+            $('#pageModal #page-html img').addClass('img-fluid');
+        }
     });
 }
\ No newline at end of file
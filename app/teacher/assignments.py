@@ -0,0 +1,90 @@
+"""teacher/assignments.py
+
+Creates assignments for a class as one bulk operation: the students,
+pages and quizzes are checked with one query each, then every
+`Assignment` and `StudentAssignment` row is inserted and committed in a
+single transaction. The class's gradebook is rebuilt afterwards.
+"""
+
+from .. import db
+from ..gradebook import invalidate_gradebooks
+from ..models import (Assignment, ClassStudent, Page, Quiz, StudentAssignment,
+                      record_assigned_students)
+
+
+class AssignmentError(ValueError):
+    """Raised when assignments can't be created (nothing is created)."""
+
+
+def _check_ids(model, ids, message):
+    ids = set(ids)
+    if not ids:
+        return
+    found = {id for id, in db.session.query(model.id).filter(model.id.in_(ids))}
+    if found != ids:
+        raise AssignmentError(message)
+
+
+def create_assignments(class_id, teacher_id, due_date, student_ids,
+                       page_ids=(), quiz_ids=()):
+    """Assigns pages and quizzes to students of a class.
+
+    Paramaters
+    ----------
+    class_id : int
+    teacher_id : int
+    due_date : datetime
+    student_ids : iterable
+        Students to assign them to, who must all be in the class
+    page_ids, quiz_ids : iterable
+        Pages and quizzes to assign (one assignment is made for each)
+
+    Returns
+    -------
+    Assignment ids : list
+        In the order of `page_ids` followed by `quiz_ids`
+
+    Raises
+    ------
+    AssignmentError
+        If a student isn't in the class or a page or quiz doesn't exist
+    """
+    student_ids = set(student_ids)
+    page_ids, quiz_ids = list(page_ids), list(quiz_ids)
+    if not student_ids:
+        raise AssignmentError('Please select one or more students.')
+    if not page_ids and not quiz_ids:
+        raise AssignmentError('Please select something to assign.')
+
+    in_class = {student_id for student_id, in db.session.query(
+        ClassStudent.student_id).filter(
+            ClassStudent.class_id == class_id,
+            ClassStudent.student_id.in_(student_ids))}
+    if in_class != student_ids:
+        raise AssignmentError('Invalid student id(s)')
+    _check_ids(Page, page_ids, 'Invalid page id(s)')
+    _check_ids(Quiz, quiz_ids, 'Invalid quiz id(s)')
+
+    assignments = [{'class_id': class_id, 'teacher_id': teacher_id,
+                    'due_date': due_date, 'page_id': page_id}
+                   for page_id in page_ids]
+    assignments.extend({'class_id': class_id, 'teacher_id': teacher_id,
+                        'due_date': due_date, 'quiz_id': quiz_id}
+                       for quiz_id in quiz_ids)
+    try:
+        # return_defaults fills in the ids of the new assignments
+        db.session.bulk_insert_mappings(Assignment, assignments,
+                                        return_defaults=True)
+        db.session.bulk_insert_mappings(StudentAssignment, [
+            {'student_id': student_id, 'assignment_id': assignment['id'],
+             'due_date': due_date}
+            for assignment in assignments
+            for student_id in sorted(student_ids)
+        ])
+        invalidate_gradebooks(class_id)
+        record_assigned_students(*student_ids)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return [assignment['id'] for assignment in assignments]
@@ -0,0 +1,254 @@
+"""teacher/provisioning.py
+
+Creates accounts for a whole class of students at once. Every username
+is checked with one query, the passwords (which are slow to hash on
+purpose) are hashed across a pool of processes and the users and their
+`ClassStudent` rows are inserted in bulk and committed together.
+
+Rows that can't be created (a missing or taken username, or a missing
+password) are skipped and reported rather than stopping the others.
+"""
+
+import atexit
+import csv
+import hashlib
+import io
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from flask import current_app
+from werkzeug.security import generate_password_hash
+
+from .. import db
+from ..gradebook import invalidate_gradebooks
+from ..models import ClassStudent, User, roles_lookup
+
+# Usernames checked per query (SQLite allows 999 parameters)
+CHUNK_SIZE = 500
+
+# Most processes hashing passwords when PASSWORD_HASH_WORKERS isn't set
+MAX_HASH_WORKERS = 4
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _hashing_pool(workers):
+    """Returns this process's pool for hashing passwords, starting it the
+    first time. Its processes are started by a fork server (or spawned)
+    rather than forked from the web worker, so they don't inherit its
+    threads' locks or its database connections.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            try:
+                context = multiprocessing.get_context('forkserver')
+            except ValueError:
+                context = multiprocessing.get_context('spawn')
+            _pool = ProcessPoolExecutor(max_workers=workers,
+                                        mp_context=context)
+            atexit.register(_shutdown_pool)
+        return _pool
+
+
+def _shutdown_pool():
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown()
+
+
+def hash_passwords(passwords, workers=None):
+    """Hashes passwords with `generate_password_hash` in a pool of
+    `workers` processes (`PASSWORD_HASH_WORKERS`, or one per CPU up to
+    `MAX_HASH_WORKERS`). The pool is started once per process and kept.
+
+    Returns
+    -------
+    Hashes : list
+        In the same order as `passwords`
+    """
+    passwords = list(passwords)
+    if workers is None:
+        workers = current_app.config.get('PASSWORD_HASH_WORKERS') or \
+            min(os.cpu_count() or 1, MAX_HASH_WORKERS)
+    if workers > 1 and len(passwords) > 1:
+        try:
+            pool = _hashing_pool(workers)
+            chunksize = max(1, len(passwords) // (workers * 4))
+            return list(pool.map(generate_password_hash, passwords,
+                                 chunksize=chunksize))
+        except BrokenProcessPool:
+            _shutdown_pool()    # Started again by the next request
+        except (NotImplementedError, OSError):
+            pass    # No processes here, hash them one by one instead
+    return [generate_password_hash(password) for password in passwords]
+
+
+def read_students_csv(text):
+    """Reads students from CSV with `username` and `password` columns.
+
+    Returns
+    -------
+    Students : list
+        A dictionary with the `username` and `password` of each row
+    """
+    reader = csv.DictReader(io.StringIO(text))
+    fields = [field.strip().lower() for field in reader.fieldnames or []]
+    if 'username' not in fields or 'password' not in fields:
+        raise ValueError('The CSV file needs username and password columns.')
+    reader.fieldnames = fields
+    return [{'username': row['username'], 'password': row['password']}
+            for row in reader]
+
+
+def existing_usernames(usernames):
+    """Returns which of `usernames` are taken (one query per
+    `CHUNK_SIZE` usernames).
+    """
+    usernames = list(usernames)
+    taken = set()
+    for i in range(0, len(usernames), CHUNK_SIZE):
+        chunk = usernames[i:i + CHUNK_SIZE]
+        taken.update(username for username, in db.session.query(User.username)
+                     .filter(User.username.in_(chunk)))
+    return taken
+
+
+def username_base(name):
+    """Returns the username a student's full name would be given before
+    any number is added ('Ada Lovelace' becomes 'alovelace').
+    """
+    name = name.split()
+    if not name:
+        return ''
+    first_name = name[0].lower()
+    if len(name) == 1:
+        return first_name
+    return first_name[0] + ''.join(name[1:]).lower()
+
+
+def _like_prefix(prefix):
+    escaped = prefix.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return User.username.like(escaped + '%', escape='\\')
+
+
+def generate_usernames(names, reserved=()):
+    """Generates a unique username for each full name. A number is added
+    to the end of usernames that are taken (e.g. 'alovelace2').
+
+    Each distinct base username is looked up with a single `LIKE` query
+    and the free numbers are worked out in memory.
+
+    Paramaters
+    ----------
+    names : list
+        Full names of the students
+    reserved : iterable
+        Usernames that have been handed out but not created yet
+
+    Returns
+    -------
+    Usernames : list
+        In the same order as `names` ('' for a blank name)
+    """
+    bases = [username_base(name) for name in names]
+    taken = {username.lower() for username in reserved}
+    for base in set(bases):
+        if base:
+            taken.update(username.lower() for username, in
+                         db.session.query(User.username).filter(_like_prefix(base)))
+    usernames = []
+    for base in bases:
+        if not base:
+            usernames.append('')
+            continue
+        username = base
+        i = 1
+        while username.lower() in taken:
+            i += 1
+            username = base + str(i)
+        taken.add(username.lower())
+        usernames.append(username)
+    return usernames
+
+
+def provision_students(class_id, students):
+    """Creates an account for each student and adds them to a class.
+
+    Paramaters
+    ----------
+    class_id : int
+    students : list
+        Dictionaries with a `username` and a `password`
+
+    Returns
+    -------
+    Results : list
+        A dictionary for each student in order with the `row` (from 1),
+        the `username`, whether it was `created` and the `error` if it
+        wasn't
+    """
+    results = []
+    valid = []
+    seen = set()
+    for row, student in enumerate(students, 1):
+        username = str(student.get('username') or '').strip()
+        password = str(student.get('password') or '')
+        result = {'row': row, 'username': username, 'created': False,
+                  'error': None}
+        if not username:
+            result['error'] = 'Missing username'
+        elif len(username) > User.username.type.length:
+            result['error'] = 'Username is too long'
+        elif username in seen:
+            result['error'] = 'Username is repeated'
+        elif not password:
+            result['error'] = 'Missing password'
+        else:
+            seen.add(username)
+            valid.append((result, password))
+        results.append(result)
+
+    taken = existing_usernames(result['username'] for result, _ in valid)
+    for result, _ in valid:
+        if result['username'] in taken:
+            result['error'] = 'Username is taken'
+    valid = [(result, password) for result, password in valid
+             if result['username'] not in taken]
+    if not valid:
+        return results
+
+    hashes = hash_passwords(password for _, password in valid)
+    default_role = roles_lookup.find(default=True)
+    try:
+        db.session.bulk_insert_mappings(User, [{
+            'username': result['username'],
+            'password_hash': password_hash,
+            'under_13': True,
+            'avatar_hash': hashlib.md5(
+                result['username'].encode('utf-8')).hexdigest(),
+            'role_id': default_role.id if default_role else None,
+        } for (result, _), password_hash in zip(valid, hashes)])
+        user_ids = {}
+        usernames = [result['username'] for result, _ in valid]
+        for i in range(0, len(usernames), CHUNK_SIZE):
+            user_ids.update((username, id) for id, username in
+                            db.session.query(User.id, User.username).filter(
+                                User.username.in_(usernames[i:i + CHUNK_SIZE])))
+        db.session.bulk_insert_mappings(ClassStudent, [
+            {'student_id': user_ids[username], 'class_id': class_id}
+            for username in usernames])
+        invalidate_gradebooks(class_id)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    for result, _ in valid:
+        result['created'] = True
+    return results
@@ -0,0 +1,114 @@
+"""teacher/reports.py
+
+Reports on how a class is getting on with an assignment.
+"""
+
+from collections import OrderedDict
+
+from sqlalchemy.sql.expression import func
+
+from .. import db
+from ..models import StudentAssignment, UserAnswer
+
+
+def assignment_responses(assignment, students, questions):
+    """Fetches every answer given by `students` to `questions` while the
+    assignment was open (after it was assigned to the student and before
+    the due date) in a single query.
+
+    Returns
+    -------
+    Answers : list
+        `UserAnswer` objects (with their user loaded), ordered by the
+        order of `students` and then by when they were given.
+    """
+    student_ids = [student.id for student in students]
+    question_ids = [question.id for question in questions]
+    if not student_ids or not question_ids:
+        return []
+
+    # When each student was given the assignment
+    assigned = db.session.query(
+        StudentAssignment.student_id.label('student_id'),
+        func.min(StudentAssignment.datetime).label('start')) \
+        .filter(StudentAssignment.assignment_id == assignment.id,
+                StudentAssignment.student_id.in_(student_ids)) \
+        .group_by(StudentAssignment.student_id).subquery()
+
+    answers = UserAnswer.query \
+        .join(assigned, assigned.c.student_id == UserAnswer.user_id) \
+        .filter(UserAnswer.question_id.in_(question_ids),
+                UserAnswer.datetime > assigned.c.start,
+                UserAnswer.datetime < assignment.due_date) \
+        .options(db.joinedload(UserAnswer.user)) \
+        .order_by(UserAnswer.id).all()
+
+    student_order = {student_id: i for i, student_id in enumerate(student_ids)}
+    answers.sort(key=lambda answer: student_order[answer.user_id])
+    return answers
+
+
+def assignment_report(assignment, students, questions):
+    """Buckets the responses to each question of an assignment.
+
+    Paramaters
+    ----------
+    assignment : Assignment
+        The (quiz) assignment
+    students : list
+        Students to report on
+    questions : list
+        Questions in the assignment's quiz
+
+    Returns
+    -------
+    Report : OrderedDict
+        `{question_id: [response, ...]}` where each response is a dict
+        with the `keyed_answer`, the `answers` (UserAnswer objects) that
+        gave it, the unique `usernames` and the `percentage` of
+        students.
+    """
+    report = OrderedDict((question.id, OrderedDict()) for question in questions)
+    for answer in assignment_responses(assignment, students, questions):
+        responses = report[answer.question_id]
+        if answer.keyed_answer not in responses:
+            responses[answer.keyed_answer] = {
+                'keyed_answer': answer.keyed_answer,
+                'answers': [],
+                'usernames': [],
+            }
+        response = responses[answer.keyed_answer]
+        response['answers'].append(answer)
+        if answer.user.username not in response['usernames']:
+            response['usernames'].append(answer.user.username)
+
+    student_count = len(students)
+    for question_id, responses in report.items():
+        for response in responses.values():
+            try:
+                response['percentage'] = (len(response['answers']) / student_count) * 100
+            except ZeroDivisionError:
+                response['percentage'] = 0
+        report[question_id] = list(responses.values())
+    return report
+
+
+def report_to_json(report):
+    """Converts a report from `assignment_report` into JSON
+    serialisable data.
+    """
+    return [{
+        'question_id': question_id,
+        'responses': [{
+            'keyed_answer': response['keyed_answer'],
+            'count': len(response['answers']),
+            'percentage': response['percentage'],
+            'students': response['usernames'],
+            'answers': [{
+                'username': answer.user.username,
+                'attempt_no': answer.attempt_no,
+                'score': answer.score,
+                'datetime': answer.datetime.isoformat()
+            } for answer in response['answers']]
+        } for response in responses]
+    } for question_id, responses in report.items()]
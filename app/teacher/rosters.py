@@ -0,0 +1,74 @@
+"""teacher/rosters.py
+
+The students in a class and a summary of each of a teacher's classes,
+each loaded with one query however many classes and students there are.
+"""
+
+from sqlalchemy import case
+from sqlalchemy.sql.expression import func
+
+from .. import db
+from ..models import Assignment, Class, ClassStudent, User
+
+
+def class_roster(class_id):
+    """Returns the students of a class in the order they joined.
+
+    Returns
+    -------
+    Students : list
+        A dictionary with the `id`, `username` and whether each student
+        is `active` (hasn't been removed from the class)
+    """
+    rows = db.session.query(User.id, User.username,
+                            ClassStudent.student_status) \
+        .join(ClassStudent, ClassStudent.student_id == User.id) \
+        .filter(ClassStudent.class_id == class_id) \
+        .order_by(ClassStudent.id)
+    return [{'id': id, 'username': username, 'active': bool(active)}
+            for id, username, active in rows]
+
+
+def class_summaries(teacher_id):
+    """Returns a summary of each of a teacher's classes.
+
+    Returns
+    -------
+    Classes : list
+        A dictionary for each class with its `id`, `name`, `code`, the
+        number of `students` (including removed ones), `active_students`
+        and `assignments`, and when its active students were last seen
+        (`last_activity`, None if it has none)
+    """
+    # Only the teacher's classes are counted (not every class's rows)
+    class_ids = db.session.query(Class.id) \
+        .filter(Class.teacher_id == teacher_id).subquery()
+    students = db.session.query(
+        ClassStudent.class_id.label('class_id'),
+        func.count(ClassStudent.id).label('students'),
+        func.sum(case([(ClassStudent.student_status == True, 1)],
+                      else_=0)).label('active_students'),
+        func.max(case([(ClassStudent.student_status == True, User.last_seen)])
+                 ).label('last_activity')) \
+        .join(User, User.id == ClassStudent.student_id) \
+        .filter(ClassStudent.class_id.in_(class_ids)) \
+        .group_by(ClassStudent.class_id).subquery()
+    assignments = db.session.query(
+        Assignment.class_id.label('class_id'),
+        func.count(Assignment.id).label('assignments')) \
+        .filter(Assignment.class_id.in_(class_ids)) \
+        .group_by(Assignment.class_id).subquery()
+    rows = db.session.query(Class.id, Class.name, Class.code,
+                            students.c.students, students.c.active_students,
+                            assignments.c.assignments,
+                            students.c.last_activity) \
+        .outerjoin(students, students.c.class_id == Class.id) \
+        .outerjoin(assignments, assignments.c.class_id == Class.id) \
+        .filter(Class.teacher_id == teacher_id) \
+        .order_by(Class.id)
+    return [{'id': row.id, 'name': row.name, 'code': row.code,
+             'students': row.students or 0,
+             'active_students': int(row.active_students or 0),
+             'assignments': row.assignments or 0,
+             'last_activity': row.last_activity}
+            for row in rows]
@@ -1,10 +1,18 @@
-import random, string
+import csv, random, string
+from datetime import datetime
 
 from flask import abort, flash, jsonify, redirect, render_template, request, session, url_for
 from flask_login import current_user, login_required
-from ..models import Assignment, Class, ClassStudent, Page, Permission, Question, QuestionType, Quiz, StudentAssignment, TeacherNote, User, db
+from ..models import Assignment, Class, ClassStudent, Page, Permission, Question, Quiz, StudentAssignment, TeacherNote, User, db, question_types
 from .. import moment
+from ..curriculum import get_curriculum_tree
+from ..fragment_cache import cached
+from ..gradebook import Gradebook, class_ids_of_student, gradebook_dependency, invalidate_gradebooks
+from .assignments import AssignmentError, create_assignments
 from .forms import AssignmentForm, NewClass, TeacherNoteForm
+from .provisioning import generate_usernames, provision_students, read_students_csv
+from .rosters import class_roster, class_summaries
+from .reports import assignment_report, report_to_json
 from . import teacher
 
 @teacher.before_request
@@ -14,7 +22,7 @@ def teacher_before_request():
 
 @teacher.route('/dashboard')
 def dashboard():
-    classes = Class.query.filter_by(teacher_id=current_user.id).all()
+    classes = class_summaries(current_user.id)
     form = NewClass()
     if form.validate_on_submit():
         random_code = ''
@@ -22,6 +30,7 @@ def dashboard():
             random_code = ''.join(random.choices(string.ascii_uppercase + string.digits, k=6))
         new_class = Class(name=form.name.data, code=random_code, description=form.description.data, teacher_id=current_user.id)
         db.session.add(new_class)
+        db.session.commit()
         return redirect(url_for('.dashboard'))
     return render_template('teacher/dashboard.html', title="JCCoder - Teacher Dashboard", form=form, classes=classes)
 
@@ -51,34 +60,12 @@ def display_class(id):
     teacher_notes_form = TeacherNoteForm()
     objects = []
     if assignment_form.validate_on_submit() and assignment_form.submit_assignments.data:
-        # Merging them into one list
-        items = session.get("assigned_pages", [])
-        items.append('change-to-quiz')
-        items.extend(session.get("assigned_quizzes", []))
-        items.extend(session.get("assigned_chapter_quizzes", []))
-
-        item_type = "page"
-        for item in items:
-            if item == "change-to-quiz":
-                item_type = "quiz"
-                continue
-            assignment = Assignment(class_id=id, teacher_id=current_user.id, due_date=assignment_form.due_date.data)
-            if item_type == "page":
-                assignment.page_id = item
-            else:
-                assignment.quiz_id = item
-            db.session.add(assignment)
-            db.session.commit()
-            for student_id in assignment_form.students.data:
-                # Confirming that student is a real user and in the class.
-                student = User.query.get(student_id)
-                if student and (student in class_.students.all()):
-                    student_assignment = StudentAssignment(student_id=student_id, assignment_id=assignment.id)
-                    db.session.add(student_assignment)
-                else:
-                    flash('Invalid student id(s)', 'warning')
-                    db.session.delete(assignment)
-                    db.session.commit()
+        quizzes = session.get("assigned_quizzes", []) + session.get("assigned_chapter_quizzes", [])
+        try:
+            create_assignments(id, current_user.id, assignment_form.due_date.data, assignment_form.students.data,
+                               page_ids=session.get("assigned_pages", []), quiz_ids=quizzes)
+        except AssignmentError as e:
+            flash(str(e), 'warning')
         return redirect(url_for('.display_class', id=id))
     elif assignment_form.submit_assignments.data and not assignment_form.validate():
         objects = session.get("assigned_pages", [])
@@ -90,6 +77,7 @@ def display_class(id):
         page_id = int(teacher_notes_form.page_id.data)
         teacher_note = TeacherNote(teacher_id=current_user.id, body=teacher_notes_form.note_content.data, page_id=page_id, class_id=class_.id)
         db.session.add(teacher_note)
+        db.session.commit()
         flash('Content Added!', 'info')
         return redirect(url_for('main.chapter', id=Page.query.get_or_404(page_id).lesson.chapter.id, item='page_' + str(page_id)))
     elif teacher_notes_form.submit_notes.data and not teacher_notes_form.validate():
@@ -97,7 +85,42 @@ def display_class(id):
         return redirect(url_for('.display_class', id=class_.id))
     # assignment_pagination = class_.assignments.filter_by(page_id=None).order_by(Assignment.due_date.desc()).paginate(page, per_page=8)
     assignment_pagination = class_.assignments.order_by(Assignment.due_date.desc()).paginate(page, per_page=8)
-    return render_template('teacher/class.html', title="JCCoder - " + class_.name, class_=class_, assignment_form=assignment_form, teacher_notes_form=teacher_notes_form, objects=objects, assignments_pagination=assignment_pagination)
+    assignments_html = gradebook_html(class_, assignment_pagination, just_quizzes=False)
+    return render_template('teacher/class.html', title="JCCoder - " + class_.name, class_=class_, assignment_form=assignment_form, teacher_notes_form=teacher_notes_form, objects=objects, roster=class_roster(class_.id), assignments_pagination=assignment_pagination, assignments_html=assignments_html, curriculum=get_curriculum_tree())
+
+def gradebook_html(class_, assignments_pagination, just_quizzes):
+    """Renders the gradebook for a page of a class's assignments, from
+    the cache if nothing in it has changed.
+    """
+    assignment_ids = [assignment.id for assignment in assignments_pagination.items]
+    def render():
+        gradebook = Gradebook(class_.id, assignment_ids)
+        return render_template('teacher/_assignment.html', class_=class_, assignments_pagination=assignments_pagination, gradebook=gradebook, moment=moment.create)
+    return cached('gradebook', class_.id, assignments_pagination.page, just_quizzes, assignment_ids, depends=('curriculum', 'content', gradebook_dependency(class_.id)), shared_only=True, caller=render)
+
+@teacher.route('/class/<int:id>/assignments', methods=["GET", "POST"])
+def new_assignments(id):
+    # JSON version of assigning items in display_class
+    if request.method == "GET":
+        abort(404)
+    class_ = Class.query.get_or_404(id)
+    if class_.teacher_id != current_user.id:
+        abort(403)
+    data = request.get_json()
+    try:
+        due_date = datetime.strptime(data["due_date"], "%d-%m-%Y")
+        students = [int(student_id) for student_id in data["students"]]
+        pages = [int(page_id) for page_id in data.get("pages", [])]
+        quizzes = [int(quiz_id) for quiz_id in data.get("quizzes", [])]
+    except (KeyError, TypeError, ValueError):
+        abort(400)
+    if due_date < datetime.utcnow():
+        abort(400)
+    try:
+        assignment_ids = create_assignments(id, current_user.id, due_date, students, page_ids=pages, quiz_ids=quizzes)
+    except AssignmentError:
+        abort(400)
+    return jsonify(success=True, assignment_ids=assignment_ids)
 
 @teacher.route('/class/assignment-page', methods=["GET", "POST"])
 def assignment_page():
@@ -116,7 +139,7 @@ def assignment_page():
     else:
         assignments_pagination = class_.assignments
     assignments_pagination = assignments_pagination.order_by(Assignment.due_date.desc()).paginate(page + data["direction"], per_page=8)
-    html = render_template('teacher/_assignment.html', class_=class_, assignments_pagination=assignments_pagination, moment=moment.create)
+    html = gradebook_html(class_, assignments_pagination, just_quizzes=bool(data["just_quizzes"]))
     return jsonify(success=True, html=html)
 
 @teacher.route('/save-items', methods=["GET", "POST"])
@@ -150,6 +173,7 @@ def delete_class(id):
     for student_assignment in StudentAssignment.query.filter(db.and_(StudentAssignment.student_id.in_(students_ids), StudentAssignment.assignment_id.in_(assignments_ids))):
         db.session.delete(student_assignment)
     db.session.delete(class_)
+    db.session.commit()
     return redirect(url_for('.dashboard'))
 
 @teacher.route('/generate-username', methods=['GET', 'POST'])
@@ -162,47 +186,56 @@ def generate_username():
     except KeyError:
         abort(400)
     else:
-        if not name.strip():
-            return jsonify(success=True, username='')
-        name = name.split()
-        first_name = name[0].lower()
-        if len(name) == 1:
-            username = first_name
-        else:
-            last_name = ''.join(name[1:]).lower()
-            username = first_name[0] + last_name
-        new_username = username
-        i = 1
-        while User.query.filter_by(username=new_username).first() or new_username in session["usernames"]: # Prevent duplicates
-            i += 1
-            new_username = username + str(i)
-        usernames = session['usernames']
-        usernames.append(new_username)
-        session['usernames'] = usernames
+        new_username, = generate_usernames([name], reserved=session.get("usernames", []))
+        if new_username:
+            session['usernames'] = session.get("usernames", []) + [new_username] # Prevent duplicates
         return jsonify(success=True, username=new_username)
 
+@teacher.route('/generate-usernames', methods=['GET', 'POST'])
+def generate_usernames_batch():
+    # Batch version of generate_username for a list of names
+    if request.method == 'GET':
+        abort(404)
+    data = request.get_json()
+    try:
+        names = [str(name) for name in data['names']]
+    except (KeyError, TypeError):
+        abort(400)
+    usernames = generate_usernames(names, reserved=session.get("usernames", []))
+    session['usernames'] = session.get("usernames", []) + [username for username in usernames if username]
+    return jsonify(success=True, usernames=usernames)
+
 @teacher.route('/create-accounts', methods=['GET', 'POST'])
 def create_accounts():
     if request.method == 'GET':
         abort(404)
     data = request.get_json()
     students = data["students"]
-    class_id = int(data["class_id"])
-    if current_user.id != Class.query.get(class_id).teacher_id:
+    class_ = Class.query.get(int(data["class_id"]))
+    if not class_ or current_user.id != class_.teacher_id:
         abort(403)
-    for student_object in students:
-        username = student_object["username"]
-        password = student_object["password"]
-        if User.query.filter_by(username=username).first():
-            # Not unique username - Problem!
-            abort(400)
-        else:
-            student = User(username=username, password=password, under_13=True)
-            db.session.add(student)
-            db.session.commit()
-            class_student = ClassStudent(student_id=student.id, class_id=class_id)
-            db.session.add(class_student)
-    return jsonify(success=True)
+    results = provision_students(class_.id, students)
+    created = sum(result["created"] for result in results)
+    return jsonify(success=True, created=created, results=results)
+
+@teacher.route('/class/<int:id>/import-students', methods=['GET', 'POST'])
+def import_students(id):
+    # CSV version of create_accounts (username and password columns)
+    if request.method == 'GET':
+        abort(404)
+    class_ = Class.query.get_or_404(id)
+    if current_user.id != class_.teacher_id:
+        abort(403)
+    upload = request.files.get("file")
+    if not upload:
+        abort(400)
+    try:
+        students = read_students_csv(upload.read().decode("utf-8-sig"))
+    except (UnicodeDecodeError, ValueError, csv.Error):
+        abort(400)
+    results = provision_students(class_.id, students)
+    created = sum(result["created"] for result in results)
+    return jsonify(success=True, created=created, results=results)
 
 @teacher.route('/class/<int:class_id>/delete/student/<int:student_id>')
 def delete_student_from_class(class_id, student_id):
@@ -211,6 +244,7 @@ def delete_student_from_class(class_id, student_id):
     class_student = ClassStudent.query.filter_by(class_id=class_id, student_id=student_id).first()
     class_student.student_status = False
     db.session.add(class_student)
+    db.session.commit()
     return redirect(url_for('.display_class', id=class_id))
 
 @teacher.route('/edit/student/', methods=["GET", "POST"])
@@ -234,6 +268,8 @@ def edit_student():
         return jsonify(success=True, unique_username=False)
     student.username = new_username
     db.session.add(student)
+    invalidate_gradebooks(*class_ids_of_student(student.id))
+    db.session.commit()
     return jsonify(success=True, unique_username=True)
 
 @teacher.route('/edit/class/', methods=["GET", "POST"])
@@ -248,8 +284,23 @@ def edit_class():
     
     class_.name = data["name"]
     db.session.add(class_)
+    db.session.commit()
     return jsonify(success=True)
 
+def assignment_progress_students(assignment, student_username):
+    """Returns the students an assignment progress report is about."""
+    if student_username:
+        students = User.query.filter_by(username=student_username).all()
+        if not students:
+            abort(404)
+        return students
+    return assignment.class_.students.filter(ClassStudent.student_status).all()
+
+def assignment_progress_questions(assignment):
+    """Returns the questions of an assignment's quiz."""
+    questions = assignment.quiz.questions
+    return questions.all() if questions is not None else []
+
 @teacher.route('/progress/assignment/<int:assignment_id>', defaults={'student_username': None})
 @teacher.route('/progress/assignment/<int:assignment_id>/student/<student_username>')
 def assignment_progress(assignment_id, student_username):
@@ -258,17 +309,29 @@ def assignment_progress(assignment_id, student_username):
         abort(403)
     if not assignment.is_quiz():
         abort(404)
-    students = assignment.class_.students.filter(ClassStudent.student_status)
-    if student_username:
-        students = User.query.filter_by(username=student_username)
-        if not students.first():
-            abort(404)
+    students = assignment_progress_students(assignment, student_username)
+    questions = assignment_progress_questions(assignment)
+    report = assignment_report(assignment, students, questions)
     title = 'JCCoder - Assignment Progress - '
     if student_username:
         title += student_username
     else:
         title += 'All Students'
-    return render_template('teacher/assignment_progress.html', title=title, assignment=assignment, students=students)
+    return render_template('teacher/assignment_progress.html', title=title, assignment=assignment, students=students, questions=questions, report=report)
+
+@teacher.route('/progress/assignment/<int:assignment_id>/report', defaults={'student_username': None})
+@teacher.route('/progress/assignment/<int:assignment_id>/student/<student_username>/report')
+def assignment_progress_report(assignment_id, student_username):
+    # JSON version of assignment_progress
+    assignment = Assignment.query.get_or_404(assignment_id)
+    if current_user.id != assignment.teacher_id:
+        abort(403)
+    if not assignment.is_quiz():
+        abort(404)
+    students = assignment_progress_students(assignment, student_username)
+    questions = assignment_progress_questions(assignment)
+    report = assignment_report(assignment, students, questions)
+    return jsonify(success=True, student_count=len(students), questions=report_to_json(report))
 
 @teacher.route('/progress/assignment/<int:id>/reveal-answer', methods=['GET', 'POST'])
 def assignment_progress_reveal_answer(id):
@@ -282,7 +345,7 @@ def assignment_progress_reveal_answer(id):
         abort(404)
     data = request.get_json()
     question = Question.query.get_or_404(int(data["question_id"]))
-    if question.question_type != QuestionType.query.filter_by(code='D').first():
+    if question.question_type_id != question_types.id('D'):
         answer = question.correct_answer()
     else:
         answer = {'raw_answer': question.correct_answer(), 'html': question.drag_and_drop_answers(use_correct_answer=True)}
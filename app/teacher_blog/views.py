@@ -66,6 +66,7 @@ def index():
         post = Post(title=form.title.data, body=form.body.data, author=current_user._get_current_object(), categories=categories, published=form.published.data)
 
         db.session.add(post)
+        db.session.commit()
 
         return redirect(url_for('.index'))
     return render_template('teacher_blog/index.html', title='Blog', form=form, posts=posts, pagination=pagination)
@@ -82,7 +83,7 @@ def search():
         if total > page * current_app.config["POSTS_PER_PAGE"] else None
     prev_url = url_for('.search', q=q, page=page - 1) \
         if page > 1 else None
-    return render_template('teacher_blog/search_results.html', title="Search results for \"{0}\"".format(q), q=q, posts=posts.all(), total=total, prev_url=prev_url, next_url=next_url)
+    return render_template('teacher_blog/search_results.html', title="Search results for \"{0}\"".format(q), q=q, posts=posts, total=total, prev_url=prev_url, next_url=next_url)
 
 # Render a full post on its own
 @teacher_blog.route('/<int:id>', methods=['GET', 'POST'])
@@ -100,6 +101,7 @@ def permalink(id):
     if form.validate_on_submit():
         comment = PostComment(body=form.body.data, post=post, author=current_user._get_current_object())
         db.session.add(comment)
+        db.session.commit()
 
         return(redirect(url_for('.permalink', id=post.id) + '#comments'))
 
@@ -118,6 +120,7 @@ def public(id):
 
     # Change status of post
     post.published = True
+    db.session.commit()
 
     # Flash a message that says that the post is public.
     flash("Your post is now public.", 'info')
@@ -136,6 +139,7 @@ def draft(id):
 
     # Change status of post
     post.published = False
+    db.session.commit()
 
     # Flash a message that says that the post is a draft
     flash("Your post is now a draft.", 'info')
@@ -162,6 +166,7 @@ def edit(id):
         post.categories = parseMultiplePost(form)
         post.published = form.published.data
         post.last_updated = datetime.utcnow()
+        db.session.commit()
 
         # Redirect the user to the page with the post in it
         return redirect(url_for('.permalink', id=id))
@@ -192,6 +197,7 @@ def edit_comment(id):
     # If request method is POST (form submitted)
     if form.validate_on_submit():
         comment.body = form.body.data
+        db.session.commit()
         return redirect(url_for('.permalink', id=comment.post.id) + '#comments')
     
     # Set initial values
@@ -0,0 +1,132 @@
+"""app/teacher_notes.py
+
+The teacher notes shown under a page. Admins see every note, teachers
+see the notes they have added and students see the notes added to their
+classes.
+
+The notes for every page in a lesson are loaded in one query (with the
+teacher and class names joined in) the first time one of the lesson's
+pages is opened, and the HTML for each page is kept in the fragment cache
+(see fragment_cache.py) for everyone who can see the same notes, so
+clicking through a lesson doesn't run any more queries for the notes.
+"""
+
+from collections import defaultdict
+
+from flask import current_app, g
+
+from app import db
+from app.fragment_cache import fragment_key
+from app.models import Class, ClassStudent, Page, Permission, TeacherNote, User
+
+
+def class_ids(user):
+    """Returns the ids of the classes a student is in (loaded once per
+    request).
+    """
+    if 'class_ids' not in g:
+        g.class_ids = tuple(sorted(
+            class_id for class_id, in db.session.query(ClassStudent.class_id)
+            .filter(ClassStudent.student_id == user.id).distinct()))
+    return g.class_ids
+
+
+def visible_to(user):
+    """Returns a key that is the same for every user who can see the same
+    notes and the filter that selects those notes.
+    """
+    if user.is_admin():
+        return ('all',), True
+    if user.can(Permission.MANAGE_CLASS):
+        return ('teacher', user.id), TeacherNote.teacher_id == user.id
+    ids = class_ids(user)
+    return ('classes',) + ids, TeacherNote.class_id.in_(ids or [None])
+
+
+def visible_notes(user):
+    """Returns a query for the notes the user can see."""
+    return TeacherNote.query.filter(visible_to(user)[1])
+
+
+def load_notes(page_ids, user):
+    """Loads the notes the user can see on several pages in one query.
+
+    Returns
+    -------
+    Notes : dict
+        `{page_id: [(body_html, teacher_username, class_id, class_name)]}`
+        in the order they are shown.
+    """
+    visibility, criterion = visible_to(user)
+    if user.is_admin():
+        order = TeacherNote.teacher_id
+    else:
+        order = TeacherNote.class_id
+    rows = db.session.query(TeacherNote.page_id, TeacherNote.body_html,
+                            User.username, Class.id, Class.name) \
+        .outerjoin(User, User.id == TeacherNote.teacher_id) \
+        .outerjoin(Class, Class.id == TeacherNote.class_id) \
+        .filter(TeacherNote.page_id.in_(page_ids), criterion) \
+        .order_by(TeacherNote.page_id, order, TeacherNote.id)
+    notes = defaultdict(list)
+    for page_id, body_html, username, class_id, class_name in rows:
+        notes[page_id].append((body_html, username, class_id, class_name))
+    return notes
+
+
+def render_notes(notes, user):
+    """Returns the HTML for a page's notes (from `load_notes()`)."""
+    if not notes:
+        return ''
+    if user.is_admin():
+        html = "<hr /><h3>Added Notes</h3>"
+        for body_html, username, class_id, class_name in notes:
+            html += '<hr />{0}<p>Added by {1} to their class {2}'.format(body_html, username, class_name)
+    elif user.can(Permission.MANAGE_CLASS):
+        html = "<hr /><h3>You added</h3>"
+        current_class = None
+        for body_html, username, class_id, class_name in notes:
+            if class_id != current_class:
+                html += '<hr /><h5>Class: ' + class_name + '</h5>'
+                current_class = class_id
+            html += '<hr />{0}'.format(body_html)
+    else:
+        html = "<hr /><h3>Added by your teacher</h3>"
+        for body_html, username, class_id, class_name in notes:
+            html += '<hr />{0}'.format(body_html)
+    return html
+
+
+def _cache_key(cache, page_id, visibility):
+    return fragment_key(cache, 'notes', (page_id, visibility),
+                        ('teacher_notes',))
+
+
+def notes_html(page_id, user):
+    """Returns the HTML of the notes the user can see on a page.
+
+    On a cache miss the notes of every page in the same lesson are loaded
+    and cached together.
+    """
+    cache = current_app.fragment_cache
+    if cache is None:
+        return render_notes(load_notes([page_id], user)[page_id], user)
+    visibility = visible_to(user)[0]
+    html = cache.get(_cache_key(cache, page_id, visibility))
+    if html is not None:
+        return html
+
+    lesson_id = db.session.query(Page.lesson_id) \
+        .filter(Page.id == page_id).scalar()
+    page_ids = [pid for pid, in db.session.query(Page.id)
+                .filter(Page.lesson_id == lesson_id)] \
+        if lesson_id is not None else []
+    if page_id not in page_ids:
+        page_ids.append(page_id)
+    notes = load_notes(page_ids, user)
+    for pid in page_ids:
+        page_html = render_notes(notes[pid], user)
+        cache.set(_cache_key(cache, pid, visibility), page_html)
+        if pid == page_id:
+            html = page_html
+    return html
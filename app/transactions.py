@@ -0,0 +1,106 @@
+"""app/transactions.py
+
+How each request uses the database session. Nothing is committed when
+a request ends (`SQLALCHEMY_COMMIT_ON_TEARDOWN` is off): a route that
+writes calls `db.session.commit()` itself, and anything it leaves
+uncommitted (e.g. a lazily set attribute) is rolled back. Routes that
+only read are declared with `@read_only`: autoflush is turned off and,
+if `SQLALCHEMY_READ_REPLICA_URI` is set, queries go to the read replica,
+so they must not write through the session's connection either.
+
+Every commit that reaches the database is counted against the route
+that made it, so the policy can be checked (see `/admin/commit-counts`).
+"""
+
+import threading
+from collections import Counter
+from functools import wraps
+
+from flask import g, has_request_context, request
+from flask_sqlalchemy import SignallingSession, SQLAlchemy
+from sqlalchemy import create_engine, orm
+
+
+def read_only(view):
+    """Declares a view as only reading from the database."""
+    @wraps(view)
+    def decorated_function(*args, **kwargs):
+        return view(*args, **kwargs)
+    decorated_function.read_only = True
+    return decorated_function
+
+
+def is_read_only():
+    """Whether the current request is for a read-only route."""
+    return has_request_context() and g.get('read_only', False)
+
+
+class ReadReplicaSession(SignallingSession):
+    """Session that sends every query to `info['read_replica']` when it
+    is set (for read-only requests), rather than to the engine each
+    table is bound to.
+    """
+
+    def get_bind(self, mapper=None, clause=None):
+        replica = self.info.get('read_replica')
+        if replica is not None:
+            return replica
+        return super(ReadReplicaSession, self).get_bind(mapper, clause)
+
+
+class ReadReplicaSQLAlchemy(SQLAlchemy):
+    """Flask-SQLAlchemy with sessions that can use a read replica."""
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=ReadReplicaSession, db=self, **options)
+
+
+class CommitCounter(object):
+    """Counts database commits per route (endpoint)."""
+
+    def __init__(self):
+        self._counts = Counter()
+        self._lock = threading.Lock()
+
+    def count(self, conn):
+        endpoint = (request.endpoint or '<unknown>') if has_request_context() \
+            else '<no request>'
+        with self._lock:
+            self._counts[endpoint] += 1
+
+    def counts(self):
+        """Returns `{endpoint: commits}` since the process started."""
+        with self._lock:
+            return dict(self._counts)
+
+    def reset(self):
+        with self._lock:
+            self._counts.clear()
+
+
+def init_app(app, db):
+    """Sets up the transaction policy. Must be called before blueprints
+    are registered, so that read-only requests are set up before any
+    other `before_request` function queries.
+    """
+    replica_uri = app.config.get('SQLALCHEMY_READ_REPLICA_URI')
+    app.read_replica = create_engine(replica_uri) if replica_uri else None
+    app.commit_counter = CommitCounter()
+    with app.app_context():
+        db.event.listen(db.engine, 'commit', app.commit_counter.count)
+
+    @app.before_request
+    def begin_read_only():
+        view = app.view_functions.get(request.endpoint)
+        g.read_only = getattr(view, 'read_only', False)
+        if not g.read_only:
+            return
+        db.session.autoflush = False
+        if app.read_replica is not None:
+            db.session.info['read_replica'] = app.read_replica
+
+    @app.teardown_request
+    def end_read_only(exc):
+        if is_read_only():
+            db.session.rollback()
+            db.session.info.pop('read_replica', None)
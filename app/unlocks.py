@@ -0,0 +1,87 @@
+"""app/unlocks.py
+
+The pages and quizzes a user has unlocked (been assigned). They are
+loaded in one query the first time they are needed in a request and kept
+for the rest of the request, and for `UNLOCKED_CONTENT_TTL` seconds
+between requests, so checking whether any number of pages or quizzes are
+unlocked doesn't run a query each.
+
+Cached ids are forgotten when the user's assignments change through this
+process. Other processes see the change within the TTL. At most
+`UNLOCKED_CONTENT_CACHE_SIZE` users are kept, and expired ones are
+dropped whenever another is stored.
+"""
+
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from flask import current_app, g
+
+UnlockedIds = namedtuple('UnlockedIds', ['pages', 'quizzes'])
+
+NOTHING_UNLOCKED = UnlockedIds(frozenset(), frozenset())
+
+
+class UnlockedContent(object):
+    """Caches the ids of the pages and quizzes each user has unlocked.
+
+    Paramaters
+    ----------
+    loader : callable
+        Given a user id, returns an `UnlockedIds` from the database
+    """
+
+    def __init__(self, loader):
+        self.loader = loader
+        # {user_id: (expires, UnlockedIds)}, the soonest to expire first
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user):
+        """Returns the `UnlockedIds` of a user (nothing for anonymous
+        users).
+        """
+        if not user.is_authenticated:
+            return NOTHING_UNLOCKED
+        if 'unlocked_ids' not in g:
+            g.unlocked_ids = {}
+        if user.id in g.unlocked_ids:
+            return g.unlocked_ids[user.id]
+
+        ttl = current_app.config.get('UNLOCKED_CONTENT_TTL', 0)
+        now = time.time()
+        with self._lock:
+            expires, ids = self._cache.get(user.id, (0, None))
+        if ids is None or expires <= now:
+            ids = self.loader(user.id)
+            if ttl:
+                self._store(user.id, now + ttl, ids, now)
+        g.unlocked_ids[user.id] = ids
+        return ids
+
+    def _store(self, user_id, expires, ids, now):
+        max_entries = current_app.config.get('UNLOCKED_CONTENT_CACHE_SIZE',
+                                              1024)
+        with self._lock:
+            self._cache[user_id] = (expires, ids)
+            self._cache.move_to_end(user_id)
+            while self._cache:
+                oldest_expires, _ = next(iter(self._cache.values()))
+                if oldest_expires > now and len(self._cache) <= max_entries:
+                    break
+                self._cache.popitem(last=False)
+
+    def forget(self, *user_ids):
+        """Makes the ids of the users be loaded again."""
+        with self._lock:
+            for user_id in user_ids:
+                self._cache.pop(user_id, None)
+        if 'unlocked_ids' in g:
+            for user_id in user_ids:
+                g.unlocked_ids.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+        g.pop('unlocked_ids', None)
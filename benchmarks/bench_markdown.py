@@ -0,0 +1,170 @@
+"""benchmarks/bench_markdown.py
+
+Benchmarks rendering of the custom markdown dialect, including the
+bleach sanitisation done by the models' `generate_new_html` and
+`body_changed` listeners.
+
+Synthetic pages, questions and posts using every custom tag are
+generated (with a fixed seed) at several sizes. Run from the project
+root:
+
+    python benchmarks/bench_markdown.py
+    python benchmarks/bench_markdown.py --sizes 1 10 50 --repeat 10
+
+Sizes are in KB. Results can be written to a file with `--output` to
+compare runs.
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import timeit
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.models import (Glossary, Lesson, Page, PageQuestion, Post,
+                        Question, TeacherNote)
+from app.rendering import renderer
+
+WORDS = ('variable loop function python scratch binary decimal list string '
+         'integer algorithm sprite condition value print input output '
+         'computer program code').split()
+
+
+def sentence(rng, words=12):
+    text = ' '.join(rng.choice(WORDS) for _ in range(words))
+    return text.capitalize() + '.'
+
+
+def paragraph(rng):
+    lines = [sentence(rng) for _ in range(rng.randint(2, 5))]
+    lines[0] = lines[0].replace(WORDS[0], '**{0}**'.format(WORDS[0]), 1)
+    return ' '.join(lines) + ' See http://example.com/{0}'.format(rng.randint(1, 999))
+
+
+def video(rng):
+    return '::video::col-12 col-md-8::16by9::https://www.youtube.com/embed/{0}'.format(rng.randint(1000, 9999))
+
+
+def hints(rng):
+    block = ['::hints::']
+    for _ in range(rng.randint(1, 3)):
+        block.extend(['::hint::', sentence(rng), '`print({0})`'.format(rng.randint(0, 9)), '::/hint::'])
+    block.append('::/hints::')
+    return '\n'.join(block)
+
+
+def drag_and_drop(rng):
+    options = [sentence(rng, 3) for _ in range(rng.randint(2, 5))]
+    return '\n'.join(['::drag-and-drop::'] + options + ['::/drag-and-drop::'])
+
+
+def collapse(rng):
+    body = [sentence(rng) for _ in range(rng.randint(1, 4))]
+    return '\n'.join(['::collapse::' + sentence(rng, 3)] + body + ['::/collapse::'])
+
+
+def glossary_item(rng):
+    return '\n'.join(['::glossary-item::' + rng.choice(WORDS), sentence(rng), '::/glossary-item::'])
+
+
+def code_block(rng):
+    return '```python\nfor i in range({0}):\n    print(i)\n```'.format(rng.randint(1, 10))
+
+
+def table(rng):
+    rows = ['| {0} | {1} |'.format(rng.choice(WORDS), rng.randint(0, 100)) for _ in range(3)]
+    return '\n'.join(['| Name | Value |', '|---|---|'] + rows)
+
+
+BLOCKS = (paragraph, paragraph, paragraph, video, hints, drag_and_drop,
+          collapse, glossary_item, code_block, table)
+
+
+def generate_document(size_kb, seed=0):
+    """Generates markdown of roughly `size_kb` KB using every custom tag."""
+    rng = random.Random(seed)
+    blocks = ['# ' + sentence(rng, 4)]
+    blocks.extend(block(rng) for block in BLOCKS[3:])  # Every tag at least once
+    while sum(len(block) + 2 for block in blocks) < size_kb * 1024:
+        blocks.append(rng.choice(BLOCKS)(rng))
+    return '\n\n'.join(blocks)
+
+
+class Target(object):
+    """Stand-in for a model instance passed to an attribute listener."""
+    id = 1
+    version = 0
+    last_updated = None
+
+
+def listener_cases():
+    """(name, function) for each path that renders markdown on save."""
+    def listener(function):
+        return lambda value: function(Target(), value, None, None)
+    return [
+        ('customTagMarkdown', lambda value: renderer.render(value)),
+        ('Page.generate_new_html', listener(Page.generate_new_html)),
+        ('Question.generate_new_html', listener(Question.generate_new_html)),
+        ('Glossary.generate_new_html (linkify)', listener(Glossary.generate_new_html)),
+        ('Lesson.generate_new_html (clean+linkify)', listener(Lesson.generate_new_html)),
+        ('PageQuestion.generate_new_html (clean+linkify)', listener(PageQuestion.generate_new_html)),
+        ('Post.body_changed (clean+linkify+summary)', listener(Post.body_changed)),
+        ('TeacherNote.body_changed (clean+linkify)', listener(TeacherNote.body_changed)),
+    ]
+
+
+def run(sizes, repeat, number, cached):
+    results = []
+    for size in sizes:
+        document = generate_document(size)
+        for name, function in listener_cases():
+            if not cached:
+                renderer.clear_cache()
+                original_size = renderer.cache_size
+                renderer.cache_size = 0
+            try:
+                timings = timeit.repeat(lambda: function(document),
+                                        repeat=repeat, number=number)
+            finally:
+                if not cached:
+                    renderer.cache_size = original_size
+            timings = [timing / number * 1000 for timing in timings]
+            results.append((size, len(document), name, min(timings),
+                            statistics.median(timings)))
+    return results
+
+
+def format_results(results):
+    lines = ['{0:>7} {1:>9} {2:<48} {3:>10} {4:>10}'.format(
+        'Size KB', 'Chars', 'Case', 'Min ms', 'Median ms')]
+    for size, chars, name, best, median in results:
+        lines.append('{0:>7} {1:>9} {2:<48} {3:>10.2f} {4:>10.2f}'.format(
+            size, chars, name, best, median))
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1, 10, 50],
+                        help='document sizes in KB (default 1 10 50)')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='number of timing runs per case (default 5)')
+    parser.add_argument('--number', type=int, default=3,
+                        help='calls per timing run (default 3)')
+    parser.add_argument('--cached', action='store_true',
+                        help='leave the rendered HTML cache enabled')
+    parser.add_argument('--output', help='also write the results to a file')
+    args = parser.parse_args(argv)
+
+    output = format_results(run(args.sizes, args.repeat, args.number, args.cached))
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+
+
+if __name__ == '__main__':
+    main()
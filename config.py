@@ -10,6 +10,26 @@ class Config(object):
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or \
         'sqlite:///' + os.path.join(basedir, 'jccoder.db')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
-    SQLALCHEMY_COMMIT_ON_TEARDOWN = True
+    SQLALCHEMY_COMMIT_ON_TEARDOWN = False   # Views commit their changes themselves
     BOOTSTRAP_SERVE_LOCAL = True
-    ELASTICSEARCH_URL = os.environ.get('ELASTICSEARCH_URL')
\ No newline at end of file
+    ELASTICSEARCH_URL = os.environ.get('ELASTICSEARCH_URL')
+    ELASTICSEARCH_ASYNC = True     # Index changes from a background thread
+    ELASTICSEARCH_BULK_SIZE = 500  # Documents per bulk request
+    SEARCH_FALLBACK = True  # Use the database's full-text search without Elasticsearch
+    # Where the state of quizzes being taken is kept ('sql' or 'file')
+    QUIZ_SESSION_STORE = os.environ.get('QUIZ_SESSION_STORE') or 'sql'
+    QUIZ_SESSION_DIR = os.environ.get('QUIZ_SESSION_DIR') or \
+        os.path.join(basedir, 'quiz_sessions')
+    QUIZ_SESSION_LIFETIME = 24 * 60 * 60   # Seconds
+    # Where rendered parts of templates are cached ('memory', 'file' or 'none')
+    FRAGMENT_CACHE = os.environ.get('FRAGMENT_CACHE') or 'memory'
+    FRAGMENT_CACHE_SIZE = 256  # Fragments kept by the 'memory' cache
+    FRAGMENT_CACHE_DIR = os.environ.get('FRAGMENT_CACHE_DIR') or \
+        os.path.join(basedir, 'fragment_cache')
+    FRAGMENT_CACHE_MAX_AGE = 24 * 60 * 60  # Seconds fragments are kept by the 'file' cache
+    PASSWORD_HASH_WORKERS = None    # Processes hashing new students' passwords (None for one per CPU, up to 4)
+    UNLOCKED_CONTENT_TTL = 30   # Seconds a user's unlocked pages and quizzes are cached for
+    UNLOCKED_CONTENT_CACHE_SIZE = 1024  # Users whose unlocked pages and quizzes are cached
+    LAST_SEEN_FLUSH_INTERVAL = 60   # Seconds between saving users' last seen times (0 saves them on every request)
+    # Database read-only routes are sent to (None for the main database)
+    SQLALCHEMY_READ_REPLICA_URI = os.environ.get('DATABASE_READ_REPLICA_URL')
\ No newline at end of file
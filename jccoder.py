@@ -1,8 +1,26 @@
 from app import create_app, db
-from app.models import User, Role
+from app.models import Announcement, Lesson, Page, Post, User, Role
+from app.progress import rebuild_progress
 
 app = create_app()
 
 @app.shell_context_processor
 def make_shell_context():
-    return {'db': db, 'User': User, 'Role': Role}
\ No newline at end of file
+    return {'db': db, 'User': User, 'Role': Role}
+
+@app.cli.command('rebuild-progress')
+def rebuild_progress_command():
+    """Rebuilds the student progress rollups from the quiz attempts."""
+    rebuild_progress()
+
+@app.cli.command('purge-quiz-sessions')
+def purge_quiz_sessions_command():
+    """Deletes the state of quizzes that were abandoned."""
+    deleted = app.quiz_session_store.purge(app.config['QUIZ_SESSION_LIFETIME'])
+    print('Deleted {0} quiz sessions'.format(deleted))
+
+@app.cli.command('reindex')
+def reindex_command():
+    """Rebuilds the search indices from the database."""
+    for model in (Announcement, Lesson, Page, Post):
+        model.reindex()
@@ -0,0 +1,68 @@
+"""full text search
+
+Revision ID: a71d3e9b5c04
+Revises: 5b8e1f4c2a97
+Create Date: 2020-01-07 18:40:06.228415
+
+"""
+import sqlite3
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a71d3e9b5c04'
+down_revision = '5b8e1f4c2a97'
+branch_labels = None
+depends_on = None
+
+# Table: searchable columns
+searchable_tables = {
+    'announcements': ['title', 'body'],
+    'lessons': ['title', 'overview'],
+    'pages': ['title', 'text'],
+    'posts': ['title', 'body'],
+}
+
+# Table: columns only stored in the SQLite FTS5 tables (see app/search.py)
+stored_columns = {
+    'pages': ['page_type_id'],
+}
+
+
+def has_fts5():
+    try:
+        sqlite3.connect(':memory:').execute(
+            'CREATE VIRTUAL TABLE fts5_test USING fts5(x)')
+    except sqlite3.OperationalError:
+        return False
+    return True
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'mysql':
+        for table_name, columns in searchable_tables.items():
+            op.create_index('ix_{0}_fulltext'.format(table_name), table_name, columns, unique=False, mysql_prefix='FULLTEXT')
+        return
+    if dialect != 'sqlite' or not has_fts5():
+        return
+    # An FTS5 table for each searchable table, filled with its rows
+    for table_name, columns in searchable_tables.items():
+        stored = stored_columns.get(table_name, [])
+        definitions = columns + [column + ' UNINDEXED' for column in stored]
+        op.execute("CREATE VIRTUAL TABLE search_{0} USING fts5({1}, "
+                   "tokenize = 'porter unicode61')".format(
+                       table_name, ', '.join(definitions)))
+        op.execute('INSERT INTO search_{0} (rowid, {1}) SELECT id, {1} FROM {0}'.format(
+            table_name, ', '.join(columns + stored)))
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'mysql':
+        for table_name in searchable_tables:
+            op.execute('DROP TABLE IF EXISTS search_{0}'.format(table_name))
+        return
+    for table_name in searchable_tables:
+        op.drop_index('ix_{0}_fulltext'.format(table_name), table_name=table_name)